@@ -1,10 +1,12 @@
 from universe_render.camera import Camera, raw_to_clip, clip_to_canvas
-from universe_render.snap_io import from_npy
+from universe_render.snap_io import NpySnapshot, HDF5Snapshot, hdf5_files
 from universe_render.render import render_func_factory
-from universe_render.plot import rho_map # redua
+from universe_render.plot import ImageWriter
 from universe_render.sph_kernels import kernels
 from universe_render.frames import hash_file, read_frame_file, frame_to_camera
 from universe_render.mpi_wrapper import mpi_render_wrap
+from universe_render.sinks import FFmpegSink
+from universe_render.cache import FrameCache
 
 import numpy as np
 import configparser
@@ -22,23 +24,44 @@ data_path = config["paths"]["data_path"]
 frames_path = config["paths"]["frames_path"]
 tmp_path = config["paths"]["tmp_path"]
 file_prefix = config["paths"]["file_prefix"]
+cache_path = config["paths"].get("cache_path", "")
 
 hinv = config["processing"]["hinv"] == "True"
+decomposition = config["processing"].get("decomposition", "particle")
+movie = config["processing"].get("movie", "")
+dtype = np.float32 if config["processing"].get("precision", "float64") == "float32" else np.float64
 if hinv:
     sph_kernel = kernels[config["setting"]["sph_kernel"]+"_hinv"]
 else:
     sph_kernel = kernels[config["setting"]["sph_kernel"]]
 
-render_cpu = render_func_factory(sph_kernel, npix_x, npix_y)
+# a float32 canvas is summed tile by tile in float64, see render_func_factory
+render_cpu = render_func_factory(sph_kernel, dtype=dtype, accumulate="tile" if dtype == np.float32 else "canvas")
 
 if __name__ == "__main__":
     # read frame info
     frames = read_frame_file(frames_path)
     n_frame = frames.shape[0]
     
-    # read particle data
-    pos, hsml, rho, temp = from_npy(data_path)
+    # read particle data, each rank only reads its own particles
+    if data_path.endswith(".hdf5"):
+        from mpi4py import MPI
+        pos, hsml, rho = HDF5Snapshot(data_path).read_local(MPI.COMM_WORLD, dtype=dtype)
+        local = True
+    else:
+        snap = NpySnapshot(data_path)
+        pos, hsml, rho = snap.column("pos"), snap.column("hsml"), snap.column("rho")
+        local = False
     
-    mpi_render_wrap(pos, hsml, rho, frames, render_cpu, npix_x, npix_y, plot_n_save=rho_map)
+    if movie:
+        outputs = dict(sinks=[FFmpegSink(movie, npix_x, npix_y)])
+    else:
+        outputs = dict(plot_n_save=ImageWriter())
+    if cache_path:
+        snap_files = hdf5_files(data_path) if data_path.endswith(".hdf5") else data_path
+        outputs["cache"] = FrameCache(cache_path, snap_files, config["setting"]["sph_kernel"], npix_x, npix_y,
+                                      qty="rho", params={"hinv": hinv, "dtype": np.dtype(dtype).name})
+    mpi_render_wrap(pos, hsml, rho, frames, render_cpu, npix_x, npix_y, local=local,
+                    decomposition=decomposition, reduction="pipeline", dtype=dtype, **outputs)
     
     
\ No newline at end of file
@@ -0,0 +1,69 @@
+import numpy as np
+import hashlib
+import glob
+import os
+import pytest
+
+from universe_render.cache import FrameCache
+from universe_render.frames import hash_file, hash_file_chunks
+from universe_render.render import render_func_factory
+from universe_render.sph_kernels import kernels, get_kernel_table
+from universe_render.benchmarks.synthetic import generators, orbit_frames
+
+npix_x, npix_y = 64, 48
+
+@pytest.fixture
+def snapshot(tmp_path):
+    pos, hsml, rho = generators["halo"](5000, seed=0)
+    filename = str(tmp_path / "snap.bin")
+    with open(filename, "wb") as f:
+        for arr in (pos, hsml, rho):
+            f.write(arr.tobytes())
+    return filename, pos, hsml, rho
+
+def test_hash_file(snapshot):
+    filename = snapshot[0]
+    with open(filename, "rb") as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    assert hash_file(filename) == hash_file(filename, chunk_size=1000) == sha256
+    # many chunks, hashed by any number of threads
+    digests = {hash_file_chunks(filename, chunk_size=1000, n_workers=n_workers) for n_workers in (1, 2, 4)}
+    assert len(digests) == 1 and digests != {hash_file_chunks(filename, chunk_size=999)}
+
+def test_key(snapshot, tmp_path):
+    filename = snapshot[0]
+    frame = orbit_frames(2)[0]
+    caches = [FrameCache(str(tmp_path / "cache"), filename, "cubic_spline_2D", npix_x, npix_y, n_workers=n_workers)
+              for n_workers in (1, 4)]
+    assert caches[0].key(frame) == caches[1].key(frame)
+    assert caches[0].key(frame) != caches[0].key(orbit_frames(2)[1])
+    other = FrameCache(str(tmp_path / "cache"), filename, "cubic_spline_2D", npix_x, npix_y + 1)
+    assert other.key(frame) != caches[0].key(frame)
+
+@pytest.mark.filterwarnings("ignore:No plot_n_save")
+def test_resume(snapshot, tmp_path):
+    from universe_render.mpi_wrapper import mpi_render_wrap
+    filename, pos, hsml, rho = snapshot
+    frames = orbit_frames(4)
+    render_func = render_func_factory(kernels["cubic_spline_2D"], kernel_table=get_kernel_table("cubic_spline_2D"))
+    cache_path = str(tmp_path / "cache")
+    def render(name):
+        tmp = str(tmp_path / name) + "/"
+        os.makedirs(tmp)
+        cache = FrameCache(cache_path, filename, "cubic_spline_2D", npix_x, npix_y)
+        report = mpi_render_wrap(pos, hsml, rho, frames, render_func, npix_x, npix_y, tmp_path=tmp, cache=cache)
+        maps = [np.load(fn) for fn in sorted(glob.glob(tmp + "map_*.npy"))]
+        return report["n_cached"], maps, cache
+    n_cached, ref, cache = render("first")
+    assert n_cached == 0 and len(ref) == len(frames)
+    assert render("second")[0] == len(frames)
+    # an interrupted render: one map is missing, another was cut short
+    keys = cache.keys(frames)
+    os.remove(cache.path(keys[1]))
+    with open(cache.path(keys[2]), "r+b") as f:
+        f.truncate(100)
+    assert not cache.valid(keys[2])
+    n_cached, maps, cache = render("third")
+    assert n_cached == 2
+    assert all(np.array_equal(m, r) for m, r in zip(maps, ref))
+    assert all(cache.valid(key) for key in keys)
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from universe_render.camera import raw_to_clip, clip_to_canvas, raw_to_canvas, ProjectionBuffer
+from universe_render.spatial import ParticleTree
+from universe_render.frames import (frame_to_camera, frames_to_view_project, keyframes_to_all_frames,
+                                    read_frame_file, write_frame_file, get_rotation, construct_q_rot, rotate)
+from universe_render.benchmarks.synthetic import generators, orbit_frames
+
+def keyframes():
+    rng = np.random.default_rng(0)
+    kf = np.zeros((5, 10))
+    kf[:,0] = np.arange(5) * 20.
+    kf[:,1:4] = rng.uniform(-50, 50, (5, 3))
+    kf[:,4:7] = rng.normal(size=(5, 3))
+    # two keyframes looking the same way
+    kf[2,4:7] = kf[1,4:7]
+    kf[:,7:10] = [60, 0.1, 500]
+    return kf
+
+def test_view_project_matrices():
+    frames = keyframes_to_all_frames(keyframes())
+    vps = frames_to_view_project(frames)
+    assert vps.shape == (len(frames), 4, 4)
+    for frame, vp in zip(frames, vps):
+        assert np.allclose(vp, frame_to_camera(frame).view_project_matrix(), rtol=1e-12, atol=1e-12)
+
+def test_slerp_matches_quaternion_loop():
+    pytest.importorskip("quaternion")
+    kf = keyframes()
+    # the quaternion loop of the keyframe interpolation before it was vectorized
+    dirs = []
+    for v_s, v_e in zip(kf[:-1,4:7], kf[1:,4:7]):
+        if (v_s == v_e).all():
+            dirs += [v_s] * 20
+            continue
+        ax, theta = get_rotation(v_s, v_e)
+        q_rot_step = construct_q_rot(ax, theta / 20)
+        v = v_s
+        for _ in range(20):
+            dirs.append(v)
+            v = rotate(v, q_rot_step)
+    frames = keyframes_to_all_frames(kf)
+    assert np.allclose(frames[:,4:7], dirs, rtol=0, atol=1e-12)
+    assert np.array_equal(frames[:,0], np.arange(0., 80.))
+
+def test_frame_file(tmp_path):
+    frames = keyframes_to_all_frames(keyframes())
+    write_frame_file(frames, str(tmp_path / "frames.npy"))
+    assert np.array_equal(read_frame_file(str(tmp_path / "frames.npy")), frames)
+    write_frame_file(frames, str(tmp_path / "frames.txt"))
+    assert np.allclose(read_frame_file(str(tmp_path / "frames.txt")), frames, rtol=1e-6, atol=0)
+
+def test_raw_to_canvas_view_project():
+    # the batched matrix gives the projection of the one computed from the camera, up to rounding
+    pos, hsml, rho = generators["halo"](20000, seed=0)
+    frames = orbit_frames(3)
+    for frame, vp in zip(frames, frames_to_view_project(frames)):
+        cam = frame_to_camera(frame)
+        ref = [np.array(_) for _ in raw_to_canvas(cam, rho, hsml, pos, 64, 48)]
+        w, h, p = raw_to_canvas(cam, rho, hsml, pos, 64, 48, vp=vp)
+        assert len(ref[0]) > 0 and np.array_equal(w, ref[0])
+        assert np.allclose(h, ref[1], rtol=1e-12, atol=0) and np.allclose(p, ref[2], rtol=0, atol=1e-10)
+
+def particles(n, seed=0):
+    # the particle ids as weights, so that the selections can be compared
+    pos, hsml, _ = generators["halo"](n, seed=seed)
+    return pos, hsml, np.arange(n, dtype=float)
+
+@pytest.mark.parametrize("n", [0, 1, 20000])
+def test_tree_selection(n):
+    pos, hsml, ids = particles(max(n, 1))
+    pos, hsml, ids = pos[:n], hsml[:n], ids[:n]
+    tree = ParticleTree(pos, hsml, leaf_size=64)
+    frames = orbit_frames(4)
+    # a narrow field of view, so that most of the tree is culled
+    frames[2:,7] = 15
+    for frame in frames:
+        cam = frame_to_camera(frame)
+        ref = raw_to_clip(cam, ids, hsml, pos, 64, 48)
+        out = raw_to_clip(cam, ids, hsml, pos, 64, 48, tree=tree)
+        assert all(np.array_equal(o, r) for o, r in zip(out, ref))
+    if n > 1:
+        assert len(tree.query(cam, clip_x=64/48)) < n / 2
+    # a particle in front of the camera and one behind it
+    cam = frame_to_camera(orbit_frames(1)[0])
+    for sign, visible in ((1, 1), (-1, 0)):
+        one = cam.pos + sign * 10 * cam.taD_ / np.linalg.norm(cam.taD_)
+        w, h, p = raw_to_clip(cam, np.ones(1), np.ones(1), one[None], 64, 48, tree=ParticleTree(one[None], np.ones(1)))
+        assert len(w) == visible
+
+@pytest.mark.parametrize("n", [0, 1, 20000])
+def test_fused_projection(n):
+    # raw_to_canvas selects the particles of raw_to_clip, and projects them the same up to rounding
+    pos, hsml, ids = particles(max(n, 1))
+    pos, hsml, ids = pos[:n], hsml[:n], ids[:n]
+    tree = ParticleTree(pos, hsml, leaf_size=64)
+    frames = orbit_frames(4)
+    frames[2:,7] = 15
+    # a buffer too small for the first frame, so that the projection resumes after growing it,
+    # and then reused for the frames with fewer particles
+    buf = ProjectionBuffer(capacity=100)
+    for frame in frames:
+        cam = frame_to_camera(frame)
+        w, h, p = raw_to_clip(cam, ids, hsml, pos, 64, 48)
+        h, p = clip_to_canvas(h, p, 64, 48)
+        for out_buf, out_tree in ((buf, None), (None, None), (ProjectionBuffer(), tree)):
+            out = raw_to_canvas(cam, ids, hsml, pos, 64, 48, buf=out_buf, tree=out_tree)
+            assert np.array_equal(out[0], w)
+            assert np.allclose(out[1], h, rtol=1e-12, atol=0) and np.allclose(out[2], p, rtol=0, atol=1e-10)
+        assert np.array_equal(buf.idx[:buf.n], w.astype(np.int64))
+    if n > 1:
+        assert buf.capacity > 100
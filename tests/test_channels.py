@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from universe_render.channels import Channels, WeightedAverage
+from universe_render.render import render_func_factory
+from universe_render.sph_kernels import kernels, get_kernel_table
+
+def particles(n=3000, nx=100, ny=70, seed=4):
+    """
+    Particles in the left half of the canvas only, so that the right half gets no weight.
+    """
+    rng = np.random.default_rng(seed)
+    h = np.exp(rng.uniform(np.log(0.5), np.log(8.), n))
+    p = np.stack([rng.uniform(0, nx / 2 - 20, n), rng.uniform(0, ny, n)], axis=1)
+    rho, temp = rng.uniform(0.5, 2., n), rng.uniform(1e3, 1e5, n)
+    return rho, temp, h, p
+
+@pytest.mark.parametrize("kernel_table", [False, True])
+def test_channels_match_single(kernel_table):
+    rho, temp, h, p = particles()
+    table = get_kernel_table("cubic_spline_2D") if kernel_table else None
+    channels = Channels([rho, WeightedAverage(temp, rho), temp])
+    # rho is shared by the first map and the weight of the average
+    assert (channels.n_column, channels.n_map) == (3, 3)
+    w = np.asarray(channels)
+    assert np.array_equal(w, np.stack([rho, temp * rho, temp], axis=1))
+    canvas = np.zeros((3, 100, 70))
+    render_func_factory(kernels["cubic_spline_2D"], kernel_table=table, n_channel=3)(w, h, p, canvas)
+    singles = []
+    for k in range(3):
+        grid = np.zeros((100, 70))
+        render_func_factory(kernels["cubic_spline_2D"], kernel_table=table)(np.ascontiguousarray(w[:,k]), h, p, grid)
+        singles.append(grid)
+        assert np.array_equal(canvas[k], grid), k
+
+    maps = channels.finalize(canvas)
+    rho_map, avg_map, temp_map = maps
+    assert np.array_equal(rho_map, singles[0]) and np.array_equal(temp_map, singles[2])
+    covered = singles[0] != 0
+    assert covered.any() and not covered.all()
+    assert np.allclose(avg_map[covered], singles[1][covered] / singles[0][covered], rtol=1e-14, atol=0)
+    # the pixels without weight are 0, not nan
+    assert np.all(avg_map[~covered] == 0)
+    # the average stays within the values of temp
+    assert avg_map[covered].min() >= temp.min() * (1 - 1e-12) and avg_map.max() <= temp.max() * (1 + 1e-12)
+
+def test_channels_slice():
+    rho, temp, h, p = particles()
+    channels = Channels([rho, WeightedAverage(temp, rho)])
+    sliced = channels[100:200]
+    assert len(channels) == len(rho) and len(sliced) == 100
+    assert np.array_equal(np.asarray(sliced), np.asarray(channels)[100:200])
@@ -0,0 +1,98 @@
+import numpy as np
+import glob
+import os
+import pytest
+
+from universe_render.mpi_wrapper import WorkScheduler, balance_bins, cost_proj, mpi_render_wrap, mpi_render_tiled
+from universe_render.channels import Channels, WeightedAverage
+from universe_render.render import render_func_factory
+from universe_render.sph_kernels import kernels, get_kernel_table
+from universe_render.benchmarks.synthetic import generators, orbit_frames
+
+class FakeComm(object):
+    """
+    Rank 0 of a communicator of size ranks, whose Allreduce keeps the buffers it is given.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.sent = []
+
+    def Get_rank(self):
+        return 0
+
+    def Get_size(self):
+        return self.size
+
+    def Allreduce(self, send, recv, op=None):
+        self.sent.append(send.copy())
+        recv[:] = send
+
+class FakeMPI(object):
+    SUM = "sum"
+
+def test_rebalance_every():
+    # the rebalance after the second block splits by the cost of both blocks, not only the last one
+    comm = FakeComm(2)
+    npart = 999
+    sched = WorkScheduler(comm, npart, [0, 1, 2], 64, 48, balance="cost", rebalance_every=2, n_bin_per_rank=5)
+    assert (sched.ip_start, sched.ip_end) == (0, 500)
+    blocks = list(sched.blocks())
+    visible = [np.arange(0, 100), np.arange(300, 500)]
+    costs = [np.full(100, 50.), np.full(200, 10.)]
+    for block, idx, cost in zip(blocks[:2], visible, costs):
+        sched.start_block(block)
+        sched.add_cost(0, idx, cost)
+        sched.rebalance(block, FakeMPI)
+    assert len(comm.sent) == 1
+    expected = np.zeros(10)
+    # the projection of the 500 local particles, 100 per bin, for the 2 frames
+    expected[:5] = 2 * cost_proj * 100
+    expected[0] += 5000.
+    expected[3:5] += 1000.
+    assert np.array_equal(comm.sent[0], expected)
+    assert (sched.ip_start, sched.ip_end) == tuple(balance_bins(expected, 100, npart, 2)[:2])
+    # the next rebalance starts from zero
+    assert not sched.bin_cost.any()
+
+@pytest.fixture(scope="module")
+def snapshot():
+    pos, hsml, rho = generators["halo"](5000, seed=0)
+    render_func = render_func_factory(kernels["cubic_spline_2D"], kernel_table=get_kernel_table("cubic_spline_2D"))
+    return pos, hsml, rho, render_func
+
+def render_maps(tmp_path, name, pos, hsml, qty, frames, render_func, **kwargs):
+    tmp = str(tmp_path / name) + "/"
+    os.makedirs(tmp)
+    mpi_render_wrap(pos, hsml, qty, frames, render_func, 64, 48, tmp_path=tmp, **kwargs)
+    return np.array([np.load(fn) for fn in sorted(glob.glob(tmp + "map_*.npy"))])
+
+@pytest.mark.filterwarnings("ignore:No plot_n_save")
+@pytest.mark.parametrize("frame_batch, chunk_size", [(2, None), (3, 1500), (5, 999)])
+def test_frame_batch(snapshot, tmp_path, frame_batch, chunk_size):
+    # every chunk is splatted into the canvases of a block of frames, in the same order
+    pos, hsml, rho, render_func = snapshot
+    frames = orbit_frames(5)
+    ref = render_maps(tmp_path, "ref", pos, hsml, rho, frames, render_func)
+    maps = render_maps(tmp_path, "batch", pos, hsml, rho, frames, render_func,
+                       frame_batch=frame_batch, chunk_size=chunk_size)
+    assert ref.shape == (5, 64, 48) and ref.any()
+    assert np.array_equal(maps, ref)
+
+@pytest.mark.filterwarnings("ignore:No plot_n_save")
+@pytest.mark.parametrize("tile_size", [17, 64])
+@pytest.mark.parametrize("channels", [False, True])
+def test_tiled(snapshot, tmp_path, tile_size, channels):
+    # tiles that do not divide the canvas, and one tile larger than npix_y
+    pos, hsml, rho, render_func = snapshot
+    qty = rho
+    if channels:
+        qty = Channels([rho, WeightedAverage(np.log(rho), rho)])
+        render_func = render_func_factory(kernels["cubic_spline_2D"], kernel_table=get_kernel_table("cubic_spline_2D"),
+                                          n_channel=qty.n_column)
+    frame = orbit_frames(3)[1]
+    ref = render_maps(tmp_path, "ref", pos, hsml, qty, [frame], render_func)[0]
+    filename = str(tmp_path / "tiled.npy")
+    mpi_render_tiled(pos, hsml, qty, frame, render_func, 64, 48, filename, tile_size=tile_size, chunk_size=1500)
+    tiled = np.load(filename)
+    assert tiled.shape == ref.shape and ref.any()
+    assert np.allclose(tiled, ref, rtol=1e-12, atol=1e-12 * np.abs(ref).max())
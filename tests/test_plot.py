@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from universe_render.plot import rho_map, rho_map_fast, ColormapLUT, ImageWriter
+
+matplotlib = pytest.importorskip("matplotlib")
+matplotlib.use("Agg")
+
+def test_lut_matches_rho_map(tmp_path):
+    # a map over and beyond clim, with zeros (log10 is -inf), negative values and nan (bad)
+    rng = np.random.default_rng(0)
+    arr = 10**rng.uniform(-10, -3, (96, 64))
+    arr[::7,::5] = 0.
+    arr[3,4], arr[5,6], arr[8,9] = np.nan, -1e-5, np.inf
+    # the ends of clim
+    arr[10,11], arr[12,13] = 1e-4, 1e-9
+    import matplotlib.image as mpimg
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rho_map(arr, str(tmp_path / "ref.png"), "png")
+    ref = np.round(mpimg.imread(str(tmp_path / "ref.png"))[...,:3] * 255).astype(np.uint8)
+    rgb = ColormapLUT()(arr)
+    assert rgb.shape == ref.shape == (64, 96, 3)
+    assert np.array_equal(rgb, ref)
+    rho_map_fast(arr, str(tmp_path / "fast.png"))
+    writer = ImageWriter()
+    writer(arr, str(tmp_path / "writer.png"))
+    writer.close()
+    for fn in ("fast.png", "writer.png"):
+        assert np.array_equal(np.round(mpimg.imread(str(tmp_path / fn)) * 255).astype(np.uint8), ref)
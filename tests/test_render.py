@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from universe_render.render import render_func_factory
+from universe_render.sph_kernels import kernels, get_kernel_table
+
+def particles(n=2000, nx=100, ny=70, seed=1):
+    """
+    Particles of all sizes from sub-pixel to many tiles, some of them over the canvas edges.
+    """
+    rng = np.random.default_rng(seed)
+    w = rng.uniform(0.5, 2., n)
+    h = np.exp(rng.uniform(np.log(0.3), np.log(20.), n))
+    p = np.stack([rng.uniform(-10, nx + 10, n), rng.uniform(-10, ny + 10, n)], axis=1)
+    return w, h, p
+
+def render(name, w, h, p, shape=(100, 70), **options):
+    use_hinv = name.endswith("_hinv")
+    grid = np.zeros(shape)
+    render_func = render_func_factory(kernels[name], use_hinv=use_hinv, **options)
+    render_func(*([w, h] + ([1. / h] if use_hinv else []) + [p, grid]))
+    return grid
+
+@pytest.mark.filterwarnings("ignore:Using hinv option")
+@pytest.mark.parametrize("kernel_table", [False, True])
+@pytest.mark.parametrize("name", ["cubic_spline_2D", "cubic_spline_2D_hinv"])
+def test_parallel_matches_serial(name, kernel_table):
+    w, h, p = particles()
+    table = get_kernel_table(name) if kernel_table else None
+    serial = render(name, w, h, p, kernel_table=table)
+    parallel = render(name, w, h, p, kernel_table=table, parallel=True, tile_size=16)
+    assert serial.sum() > 0
+    assert np.array_equal(parallel, serial)
+
+@pytest.mark.filterwarnings("ignore:Using hinv option")
+@pytest.mark.parametrize("name", ["cubic_spline_2D", "cubic_spline_2D_hinv"])
+def test_kernel_table(name):
+    # the table is within 1e-5 of the kernel peak, and so is the rendered map of the map maximum
+    assert get_kernel_table(name).error() < 1e-5
+    w, h, p = particles()
+    analytic = render(name, w, h, p)
+    table = render(name, w, h, p, kernel_table=get_kernel_table(name))
+    assert np.abs(table - analytic).max() < 1e-5 * analytic.max()
+
+def test_kernel_table_options():
+    # the tables are cached per options
+    table = get_kernel_table("cubic_spline_2D")
+    coarse = get_kernel_table("cubic_spline_2D", n_bin=64)
+    assert coarse.n_bin == 64 and table.n_bin != 64
+    assert get_kernel_table("cubic_spline_2D", n_bin=64) is coarse
+    assert get_kernel_table("cubic_spline_2D") is table
+
+@pytest.mark.parametrize("kernel_table", [False, True])
+def test_lod_total(kernel_table):
+    # every particle puts w times the integral of the kernel (pi^2 for cubic_spline_2D) on the canvas
+    name = "cubic_spline_2D"
+    table = get_kernel_table(name) if kernel_table else None
+    rng = np.random.default_rng(2)
+    for h in np.geomspace(0.05, 100., 25):
+        n = int(8*h) + 16
+        p = n / 2 + rng.uniform(-0.5, 0.5, (1, 2))
+        grid = render(name, np.array([2.]), np.array([h]), p, shape=(n, n), kernel_table=table, lod=True)
+        assert grid.sum() == pytest.approx(2. * np.pi**2, rel=1e-3), h
+
+def test_float32_accumulate():
+    # many overlapping particles (no sub-pixel ones): the error is that of summing in float32,
+    # which accumulate="tile" leaves to one rounding per pixel
+    w, h, p = particles(n=100000, seed=3)
+    h = 2. + h
+    table = get_kernel_table("cubic_spline_2D")
+    ref = render("cubic_spline_2D", w, h, p, kernel_table=table)
+    args = [_.astype(np.float32) for _ in (w, h, p)]
+    for accumulate, tol in (("canvas", 2e-5), ("tile", 5e-7)):
+        grid = np.zeros(ref.shape, dtype=np.float32)
+        render_func_factory(kernels["cubic_spline_2D"], kernel_table=table, dtype=np.float32,
+                            accumulate=accumulate)(*args, grid)
+        assert np.abs(grid - ref).max() < tol * ref.max(), accumulate
+
+@pytest.mark.parametrize("lod, tol", [(False, 1e-3), (True, 1e-5)])
+def test_float32_projected(lod, tol):
+    # the full path of mpi_render_wrap(..., dtype=np.float32): the snapshot is read in float32,
+    # projected and splatted. Without lod, the sub-pixel particles are point-sampled, and their
+    # float32 positions move the pixels they hit.
+    from universe_render.camera import raw_to_canvas, ProjectionBuffer
+    from universe_render.frames import frame_to_camera
+    from universe_render.benchmarks.synthetic import generators, orbit_frames
+    pos, hsml, rho = generators["uniform"](200000, seed=0)
+    cam = frame_to_camera(orbit_frames(1)[0])
+    table = get_kernel_table("cubic_spline_2D")
+    maps = []
+    for dtype in (np.float64, np.float32):
+        w, h, p = raw_to_canvas(cam, rho.astype(dtype), hsml.astype(dtype), pos.astype(dtype), 160, 120,
+                                buf=ProjectionBuffer(dtype=dtype))
+        grid = np.zeros((160, 120), dtype=dtype)
+        render_func_factory(kernels["cubic_spline_2D"], kernel_table=table, dtype=dtype, lod=lod,
+                            accumulate="tile")(w, h, p, grid)
+        maps.append(grid)
+    assert np.abs(maps[1] - maps[0]).max() < tol * maps[0].max()
@@ -0,0 +1,36 @@
+import numpy as np
+import glob
+import pytest
+
+from universe_render.series import SnapshotSeries, mpi_render_series
+from universe_render.mpi_wrapper import render_frame
+from universe_render.render import render_func_factory
+from universe_render.sph_kernels import kernels, get_kernel_table
+from universe_render.frames import frame_to_camera, frames_to_view_project
+from universe_render.benchmarks.synthetic import generators, orbit_frames
+
+npix_x, npix_y = 64, 48
+
+@pytest.mark.filterwarnings("ignore:No plot_n_save")
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_interpolated_series(tmp_path, prefetch):
+    # the frames between two snapshots are the renders of the blended particles
+    pos, hsml, rho = generators["halo"](5000, seed=0)
+    rng = np.random.default_rng(1)
+    snaps = {"snap_0": (pos, hsml, rho),
+             "snap_1": (pos + rng.normal(0, 0.5, pos.shape), hsml * rng.uniform(0.8, 1.2, len(hsml)), 2 * rho)}
+    series = SnapshotSeries(list(snaps), [0, 4], lambda fn: snaps[fn], interpolate=True, prefetch=prefetch)
+    frames = orbit_frames(6)
+    render_func = render_func_factory(kernels["cubic_spline_2D"], kernel_table=get_kernel_table("cubic_spline_2D"))
+    reports = mpi_render_series(series, frames, render_func, npix_x, npix_y, tmp_path=str(tmp_path) + "/")
+    assert [report["snapshot"] for report in reports] == [0, 1]
+    maps = [np.load(fn) for fn in sorted(glob.glob(str(tmp_path / "map_*.npy")))]
+    assert len(maps) == len(frames)
+
+    data = [snaps["snap_0"], snaps["snap_1"]]
+    for i, (frame, vp) in enumerate(zip(frames, frames_to_view_project(frames))):
+        # frames 4 and 5 show the last snapshot
+        pos_t, hsml_t, rho_t = series.blend(data, i / 4) if i < 4 else data[1]
+        grid = np.zeros((npix_x, npix_y))
+        render_frame(frame_to_camera(frame), pos_t, hsml_t, rho_t, render_func, grid, npix_x, npix_y, vp=vp)
+        assert np.array_equal(maps[i], grid), i
@@ -0,0 +1,71 @@
+import numpy as np
+import time
+import pytest
+
+from universe_render.render import render_func_factory
+from universe_render.sph_kernels import kernels, get_kernel_table
+from universe_render.server import RenderServer, RenderClient
+from universe_render.mpi_wrapper import render_frame
+from universe_render.frames import frame_to_camera
+from universe_render.spatial import ParticleTree
+from universe_render.benchmarks.synthetic import generators, orbit_frames
+
+npix_x, npix_y = 64, 48
+
+@pytest.fixture(scope="module")
+def snapshot():
+    pos, hsml, rho = generators["halo"](20000, seed=0)
+    render_func = render_func_factory(kernels["cubic_spline_2D"], kernel_table=get_kernel_table("cubic_spline_2D"))
+    return pos, hsml, rho, render_func
+
+@pytest.fixture
+def server(snapshot):
+    pos, hsml, rho, render_func = snapshot
+    def slow_render(*args):
+        # long enough for a cancel to arrive while a level is rendered
+        time.sleep(0.3)
+        return render_func(*args)
+    server = RenderServer(pos, hsml, rho, slow_render, npix_x, npix_y, format="map")
+    address = server.start(port=0)
+    client = RenderClient(address, timeout=60)
+    yield client
+    client.close()
+    server.stop()
+
+def test_final_level_matches_render_frame(server, snapshot):
+    pos, hsml, rho, render_func = snapshot
+    frame = orbit_frames(3)[1]
+    responses = list(server.render(frame))
+    assert [response["level"] for response, _ in responses] == [0, 1, 2]
+    response, data = responses[-1]
+    assert response["final"] and response["n_part"] == len(hsml)
+    grid = np.zeros((npix_x, npix_y))
+    render_frame(frame_to_camera(frame), pos, hsml, rho, render_func, grid, npix_x, npix_y, tree=ParticleTree(pos, hsml))
+    assert np.array_equal(data, grid.astype("<f4"))
+
+def test_cancel(server):
+    frame = orbit_frames(3)[1]
+    request_id = server.request(frame)
+    server.cancel(request_id)
+    responses = []
+    while True:
+        response, _ = server.receive()
+        responses.append(response)
+        if response.get("cancelled") or response.get("final"):
+            break
+    assert responses[-1] == {"id": request_id, "cancelled": True}
+    assert len(responses) < 3
+    # the connection still takes requests
+    assert list(server.render(frame, levels=1))[-1][0]["final"]
+
+def test_malformed_request(server):
+    server.sock.sendall(b"not json\n")
+    response, _ = server.receive()
+    assert response["id"] is None and "error" in response
+    server.sock.sendall(b'{"id": 7, "frame": [1, 2]}\n')
+    response, _ = server.receive()
+    assert response["id"] == 7 and "error" in response
+    with pytest.raises(RuntimeError):
+        list(server.render(orbit_frames(1)[0], npix_x=-1, npix_y=10))
+    # the server still renders
+    assert list(server.render(orbit_frames(1)[0], levels=1))[-1][0]["final"]
@@ -0,0 +1,102 @@
+import numpy as np
+import os
+import pytest
+
+from universe_render.sinks import FFmpegSink
+from universe_render.mpi_wrapper import FrameOutput, pack_payload
+
+@pytest.fixture
+def ffmpeg(tmp_path):
+    """
+    A stand-in for ffmpeg writing the raw frames it is given to {filename}.raw.
+    """
+    fn = tmp_path / "ffmpeg"
+    fn.write_text('#!/bin/sh\nout=""; for a in "$@"; do out="$a"; done\ncat > "$out.raw"\n')
+    os.chmod(fn, 0o755)
+    return str(fn)
+
+def frames(n, shape, seed):
+    return np.random.default_rng(seed).integers(0, 256, (n, ) + shape, dtype=np.uint8)
+
+def read_raw(filename, shape):
+    return np.fromfile(filename + ".raw", dtype=np.uint8).reshape((-1, ) + shape)
+
+def test_ffmpeg_sink_order(ffmpeg, tmp_path):
+    filename = str(tmp_path / "movie.mp4")
+    sink = FFmpegSink(filename, 8, 6, ffmpeg=ffmpeg, first_frame=3)
+    rgb = frames(5, sink.shape, 0)
+    for i in (4, 3, 7, 5, 6):
+        sink.write(i, rgb[i-3])
+    sink.close()
+    assert np.array_equal(read_raw(filename, sink.shape), rgb)
+
+def test_ffmpeg_sink_missing(ffmpeg, tmp_path):
+    sink = FFmpegSink(str(tmp_path / "movie.mp4"), 8, 6, ffmpeg=ffmpeg)
+    rgb = frames(3, sink.shape, 0)
+    sink.write(0, rgb[0])
+    sink.write(2, rgb[2])
+    with pytest.raises(RuntimeError, match="Missing frame 1"):
+        sink.close()
+
+class FakeStatus(object):
+    def Get_tag(self):
+        return self.tag
+
+    def Get_source(self):
+        return 1
+
+class FakeComm(object):
+    """
+    Rank 0 of 2 ranks, receiving the given (tag, message) in that order.
+    As in MPI, the messages of one tag from one rank are received in the order they were sent.
+    """
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    def Get_rank(self):
+        return 0
+
+    def Get_size(self):
+        return 2
+
+    def Dup(self):
+        return self
+
+    def Free(self):
+        pass
+
+    def Probe(self, source, tag, status):
+        status.tag = self.messages[0][0]
+
+    def Recv(self, buf, source, tag):
+        i = [t for t, _ in self.messages].index(tag)
+        buf[:] = self.messages.pop(i)[1]
+
+class FakeRequest(object):
+    @staticmethod
+    def Waitall(requests):
+        pass
+
+class FakeMPI(object):
+    ANY_SOURCE, ANY_TAG = -1, -1
+    Status = FakeStatus
+    Request = FakeRequest
+
+def test_ordered_frames(ffmpeg, tmp_path):
+    # two ordered sinks with frames of different sizes, sent by another rank out of order and
+    # interleaved; each sink gets its own frames, in order
+    n_frame, offset = 6, 10
+    sinks = [FFmpegSink(str(tmp_path / "a.mp4"), 8, 6, ffmpeg=ffmpeg, first_frame=offset),
+             FFmpegSink(str(tmp_path / "b.mp4"), 4, 2, ffmpeg=ffmpeg, first_frame=offset)]
+    rgb = [frames(n_frame, sink.shape, seed) for seed, sink in enumerate(sinks)]
+    order = [3, 0, 5, 1, 4, 2]
+    messages = [(tag, pack_payload(frame_id, rgb[tag][frame_id]))
+                for frame_id in order for tag in ((0, 1) if frame_id % 2 else (1, 0))]
+    comm = FakeComm(messages)
+    output = FrameOutput(comm, [None] * n_frame, sinks, lambda canvas: canvas, save_map=False,
+                         frame_offset=offset, MPI=FakeMPI)
+    output.collect()
+    output.close()
+    assert not comm.messages and output.n_ordered == 2 * n_frame
+    for sink, ref in zip(sinks, rgb):
+        assert np.array_equal(read_raw(sink.cmd[-1], sink.shape), ref)
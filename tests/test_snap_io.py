@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from universe_render.snap_io import HDF5Snapshot
+
+h5py = pytest.importorskip("h5py")
+
+class FakeComm(object):
+    def __init__(self, rank, size):
+        self.rank, self.size = rank, size
+
+    def Get_rank(self):
+        return self.rank
+
+    def Get_size(self):
+        return self.size
+
+@pytest.fixture
+def snapshot(tmp_path):
+    """
+    A snapshot of 11 files (so that snap.10 sorts after snap.9), some without gas particles.
+    With 5 ranks and split="file", rank 4 only gets files without gas.
+    """
+    counts = [5, 0, 7, 1, 0, 9, 3, 2, 4, 0, 6]
+    rng = np.random.default_rng(0)
+    n_part = sum(counts)
+    data = {"pos": rng.uniform(0, 1, (n_part, 3)), "hsml": rng.uniform(0.01, 0.1, n_part),
+            "rho": rng.uniform(1, 2, n_part)}
+    start = 0
+    for ifile, count in enumerate(counts):
+        with h5py.File(tmp_path / f"snap_000.{ifile}.hdf5", "w") as f:
+            f.create_group("Header").attrs["NumPart_ThisFile"] = np.array([count, 3, 0, 0, 0, 0])
+            # only dark matter in the files without gas, as written by Gadget
+            f.create_dataset("PartType1/Coordinates", data=rng.uniform(0, 1, (3, 3)))
+            if count > 0:
+                f.create_dataset("PartType0/Coordinates", data=data["pos"][start:start+count])
+                f.create_dataset("PartType0/SmoothingLength", data=data["hsml"][start:start+count])
+                f.create_dataset("PartType0/Density", data=data["rho"][start:start+count])
+            start += count
+    return str(tmp_path / "snap_000.3.hdf5"), data
+
+def test_read(snapshot):
+    filename, data = snapshot
+    snap = HDF5Snapshot(filename)
+    assert snap.n_part == len(data["rho"])
+    for out, name in zip(snap.read(), ("pos", "hsml", "rho")):
+        assert np.array_equal(out, data[name])
+    pos, rho = snap.read(("pos", "rho"), start=4, end=14)
+    assert np.array_equal(pos, data["pos"][4:14]) and np.array_equal(rho, data["rho"][4:14])
+
+@pytest.mark.parametrize("split", ["range", "file"])
+@pytest.mark.parametrize("size", [1, 2, 3, 5])
+def test_read_local(snapshot, split, size):
+    filename, data = snapshot
+    snap = HDF5Snapshot(filename)
+    local = [snap.read_local(FakeComm(rank, size), split=split) for rank in range(size)]
+    if split == "range":
+        index = np.arange(snap.n_part)
+    else:
+        # the files are given to the ranks round-robin
+        index = np.concatenate([np.arange(snap.offsets[ifile], snap.offsets[ifile+1])
+                                for rank in range(size) for ifile in range(rank, len(snap.files), size)])
+    for i, name in enumerate(("pos", "hsml", "rho")):
+        assert np.array_equal(np.concatenate([out[i] for out in local]), data[name][index])
@@ -0,0 +1,88 @@
+import argparse
+import json
+import sys
+
+from .results import save_results, print_results, compare
+
+################
+## Benchmarks ##
+################
+# Note: python -m universe_render.benchmarks stages   [--generator halo] [--n-part N] [--out file]
+#       python -m universe_render.benchmarks scaling  --mode strong --threads 1 2 4 --ranks 1 2 4
+#       python -m universe_render.benchmarks compare  old.json new.json
+#       The results are written as JSON, by default to bench_{kind}_{commit}.json.
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m universe_render.benchmarks",
+                                     description="Benchmarks of universe_render on synthetic snapshots.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def common(p):
+        p.add_argument("--generator", default="halo", help="uniform, halo or wide_hsml")
+        p.add_argument("--n-part", type=int, default=1<<20)
+        p.add_argument("--npix", type=int, nargs=2, default=(320, 240))
+        p.add_argument("--repeat", type=int, default=5)
+        p.add_argument("--seed", type=int, default=0)
+        p.add_argument("--out", default=None, help="the result file, by default bench_{kind}_{commit}.json")
+
+    p = sub.add_parser("stages", help="time every stage of a frame")
+    common(p)
+    p.add_argument("--kernels", nargs="*", default=None, help="the kernels of sph_kernels.kernels, by default all")
+    p.add_argument("--variants", nargs="*", default=None, help="the render variants of stages.variants, by default all")
+    p.add_argument("--stages", nargs="*", default=["project", "mask", "splat", "reduce", "image"])
+
+    p = sub.add_parser("scaling", help="end-to-end strong or weak scaling over threads and MPI ranks")
+    common(p)
+    p.add_argument("--mode", default="strong", choices=["strong", "weak"])
+    p.add_argument("--threads", type=int, nargs="*", default=[1])
+    p.add_argument("--ranks", type=int, nargs="*", default=[1])
+    p.add_argument("--n-frame", type=int, default=8)
+    p.add_argument("--decomposition", default="particle")
+    p.add_argument("--mpirun", default="mpirun", help='e.g. "mpirun --oversubscribe"')
+
+    p = sub.add_parser("e2e", help="one end-to-end run in the current MPI job (used by scaling)")
+    p.add_argument("--n-part", type=int, default=1<<20)
+    p.add_argument("--threads", type=int, default=None)
+    p.add_argument("--json", default="{}", help="further arguments of scaling.bench_e2e as JSON")
+    p.add_argument("--out", default=None)
+
+    p = sub.add_parser("compare", help="compare two result files by benchmark name")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=1.1, help="the ratio of the times reported as slower")
+    p.add_argument("--key", default="median", choices=["median", "min", "mean"])
+
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        regressions = compare(args.old, args.new, args.threshold, args.key)
+        return 1 if regressions else 0
+
+    if args.command == "e2e":
+        from .scaling import bench_e2e
+        config = dict(json.loads(args.json), n_part=args.n_part, threads=args.threads)
+        result = bench_e2e(**config)
+        if result is not None:
+            save_results(args.out, "e2e", config, [result])
+        return 0
+
+    config = {"generator": args.generator, "n_part": args.n_part, "npix_x": args.npix[0],
+              "npix_y": args.npix[1], "repeat": args.repeat, "seed": args.seed}
+    if args.command == "stages":
+        from .stages import bench_stages
+        config.update(kernel_names=args.kernels, variant_names=args.variants, stages=args.stages)
+        results = bench_stages(**config)
+        # with mpirun, the ranks run the same benchmarks, rank 0 writes them
+        if "mpi4py" in sys.modules and sys.modules["mpi4py"].MPI.COMM_WORLD.Get_rank() != 0:
+            return 0
+    else:
+        from .scaling import bench_scaling
+        config.update(mode=args.mode, threads=args.threads, ranks=args.ranks, n_frame=args.n_frame,
+                      decomposition=args.decomposition)
+        results = bench_scaling(mpirun=args.mpirun, **config)
+    print_results(results)
+    print(f"Results written to {save_results(args.out, args.command, config, results)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
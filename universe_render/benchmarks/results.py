@@ -0,0 +1,100 @@
+import numpy as np
+import json
+import os
+import platform
+import subprocess
+import time
+
+#############
+## Results ##
+#############
+# Note: Every benchmark is a dict with a unique "name" and its times in seconds
+#       ("times", and their "min", "median" and "mean"). A result file holds the
+#       environment (with the git commit), the configuration and the benchmarks, so that
+#       two files from different commits can be compared by name, see compare.
+
+def time_call(func, repeat=5, warmup=1):
+    """
+    Call func warmup times (e.g. to compile it), then time repeat calls.
+    """
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t_start)
+    return summarize(times)
+
+def summarize(times):
+    return {"times": list(times), "min": float(np.min(times)), "median": float(np.median(times)),
+            "mean": float(np.mean(times))}
+
+def _git(*args):
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        return subprocess.run(["git", "-C", root] + list(args), capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    """
+    Return the git commit (and whether the tracked files differ from it), the versions and the machine.
+    """
+    import numba
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": _git("rev-parse", "HEAD"), "dirty": None if status is None else bool(status),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "host": platform.node(),
+            "platform": platform.platform(), "python": platform.python_version(),
+            "numpy": np.__version__, "numba": numba.__version__, "n_cpu": os.cpu_count(),
+            "numba_threads": numba.config.NUMBA_NUM_THREADS}
+
+def save_results(filename, kind, config, results):
+    """
+    Write the results to filename as JSON, with the environment. If filename is None, it is
+    bench_{kind}_{commit}.json.
+    ------
+    filename
+    """
+    env = environment()
+    if filename is None:
+        filename = f"bench_{kind}_{(env['commit'] or 'nogit')[:10]}.json"
+    with open(filename, "w") as f:
+        json.dump({"kind": kind, "environment": env, "config": config, "results": results}, f, indent=1)
+    return filename
+
+def print_results(results):
+    scaling = all("speedup" in res for res in results)
+    print(f"{'benchmark':<40}{'median [s]':>12}{'min [s]':>12}" + (f"{'speedup':>10}{'efficiency':>12}" if scaling else ""))
+    for res in results:
+        print(f"{res['name']:<40}{res['median']:>12.4f}{res['min']:>12.4f}"
+              + (f"{res['speedup']:>10.2f}{res['efficiency']:>12.2f}" if scaling else ""))
+
+def compare(old, new, threshold=1.1, key="median"):
+    """
+    Compare two result files by benchmark name and print the ratio new / old of the times.
+    ------
+    old, new  - str. the result files, e.g. of two commits
+    threshold - float. a ratio above it is reported as a regression
+    key       - str. "median", "min" or "mean"
+    ------
+    regressions - list of (name, ratio)
+    """
+    with open(old) as f:
+        old = json.load(f)
+    with open(new) as f:
+        new = json.load(f)
+    old_times = {res["name"]: res[key] for res in old["results"]}
+    print(f"old: {old['environment']['commit']}  new: {new['environment']['commit']}")
+    print(f"{'benchmark':<40}{'old [s]':>12}{'new [s]':>12}{'new/old':>10}")
+    regressions = []
+    for res in new["results"]:
+        if res["name"] not in old_times:
+            continue
+        ratio = res[key] / old_times[res["name"]] if old_times[res["name"]] > 0 else np.inf
+        flag = "  slower" if ratio > threshold else ("  faster" if ratio < 1 / threshold else "")
+        print(f"{res['name']:<40}{old_times[res['name']]:>12.4f}{res[key]:>12.4f}{ratio:>10.3f}{flag}")
+        if ratio > threshold:
+            regressions.append((res["name"], ratio))
+    return regressions
@@ -0,0 +1,122 @@
+import contextlib
+import io
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import warnings
+
+from ..render import render_func_factory
+from ..sph_kernels import kernels, get_kernel_table
+from ..mpi_wrapper import mpi_render_wrap
+from .synthetic import generators, orbit_frames
+from .results import summarize
+
+##################
+## Scaling Runs ##
+##################
+# Note: A scaling run renders a movie of synthetic particles end to end with mpi_render_wrap
+#       (projection, splatting and reduction, without writing the maps) for every number of
+#       threads (numba) and local MPI ranks. Every point runs in its own process, started
+#       with mpirun for more than one rank, so that the thread pool and the MPI job are
+#       fresh. Strong scaling keeps n_part, weak scaling gives n_part to every worker.
+
+def bench_e2e(generator="halo", n_part=1<<20, n_frame=8, npix_x=320, npix_y=240, parallel=True,
+              kernel_table=True, decomposition="particle", repeat=3, seed=0, threads=None, MPI=None):
+    """
+    Render n_frame frames with mpi_render_wrap on the ranks of this MPI job, once to compile
+    and then repeat times.
+    ------
+    threads - int. the number of numba threads, by default all
+    others  - see stages.bench_stages and mpi_render_wrap
+    ------
+    result - dict on rank 0, None on the other ranks
+    """
+    import numba
+    if MPI is None:
+        from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+    rank, size = comm.Get_rank(), comm.Get_size()
+    if threads is not None:
+        numba.set_num_threads(threads)
+    pos, hsml, rho = generators[generator](n_part, seed=seed)
+    frames = orbit_frames(n_frame)
+    name = "cubic_spline_2D"
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        render_func = render_func_factory(kernels[name], parallel=parallel,
+                                          kernel_table=get_kernel_table(name) if kernel_table else None)
+    tmp_path = comm.bcast(tempfile.mkdtemp() if rank == 0 else None, root=0)
+    times = []
+    try:
+        for _ in range(repeat + 1):
+            comm.Barrier()
+            t_start = MPI.Wtime()
+            with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                report = mpi_render_wrap(pos, hsml, rho, frames, render_func, npix_x, npix_y, tmp_path=tmp_path + "/",
+                                         save_map=False, decomposition=decomposition, MPI=MPI)
+            comm.Barrier()
+            times.append(MPI.Wtime() - t_start)
+    finally:
+        comm.Barrier()
+        if rank == 0:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    if rank != 0:
+        return None
+    threads = numba.get_num_threads()
+    result = {"name": f"e2e/{generator}/ranks{size}/threads{threads}", "ranks": size, "threads": threads,
+              "workers": size * threads, "n_part": n_part, "n_frame": n_frame, "compile_run": times[0],
+              "render_time_imbalance": report["render_time_imbalance"]}
+    result.update(summarize(times[1:]))
+    return result
+
+def bench_scaling(mode="strong", threads=(1, ), ranks=(1, ), n_part=1<<20, mpirun="mpirun", **kwargs):
+    """
+    Run bench_e2e for every number of threads and ranks, each in a new process.
+    ------
+    mode    - "strong": n_part particles for all workers,
+              "weak":   n_part particles per worker (threads x ranks).
+    threads - list of int. the numbers of numba threads
+    ranks   - list of int. the numbers of MPI ranks
+    mpirun  - str. the command starting an MPI job, e.g. "mpirun --oversubscribe".
+              It is not used for one rank.
+    kwargs  - passed to bench_e2e, e.g. generator, n_frame, npix_x, npix_y, repeat
+    ------
+    results - list of dict, with the speedup and the parallel efficiency relative to the
+              first point
+    """
+    if mode not in ("strong", "weak"):
+        raise ValueError(f"Unknown mode {mode}. Use 'strong' or 'weak'.")
+    results = []
+    for n_rank in ranks:
+        for n_thread in threads:
+            n = n_part if mode == "strong" else n_part * n_rank * n_thread
+            with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+                out = f.name
+            cmd = [sys.executable, "-m", "universe_render.benchmarks", "e2e", "--n-part", str(n),
+                   "--threads", str(n_thread), "--json", json.dumps(kwargs), "--out", out]
+            if n_rank > 1:
+                cmd = shlex.split(mpirun) + ["-n", str(n_rank)] + cmd
+            # numba cannot start more threads than NUMBA_NUM_THREADS, by default the number of cores
+            env = dict(os.environ, NUMBA_NUM_THREADS=str(n_thread))
+            try:
+                subprocess.run(cmd, check=True, env=env)
+                with open(out) as f:
+                    result = json.load(f)["results"][0]
+            finally:
+                os.remove(out)
+            result["name"] = f"{mode}/{result['name']}"
+            results.append(result)
+            print(f"{mode} ranks {n_rank} threads {n_thread} n_part {n}: {result['median']:.3f} s", flush=True)
+
+    base = results[0]
+    for res in results:
+        ratio = base["median"] / res["median"]
+        workers = res["workers"] / base["workers"]
+        res["speedup"] = ratio if mode == "strong" else ratio * workers
+        res["efficiency"] = ratio / workers if mode == "strong" else ratio
+    return results
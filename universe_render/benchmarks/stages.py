@@ -0,0 +1,110 @@
+import numpy as np
+import warnings
+
+from ..camera import raw_to_clip, clip_to_canvas, raw_to_canvas, ProjectionBuffer
+from ..frames import frame_to_camera
+from ..spatial import ParticleTree
+from ..render import render_func_factory
+from ..sph_kernels import kernels, get_kernel_table
+from ..plot import ColormapLUT, encode_png
+from .synthetic import generators, orbit_frames
+from .results import time_call
+
+######################
+## Stage Benchmarks ##
+######################
+# Note: Every stage of a frame is timed on its own, on one synthetic snapshot seen from
+#       one camera: the projection (numpy, fused, with the tree), the masking, the splatting
+#       for every kernel of sph_kernels.kernels and every render variant, the reduction over
+#       the MPI ranks and the image output. The render functions are compiled by the warm-up call.
+
+variants = {
+    "analytic": {},
+    "table":    {"kernel_table": True},
+    "parallel": {"kernel_table": True, "parallel": True},
+    "lod":      {"kernel_table": True, "lod": True},
+    "float32":  {"kernel_table": True, "dtype": np.float32, "accumulate": "tile"},
+}
+
+def bench_stages(generator="halo", n_part=1<<20, npix_x=320, npix_y=240, repeat=5, kernel_names=None,
+                 variant_names=None, seed=0, stages=("project", "mask", "splat", "reduce", "image")):
+    """
+    Run the stage benchmarks.
+    ------
+    generator     - str. the particle generator in synthetic.generators
+    n_part        - int. the number of particles
+    npix_x        - int. number of pixels along the x axis
+    npix_y        - int. number of pixels along the y axis
+    repeat        - int. the number of timed calls of every benchmark
+    kernel_names  - list of str. the kernels of sph_kernels.kernels to splat with, by default all
+    variant_names - list of str. the render variants (see variants) to splat with, by default all
+    seed          - int. the seed of the particles
+    stages        - the stages to run
+    ------
+    results - list of dict, see results
+    """
+    MPI = None
+    if "reduce" in stages:
+        # started before the threads of the parallel render functions, else some MPI builds hang at exit
+        try:
+            from mpi4py import MPI
+        except ImportError:
+            warnings.warn("mpi4py is not available, the reduction is not benchmarked.")
+    pos, hsml, rho = generators[generator](n_part, seed=seed)
+    cam = frame_to_camera(orbit_frames(1)[0])
+    results = []
+    def add(name, func, n, **extra):
+        results.append(dict(name=name, n_part=n, **time_call(func, repeat), **extra))
+
+    if "project" in stages:
+        add("project/numpy", lambda: clip_to_canvas(*raw_to_clip(cam, rho, hsml, pos, npix_x, npix_y)[1:],
+                                                     npix_x, npix_y), n_part)
+        buf = ProjectionBuffer(dtype=hsml.dtype)
+        add("project/fused", lambda: raw_to_canvas(cam, rho, hsml, pos, npix_x, npix_y, buf=buf), n_part)
+        tree = ParticleTree(pos, hsml)
+        add("project/fused_tree", lambda: raw_to_canvas(cam, rho, hsml, pos, npix_x, npix_y, buf=buf, tree=tree), n_part)
+
+    if "mask" in stages:
+        pos_4 = np.hstack([pos, np.ones((n_part, 1))]).T
+        add("mask/to_mask_clip", lambda: cam.to_mask_clip(rho, hsml, pos_4, clip_x=npix_x/npix_y, clip_y=1), n_part)
+        tree = ParticleTree(pos, hsml)
+        add("mask/tree_query", lambda: tree.query(cam, clip_x=npix_x/npix_y, clip_y=1), n_part)
+
+    # the visible particles on the canvas, as given to the render functions
+    w, h, p = [np.array(_) for _ in raw_to_canvas(cam, rho, hsml, pos, npix_x, npix_y)]
+    if "splat" in stages:
+        for name in (kernels if kernel_names is None else kernel_names):
+            use_hinv = name.endswith("_hinv")
+            for variant in (variants if variant_names is None else variant_names):
+                options = dict(variants[variant])
+                if options.get("kernel_table") is True:
+                    options["kernel_table"] = get_kernel_table(name)
+                dtype = options.get("dtype", np.float64)
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    render_func = render_func_factory(kernels[name], use_hinv=use_hinv, **options)
+                args = [w.astype(dtype), h.astype(dtype)] + ([(1. / h).astype(dtype)] if use_hinv else []) + [p.astype(dtype)]
+                grid = np.zeros((npix_x, npix_y), dtype=dtype)
+                def splat():
+                    grid[:] = 0.
+                    render_func(*args, grid)
+                add(f"splat/{name}/{variant}", splat, len(h), footprint_pixels=int(np.minimum((4*h + 1)**2, npix_x*npix_y).sum()))
+
+    grid = np.zeros((npix_x, npix_y))
+    render_func_factory(kernels["cubic_spline_2D"])(w, h, p, grid)
+    if MPI is not None:
+        comm = MPI.COMM_WORLD
+        recv = np.empty_like(grid)
+        def reduce():
+            comm.Reduce(grid, recv, op=MPI.SUM, root=0)
+        add("reduce/Reduce", reduce, 0, ranks=comm.Get_size(), nbytes=grid.nbytes)
+        def allreduce():
+            comm.Allreduce(grid, recv, op=MPI.SUM)
+        add("reduce/Allreduce", allreduce, 0, ranks=comm.Get_size(), nbytes=grid.nbytes)
+
+    if "image" in stages:
+        lut = ColormapLUT()
+        add("image/lut", lambda: lut(grid), 0)
+        rgb = lut(grid)
+        add("image/png", lambda: encode_png(rgb), 0)
+    return results
@@ -0,0 +1,80 @@
+import numpy as np
+
+#########################
+## Synthetic Snapshots ##
+#########################
+# Note: Seeded particle sets for the benchmarks, so that every run and every commit
+#       renders the same particles without a data file. Every generator returns
+#       pos ndarray([n_part, 3]), hsml ndarray([n_part]) and rho ndarray([n_part]) in a box
+#       [0, box_size)^3, with hsml = eta * (m_part / rho)^(1/3) as from a density estimate.
+
+def _density(hsml, m_part, eta):
+    return m_part * (eta / hsml)**3
+
+def uniform(n_part, box_size=100., eta=1.2, mean_rho=1e-7, seed=0):
+    """
+    Particles uniform in the box, hsml about the mean separation (with a 10% scatter).
+    """
+    rng = np.random.default_rng(seed)
+    pos = rng.uniform(0., box_size, (n_part, 3))
+    hsml = eta * (box_size**3 / n_part)**(1/3) * rng.lognormal(0., 0.1, n_part)
+    return pos, hsml, _density(hsml, box_size**3 * mean_rho / n_part, eta)
+
+def halo(n_part, box_size=100., n_halo=16, f_background=0.2, slope=-1.9, eta=1.2, mean_rho=1e-7, seed=0):
+    """
+    Clustered particles: Hernquist halos with masses dN/dM ~ M^slope over two decades,
+    truncated at 10 scale radii, in a uniform background holding f_background of the particles.
+    The hsml follows the density of the profiles, so it spans several decades from the
+    halo centers to the background.
+    """
+    rng = np.random.default_rng(seed)
+    m_part = box_size**3 * mean_rho / n_part
+    n_background = int(f_background * n_part)
+    a = slope + 1
+    masses = (1. + rng.random(n_halo) * (100.**a - 1.))**(1/a)
+    counts = rng.multinomial(n_part - n_background, masses / masses.sum())
+    centers = rng.uniform(0.1*box_size, 0.9*box_size, (n_halo, 3))
+    scales = 0.02 * box_size * (masses / masses.max())**(1/3)
+
+    # M(<r) / M = r^2 / (r + a)^2, inverted, up to r = 10 a
+    k = np.repeat(np.arange(n_halo), counts)
+    s = np.sqrt(rng.uniform(0., (10/11)**2, len(k)))
+    r = scales[k] * s / (1 - s)
+    direction = rng.normal(size=(len(k), 3))
+    direction /= np.linalg.norm(direction, axis=1)[:,None]
+    pos_halo = np.mod(centers[k] + r[:,None] * direction, box_size)
+    # the mass of the full profiles, so that the truncated ones hold counts particles
+    m_halo = counts * m_part / (10/11)**2
+    rho_background = n_background * m_part / box_size**3
+    rho_halo = m_halo[k] * scales[k] / (2 * np.pi * r * (r + scales[k])**3) + rho_background
+
+    pos = np.vstack([pos_halo, rng.uniform(0., box_size, (n_background, 3))])
+    rho = np.concatenate([rho_halo, np.full(n_background, rho_background)])
+    hsml = eta * (m_part / rho)**(1/3)
+    return pos, hsml, rho
+
+def wide_hsml(n_part, box_size=100., h_min=0.01, h_max=10., mean_rho=1e-7, seed=0):
+    """
+    Particles uniform in the box with hsml log-uniform in [h_min, h_max], e.g. to stress
+    both the sub-pixel and the very large footprints (see render_func_factory(..., lod=True)).
+    """
+    rng = np.random.default_rng(seed)
+    pos = rng.uniform(0., box_size, (n_part, 3))
+    hsml = np.exp(rng.uniform(np.log(h_min), np.log(h_max), n_part))
+    return pos, hsml, _density(hsml, box_size**3 * mean_rho / n_part, 1.)
+
+generators = {"uniform": uniform, "halo": halo, "wide_hsml": wide_hsml}
+
+def orbit_frames(n_frame, box_size=100., distance=0.8, fov=60., n_turn=0.25):
+    """
+    Frames (see frames) on a circle of radius distance * box_size around the center of
+    the box, looking at the center, turning n_turn times over the frames.
+    """
+    phi = 2 * np.pi * n_turn * np.arange(n_frame) / max(n_frame, 1)
+    c = box_size / 2
+    frames = np.zeros((n_frame, 10))
+    frames[:,0] = np.arange(n_frame)
+    frames[:,1], frames[:,2], frames[:,3] = c + distance*box_size*np.cos(phi), c + distance*box_size*np.sin(phi), c
+    frames[:,4], frames[:,5] = -np.cos(phi), -np.sin(phi)
+    frames[:,7], frames[:,8], frames[:,9] = fov, 0.01 * box_size, 10 * box_size
+    return frames
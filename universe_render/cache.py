@@ -0,0 +1,182 @@
+import numpy as np
+import hashlib
+import shutil
+import time
+import glob
+import os
+
+from .frames import hash_file_chunks
+
+#################
+## Frame Cache ##
+#################
+# Note: A rendered map only depends on the snapshot, the frame, the kernel, the
+#       resolution and the quantity. The cache stores every map under the hash of
+#       these, {cache_path}/{key}.npy, so that a render can be resumed after an
+#       interruption, and frames shared between renders are only rendered once.
+#       Entries are written to a temporary file first and then renamed, so an entry
+#       is either complete or missing.
+#       The snapshot is hashed with frames.hash_file_chunks at the fixed snap_chunk_size,
+#       so that the keys only depend on its content, not on how it is hashed.
+
+snap_chunk_size = 1<<24
+
+class FrameCache(object):
+    def __init__(self, cache_path, snapshot, kernel, npix_x, npix_y, qty="rho", params=None,
+                 max_bytes=None, max_age=None, snap_hash=None, n_workers=1, n_map=None):
+        """
+        A content-addressed cache of rendered maps, for mpi_render_wrap(..., cache=...).
+        cache_path: str
+                    the directory of the cache, created if needed.
+        snapshot:   str or list
+                    the snapshot file(s), hashed with frames.hash_file_chunks when the keys
+                    are first needed.
+        kernel:     str or function
+                    the SPH kernel (or its name).
+        npix_x:     int
+        npix_y:     int
+                    the size of the maps.
+        qty:        str
+                    the name of the rendered quantity.
+        params:     dict
+                    any other setting changing the maps, e.g. {"use_hinv": True, "lod": True}.
+        max_bytes:  int
+                    If given, evict() keeps the cache below max_bytes.
+        max_age:    float
+                    If given, evict() removes the entries not used for max_age seconds.
+        snap_hash:  str
+                    the hash of the snapshot, if already known. Then snapshot is not read.
+        n_workers:  int
+                    the number of threads hashing the snapshot. The keys do not depend on it.
+        n_map:      int
+                    the number of maps per frame, when rendering several channels.
+        """
+        self.cache_path = cache_path
+        self.snapshot = [snapshot] if isinstance(snapshot, str) else snapshot
+        self.kernel = kernel if isinstance(kernel, str) else getattr(kernel, "__name__", repr(kernel))
+        self.shape = (npix_x, npix_y) if n_map is None else (n_map, npix_x, npix_y)
+        self.qty = qty
+        self.params = {} if params is None else params
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.snap_hash = snap_hash
+        self.n_workers = n_workers
+        os.makedirs(cache_path, exist_ok=True)
+
+    def hash_snapshot(self):
+        if self.snap_hash is None:
+            h = hashlib.sha256()
+            for fn in self.snapshot:
+                h.update(hash_file_chunks(fn, snap_chunk_size, n_workers=self.n_workers).encode())
+            self.snap_hash = h.hexdigest()
+        return self.snap_hash
+
+    def key(self, frame):
+        """
+        Return the key of the map of a frame.
+        """
+        h = hashlib.sha256()
+        h.update(repr((self.hash_snapshot(), self.kernel, self.shape, self.qty,
+                       sorted(self.params.items()))).encode())
+        h.update(np.ascontiguousarray(frame, dtype=np.float64).tobytes())
+        return h.hexdigest()
+
+    def keys(self, frames, comm=None):
+        """
+        Return the keys of all frames. With comm, the snapshot is only hashed by rank 0.
+        """
+        if comm is not None and self.snap_hash is None:
+            self.snap_hash = comm.bcast(self.hash_snapshot() if comm.Get_rank() == 0 else None, root=0)
+        return [self.key(frame) for frame in frames]
+
+    def path(self, key):
+        return f"{self.cache_path}/{key}.npy"
+
+    def valid(self, key):
+        """
+        Return True if the entry of key exists and is a complete map of the right shape.
+        """
+        fn = self.path(key)
+        try:
+            with open(fn, "rb") as f:
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                offset = f.tell()
+        except (OSError, ValueError):
+            return False
+        return (tuple(shape) == self.shape and not fortran_order
+                and os.path.getsize(fn) == offset + int(np.prod(shape)) * dtype.itemsize)
+
+    def load(self, key):
+        """
+        Load the map of key and mark the entry as used.
+        """
+        fn = self.path(key)
+        os.utime(fn)
+        return np.load(fn)
+
+    def _tmp(self, key):
+        return f"{self.cache_path}/{key}.{os.getpid()}.tmp"
+
+    def store(self, key, arr):
+        """
+        Store a map under key.
+        """
+        tmp = self._tmp(key)
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, self.path(key))
+
+    def store_file(self, key, filename):
+        """
+        Store a map saved as .npy under key, e.g. a map written by the "strip" reduction.
+        """
+        tmp = self._tmp(key)
+        shutil.copyfile(filename, tmp)
+        os.replace(tmp, self.path(key))
+
+    def restore(self, key, filename):
+        """
+        Copy the map of key to filename, e.g. {tmp_path}/map_XXXX.npy, and mark the entry as used.
+        """
+        os.utime(self.path(key))
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        shutil.copyfile(self.path(key), tmp)
+        os.replace(tmp, filename)
+
+    def evict(self, max_bytes=None, max_age=None):
+        """
+        Remove the entries not used for max_age seconds, then the least recently used
+        entries until the cache takes at most max_bytes. By default the limits of the cache.
+        Return the number of removed entries.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_age = self.max_age if max_age is None else max_age
+        entries = []
+        for fn in glob.glob(glob.escape(self.cache_path) + "/*.npy") + glob.glob(glob.escape(self.cache_path) + "/*.tmp"):
+            try:
+                stat = os.stat(fn)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, fn))
+        entries.sort()
+
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        n_removed = 0
+        for mtime, size, fn in entries:
+            too_old = max_age is not None and now - mtime > max_age
+            # temporary files may still be written, and are only removed by age
+            too_big = max_bytes is not None and total > max_bytes and fn.endswith(".npy")
+            if not (too_old or too_big):
+                continue
+            try:
+                os.remove(fn)
+            except OSError:
+                continue
+            total -= size
+            n_removed += 1
+        return n_removed
@@ -1,5 +1,5 @@
 import numpy as np
-from numba import jit
+from numba import njit
 
 class Camera(object):
     def __init__(self, pos, taD, up=np.array([0, 0, 1]), fov=90, zNear=0.1, zFar=5000):
@@ -84,6 +84,30 @@ class Camera(object):
         t1 = np.tan(self.fov / 2)
         return self.project_matrix_sym(r1*self.zNear, t1*self.zNear, self.zNear, self.zFar)
 
+    def view_project_matrix(self):
+        """
+        Return the product of the project matrix and the look at matrix,
+        which converts the 4-position in the coordinate space into the clip space.
+        """
+        return self.project_matrix_from_fov() @ self.look_at_matrix()
+
+    def frustum_planes(self, clip_x=1, clip_y=1, vp=None):
+        """
+        Return the planes of the view frustum in the coordinate space as np.array([6, 4]).
+        A 4-position X is inside the region selected by self.to_mask_clip iff planes @ X > 0.
+        The planes are normalized so that planes @ X is the distance to the plane.
+        clip_x: float
+        clip_y: float
+                the x-y region for render, see self.to_mask_clip
+        vp:     np.array([4, 4])
+                self.view_project_matrix(), if it is already computed.
+        """
+        M = self.view_project_matrix() if vp is None else vp
+        planes = np.array([M[3]*clip_x + M[0], M[3]*clip_x - M[0],
+                           M[3]*clip_y + M[1], M[3]*clip_y - M[1],
+                           M[3]        + M[2], M[3]        - M[2]])
+        return planes / np.linalg.norm(planes[:,0:3], axis=1)[:,None]
+
     def to_clip(self, h, pos_4):
         """
         Convert the particle 4-position & hsml in the scene into the clip space.
@@ -132,7 +156,7 @@ class Camera(object):
     def norm(cls, vec):
         return vec / np.sum(vec**2.)**.5
 
-def raw_to_clip(c, weight, hsml, pos, npix_x, npix_y):
+def raw_to_clip(c, weight, hsml, pos, npix_x, npix_y, tree=None):
     """
     a wrapper to convert the particle data to masked clip space.
     ------
@@ -143,11 +167,16 @@ def raw_to_clip(c, weight, hsml, pos, npix_x, npix_y):
     
     npix_x - int. number of pixels along the x axis
     npix_y - int. number of pixels along the y axis
+    tree   - spatial.ParticleTree built over pos. If given, only the particles
+             in the tree nodes overlapping the frustum are projected.
     ------
     w - ndarray([n_part_masked]) the quantity to map on the clip space after the mask
     h - ndarray([n_part_masked]) the size of particles on the clip space after the mask
     p - ndarray([n_part_masked, 2]) the position of particels on the clip space after the mask
     """
+    if tree is not None:
+        idx = tree.query(c, clip_x=npix_x/npix_y, clip_y=1)
+        weight, hsml, pos = weight[idx], hsml[idx], pos[idx]
     n_part = len(hsml)
     pos_4 = np.hstack([pos, np.ones(shape=(n_part, 1))]).T
     w, h, p, _ = c.to_mask_clip(weight, hsml, pos_4, clip_x=npix_x/npix_y, clip_y=1)
@@ -170,5 +199,171 @@ def clip_to_canvas(h, p, npix_x, npix_y):
     h_index = h * npix_y / 2
     p_index = p * npix_y / 2 + np.array([npix_x/2, npix_y/2])
     return h_index, p_index
-    
-    
\ No newline at end of file
+
+
+##################
+## Camera Paths ##
+##################
+# Note: The functions below give the same matrices as Camera for F cameras at once,
+#       with the camera parameters stacked along the first axis.
+
+def look_at_matrices(pos, taD, up=np.array([0, 0, 1])):
+    """
+    Return the look at matrices of F cameras as ndarray([F, 4, 4]), see Camera.look_at_matrix.
+    ------
+    pos - ndarray([F, 3]) the positions of the cameras
+    taD - ndarray([F, 3]) the directions the cameras point to
+    up  - ndarray([3]) or ndarray([F, 3]) the "up" axis
+    """
+    norm = lambda vec: vec / np.sum(vec**2., axis=1)[:,None]**.5
+    taD = norm(-np.asarray(taD, dtype=float))
+    riD = norm(np.cross(up, taD))
+    upD = norm(np.cross(taD, riD))
+    M = np.zeros((len(taD), 4, 4))
+    M[:,0,:3], M[:,1,:3], M[:,2,:3] = riD, upD, taD
+    M[:,:3,3] = -(M[:,:3,0]*pos[:,0:1] + M[:,:3,1]*pos[:,1:2] + M[:,:3,2]*pos[:,2:3])
+    M[:,3,3] = 1
+    return M
+
+def project_matrices_from_fov(fov, zNear, zFar):
+    """
+    Return the project matrices of F cameras as ndarray([F, 4, 4]), see Camera.project_matrix_from_fov.
+    ------
+    fov   - ndarray([F]) field-of-view in degree
+    zNear - ndarray([F])
+    zFar  - ndarray([F])
+    """
+    fov = np.asarray(fov, dtype=float) / 180 * np.pi
+    n, f = np.asarray(zNear, dtype=float), np.asarray(zFar, dtype=float)
+    r = np.tan(fov / 2) * n
+    t = np.tan(fov / 2) * n
+    M = np.zeros((len(fov), 4, 4))
+    M[:,0,0] = 2*n/(r+r)
+    M[:,1,1] = 2*n/(t+t)
+    M[:,2,2] = -(f+n)/(f-n)
+    M[:,2,3] = -2*f*n/(f-n)
+    M[:,3,2] = -1
+    return M
+
+def view_project_matrices(pos, taD, fov, zNear, zFar, up=np.array([0, 0, 1])):
+    """
+    Return the view-project matrices of F cameras as ndarray([F, 4, 4]), see Camera.view_project_matrix.
+    """
+    P = project_matrices_from_fov(fov, zNear, zFar)
+    V = look_at_matrices(pos, taD, up)
+    # P @ V, with the zeros of P skipped
+    M = np.empty_like(V)
+    M[:,0] = P[:,0,0:1] * V[:,0]
+    M[:,1] = P[:,1,1:2] * V[:,1]
+    M[:,2] = P[:,2,2:3] * V[:,2] + P[:,2,3:4] * V[:,3]
+    M[:,3] = -V[:,2]
+    return M
+
+
+##########################
+## Fused Projection Path ##
+##########################
+# Note: raw_to_canvas does the same as raw_to_clip + clip_to_canvas in one pass
+#       over the particles, without any full-length temporary array.
+
+class ProjectionBuffer(object):
+    def __init__(self, capacity=0, dtype=float):
+        """
+        Preallocated buffers for the output of raw_to_canvas, reusable across frames.
+        The buffers grow on demand to hold the visible particles.
+        capacity: int
+                  the initial number of particles the buffers can hold.
+        dtype:    the dtype of w, h and p, e.g. np.float32 for a float32 render function.
+                  The projection itself is computed in float64.
+        """
+        self.n = 0
+        self.dtype = dtype
+        self.resize(capacity)
+
+    def resize(self, capacity, keep=0):
+        """
+        Reallocate the buffers for capacity particles, keeping the first keep of them.
+        """
+        old = (self.w, self.h, self.p, self.idx) if keep else ()
+        self.capacity = capacity
+        self.w   = np.empty(capacity, dtype=self.dtype)
+        self.h   = np.empty(capacity, dtype=self.dtype)
+        self.p   = np.empty((capacity, 2), dtype=self.dtype)
+        self.idx = np.empty(capacity, dtype=np.int64)
+        for new, arr in zip((self.w, self.h, self.p, self.idx), old):
+            new[:keep] = arr[:keep]
+
+@njit(nogil=True, cache=True)
+def _project_to_canvas(M, tan_half_fov, weight, hsml, pos, idx, use_idx, clip_x, clip_y,
+                       npix_x, npix_y, out_w, out_h, out_p, out_idx, start, n):
+    """
+    Project the particles from start on and write the visible ones into the outputs from n on.
+    Stop at the first visible particle that does not fit and return (n, k): the number of
+    particles written and the particle to resume from, which is n_part when all are done.
+    """
+    n_part = idx.size if use_idx else hsml.size
+    capacity = out_w.size
+    clip = np.empty(4)
+    for k in range(start, n_part):
+        ip = idx[k] if use_idx else k
+        x, y, z = pos[ip, 0], pos[ip, 1], pos[ip, 2]
+        for a in range(4):
+            clip[a] = M[a, 0]*x + M[a, 1]*y + M[a, 2]*z + M[a, 3]
+        cx, cy, cz = clip[0] / clip[3], clip[1] / clip[3], clip[2] / clip[3]
+        if not ((cx > -clip_x) and (cx < clip_x) and (cy > -clip_y) and (cy < clip_y) and (cz > -1) and (cz < 1)):
+            continue
+        if n == capacity:
+            return n, k
+        out_w[n] = weight[ip]
+        # the last row of M is minus the view z, so clip[3] is the depth
+        out_h[n] = hsml[ip] / abs(clip[3]) / tan_half_fov * npix_y / 2
+        out_p[n, 0] = cx * npix_y / 2 + npix_x / 2
+        out_p[n, 1] = cy * npix_y / 2 + npix_y / 2
+        out_idx[n] = ip
+        n += 1
+    return n, n_part
+
+def raw_to_canvas(c, weight, hsml, pos, npix_x, npix_y, buf=None, tree=None, vp=None):
+    """
+    a fused equivalent of raw_to_clip followed by clip_to_canvas.
+    The particles are streamed once and the visible ones are written into buf.
+    ------
+    c - camera.Camera object
+    pos  - ndarray([n_part, 3]) position of particles
+    hsml - ndarray([n_part]) "size" of particles
+    weight - ndarray([n_part]) the quantity to map on the canvas,
+             or ndarray([n_part, K]) for several quantities
+
+    npix_x - int. number of pixels along the x axis
+    npix_y - int. number of pixels along the y axis
+    buf    - ProjectionBuffer to write into. Reuse it across frames to avoid allocation.
+    tree   - spatial.ParticleTree built over pos, see raw_to_clip
+    vp     - ndarray([4, 4]) c.view_project_matrix(), e.g. a row of frames.frames_to_view_project.
+             Pass it when the same camera projects several chunks, so it is computed once.
+    ------
+    w       - ndarray([n_part_masked]) the quantity to map on the canvas after the mask
+    h_index - ndarray([n_part_masked])
+    p_index - ndarray([n_part_masked, 2])
+    The outputs are views of buf; buf.idx[:buf.n] holds the indices of the visible particles.
+    """
+    vp = c.view_project_matrix() if vp is None else vp
+    if tree is not None:
+        idx, use_idx = tree.query(c, clip_x=npix_x/npix_y, clip_y=1, vp=vp), True
+    else:
+        idx, use_idx = np.empty(0, dtype=np.int64), False
+    n_part = idx.size if use_idx else hsml.size
+    if buf is None:
+        # a new buffer can hold all the candidates, so the particles are projected in one pass
+        buf = ProjectionBuffer(n_part, dtype=hsml.dtype)
+    # several quantities are gathered by the indices of the visible particles
+    args = (np.ascontiguousarray(vp, dtype=float), np.tan(c.fov/2),
+            weight if weight.ndim == 1 else hsml, hsml, pos, idx, use_idx, npix_x/npix_y, 1., npix_x, npix_y)
+    n, k = _project_to_canvas(*args, buf.w, buf.h, buf.p, buf.idx, 0, 0)
+    while k < n_part:
+        # the buffer is full: grow it (up to the particles left) and resume from there
+        buf.resize(min(n + n_part - k, 2 * buf.capacity + 1024), keep=n)
+        n, k = _project_to_canvas(*args, buf.w, buf.h, buf.p, buf.idx, k, n)
+    buf.n = n
+    w = buf.w[:n] if weight.ndim == 1 else weight[buf.idx[:n]]
+    return w, buf.h[:n], buf.p[:n]
+
@@ -0,0 +1,92 @@
+import numpy as np
+
+##############
+## Channels ##
+##############
+# Note: Several quantities can be rendered in one pass over the particles, onto a
+#       canvas ndarray([K, npix_x, npix_y]), see render_func_factory(..., n_channel=K).
+#       Channels describes the maps to produce, reads the K rendered columns of
+#       the particles, and converts the reduced canvas into the maps.
+
+class WeightedAverage(object):
+    def __init__(self, qty, weight):
+        """
+        The map of qty averaged with weight, sum(W*weight*qty) / sum(W*weight),
+        where W is the kernel. E.g. WeightedAverage(temp, rho) for the mass-weighted temperature.
+        qty:    ndarray([n_part, ])
+        weight: ndarray([n_part, ])
+        """
+        self.qty = qty
+        self.weight = weight
+
+class Channels(object):
+    def __init__(self, maps):
+        """
+        The maps rendered together, to be passed as qty to mpi_render_wrap.
+        maps: list of ndarray([n_part, ]) or WeightedAverage
+              An array is rendered as it is. The arrays can be lazy views,
+              e.g. snap_io.NpySnapshot.column; pass the same object to share a column,
+              e.g. the density and the weight of a density-weighted average.
+        self.n_column is the number of rendered columns, i.e. the n_channel of the render function,
+        and self.n_map the number of maps.
+        """
+        self.sources = []
+        self.columns = []   # (i_source, ) or (i_qty, i_weight) for the product
+        self.maps = []      # (i_column, i_weight_column or None)
+        for m in maps:
+            if isinstance(m, WeightedAverage):
+                i_weight = self._column((self._source(m.weight), ))
+                i_prod = self._column((self._source(m.qty), self._source(m.weight)))
+                self.maps.append((i_prod, i_weight))
+            else:
+                self.maps.append((self._column((self._source(m), )), None))
+        self.n_column = len(self.columns)
+        self.n_map = len(self.maps)
+
+    def _source(self, arr):
+        for i, src in enumerate(self.sources):
+            if src is arr:
+                return i
+        self.sources.append(arr)
+        return len(self.sources) - 1
+
+    def _column(self, column):
+        if column not in self.columns:
+            self.columns.append(column)
+        return self.columns.index(column)
+
+    def __len__(self):
+        return len(self.sources[0])
+
+    def __getitem__(self, s):
+        """
+        Return the Channels of the particles s (a slice), still lazy.
+        """
+        sliced = object.__new__(Channels)
+        sliced.__dict__.update(self.__dict__)
+        sliced.sources = [src[s] for src in self.sources]
+        return sliced
+
+    def __array__(self, dtype=None, copy=None):
+        """
+        Read the columns as ndarray([n_part, n_column]).
+        """
+        sources = [np.asarray(src, dtype=float) for src in self.sources]
+        out = np.empty((len(sources[0]), self.n_column), dtype=float if dtype is None else dtype)
+        for ic, column in enumerate(self.columns):
+            out[:,ic] = sources[column[0]] if len(column) == 1 else sources[column[0]] * sources[column[1]]
+        return out
+
+    def finalize(self, canvas):
+        """
+        Convert a canvas ndarray([n_column, npix_x, npix_y]) into the maps ndarray([n_map, npix_x, npix_y]).
+        A weighted average is 0 where the weight is 0.
+        """
+        out = np.empty((self.n_map, ) + canvas.shape[1:], dtype=canvas.dtype)
+        for im, (ic, iw) in enumerate(self.maps):
+            if iw is None:
+                out[im] = canvas[ic]
+            else:
+                np.divide(canvas[ic], canvas[iw], out=out[im], where=canvas[iw] != 0)
+                out[im][canvas[iw] == 0] = 0.
+        return out
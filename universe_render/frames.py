@@ -1,8 +1,8 @@
 import numpy as np
-import quaternion
-from scipy.interpolate import interp1d
 import hashlib
-from .camera import Camera
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .camera import Camera, view_project_matrices
 
 ############
 ## Frames ##
@@ -11,28 +11,58 @@ from .camera import Camera
 #       all the parameter for creation of new camera object.
 #       Frame  = (t, posx, posy, posz, dirx, diry, dirz, fov, n, f)
 #       Frames = list of frames
+#       scipy and numpy-quaternion are only needed for the keyframe interpolation
+#       and the quaternion rotations, and are imported when they are used.
 
 # to determine the prefix in the saved files
-def hash_file(filename):
-    """"This function returns the SHA-1 hash
-    of the file passed into it"""
-
+def hash_file(filename, chunk_size=1<<24):
+    """
+    This function returns the SHA-256 hash of the file passed into it,
+    reading it in chunks of chunk_size bytes.
+    """
     # make a hash object
     h = hashlib.sha256()
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
 
-    # open file for reading in binary mode
-    with open(filename,'rb') as file:
+    # open file for reading in binary mode, without buffering
+    with open(filename, 'rb', buffering=0) as file:
 
         # loop till the end of the file
-        chunk = 0
-        while chunk != b'':
-            # read only 1024 bytes at a time
-            chunk = file.read(1024)
-            h.update(chunk)
+        while True:
+            n = file.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
 
     # return the hex representation of digest
     return h.hexdigest()
 
+def hash_file_chunks(filename, chunk_size=1<<24, n_workers=1):
+    """
+    Return the SHA-256 hash of the size, chunk_size and the SHA-256 digests of the chunks
+    of chunk_size bytes of the file. Unlike hash_file, the chunks can be hashed in
+    n_workers parallel threads, and the hash only depends on the content and chunk_size.
+    """
+    # hashlib releases the GIL on large updates, so threads hash the chunks in parallel
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        def hash_chunk(offset):
+            return hashlib.sha256(os.pread(fd, chunk_size, offset)).digest()
+        offsets = range(0, size, chunk_size)
+        if n_workers > 1:
+            with ThreadPoolExecutor(n_workers) as pool:
+                digests = list(pool.map(hash_chunk, offsets))
+        else:
+            digests = [hash_chunk(offset) for offset in offsets]
+    finally:
+        os.close(fd)
+    h = hashlib.sha256(f"{size}:{chunk_size}:".encode())
+    for digest in digests:
+        h.update(digest)
+    return h.hexdigest()
+
 # convert frame into to a camera object
 def frame_to_camera(frame):
     """
@@ -50,20 +80,38 @@ def frame_to_camera(frame):
 # frame io
 def read_frame_file(filename):
     """
-    Read frames from a given file.
+    Read frames from a given file, written by write_frame_file.
+    A .npy file is read as the binary format, any other as text.
     """
-    with open(filename) as f:
-        lines = f.readlines()[1:]
-    return np.array([[float(_) for _ in line.split()] for line in lines])
+    if filename.endswith(".npy"):
+        return np.load(filename)
+    return np.loadtxt(filename, skiprows=1, ndmin=2)
 
 def write_frame_file(frames, filename):
     """
     Write frames into a given file.
+    A .npy file is written in the binary format, ndarray([n_frame, 10]) of float64,
+    which is exact and compact. Any other file is written as text.
     """
+    frames = np.asarray(frames, dtype=float)
+    if filename.endswith(".npy"):
+        np.save(filename, frames)
+        return
     with open(filename, "w") as f:
         f.write("# t, posx, posy, posz, dirx, diry, dirz, fov, n, f\n")
-        for frame in frames:
-            f.write("{:=+8E} {:=+8E} {:=+8E} {:=+8E} {:=+8E} {:=+8E} {:=+8E} {:=+8E} {:=+8E} {:=+8E}\n".format(*frame))
+        # the same as "{:=+8E}" for every value, formatted in blocks of lines
+        line = " ".join(["%+E"] * frames.shape[1]) + "\n"
+        for i in range(0, len(frames), 4096):
+            block = frames[i:i+4096]
+            f.write((line * len(block)) % tuple(block.ravel()))
+
+def frames_to_view_project(frames, up=np.array([0, 0, 1])):
+    """
+    Return the view-project matrices of all frames as ndarray([n_frame, 4, 4]),
+    the same as frame_to_camera(frame).view_project_matrix() for every frame up to rounding.
+    """
+    frames = np.asarray(frames, dtype=float)
+    return view_project_matrices(frames[:,1:4], frames[:,4:7], frames[:,7], frames[:,8], frames[:,9], up)
 
 # frame interpolation
 def keyframes_to_all_frames(kf, timestep=1, loop=False, kind="cubic"):
@@ -76,29 +124,18 @@ def keyframes_to_all_frames(kf, timestep=1, loop=False, kind="cubic"):
         kf0[0] = dt + kf[-1, 0]
         kf = np.vstack([kf, kf0])
     
-    n_kf = kf.shape[0]
     time = kf[:,0]
-    posc = kf[:,1:4]
     dirc = kf[:,4:7]
-    fovc = kf[:,7:8]
-    neac = kf[:,8:9]
-    farc = kf[:,9:10]
 
+    # pos, fov, near and far are interpolated together, the directions by rotation
+    from scipy.interpolate import interp1d
     time_interp = np.arange(time[0], time[-1], timestep)
-    posc_interp = interp1d(time, posc, kind=kind, axis=0)(time_interp)
-    dirc_interp = []
-    for i in range(n_kf-1):
-        v_s, v_e = dirc[i], dirc[i+1]
-        nstep = int((time[i+1]-time[i]) / timestep)
-        dirc_interp += interp_rot(v_s, v_e, nstep)
-    dirc_interp = np.array(dirc_interp)
-    fovc_interp = interp1d(time, fovc, kind=kind, axis=0)(time_interp)
-    neac_interp = interp1d(time, neac, kind=kind, axis=0)(time_interp)
-    farc_interp = interp1d(time, farc, kind=kind, axis=0)(time_interp)
+    other = interp1d(time, kf[:,[1, 2, 3, 7, 8, 9]], kind=kind, axis=0)(time_interp)
+    dirc_interp = slerp_dirs(time, dirc, time_interp)
     
     time_interp = np.expand_dims(time_interp, 1)
 
-    return np.hstack([time_interp, posc_interp, dirc_interp, fovc_interp, neac_interp, farc_interp])
+    return np.hstack([time_interp, other[:,0:3], dirc_interp, other[:,3:6]])
 
 # supporting functions
 def get_rotation(v1, v2):
@@ -111,22 +148,53 @@ def get_rotation(v1, v2):
     return ax, theta
 
 def construct_q_rot(ax, theta):
+    import quaternion  # registers np.quaternion
     return np.quaternion(np.cos(theta/2), ax[0]*np.sin(theta/2), ax[1]*np.sin(theta/2), ax[2]*np.sin(theta/2))
 
 def rotate(v, q_rot):
+    import quaternion  # registers np.quaternion
     q_v  = np.quaternion(0, v[0], v[1], v[2])
     q_vv = q_rot * q_v * q_rot.conjugate()
     return np.array([q_vv.x, q_vv.y, q_vv.z])
 
+def get_rotations(v1, v2):
+    """
+    get_rotation for ndarray([n, 3]) of vectors. For parallel vectors, theta = 0
+    (or pi if opposite) about an axis perpendicular to v1.
+    """
+    v1 = v1 / np.linalg.norm(v1, axis=1)[:,None]
+    v2 = v2 / np.linalg.norm(v2, axis=1)[:,None]
+    ax = np.cross(v1, v2)
+    ax_norm = np.linalg.norm(ax, axis=1)
+    # exactly 0 for equal vectors, and accurate near 0 and pi, unlike arccos of the dot product
+    theta = np.arctan2(ax_norm, np.sum(v1*v2, axis=1))
+    parallel = ax_norm == 0
+    if parallel.any():
+        # any axis perpendicular to v1
+        e = np.where(np.abs(v1[parallel,0:1]) < 0.9, [[1., 0., 0.]], [[0., 1., 0.]])
+        ax[parallel] = np.cross(v1[parallel], e)
+        ax_norm[parallel] = np.linalg.norm(ax[parallel], axis=1)
+    ax = ax / ax_norm[:,None]
+    return ax, theta
+
+def rotate_rodrigues(v, ax, phi):
+    """
+    Rotate the vectors v (ndarray([n, 3])) about the unit axes ax (ndarray([n, 3]))
+    by the angles phi (ndarray([n])), the same rotation as rotate(v, construct_q_rot(ax, phi)).
+    """
+    cos, sin = np.cos(phi)[:,None], np.sin(phi)[:,None]
+    return v*cos + np.cross(ax, v)*sin + ax*np.sum(ax*v, axis=1)[:,None]*(1 - cos)
+
+def slerp_dirs(time, dirc, time_interp):
+    """
+    Rotate the directions dirc (ndarray([n_kf, 3])) at the times time to the times time_interp,
+    at a constant angular speed between two keyframes. Vectorized over all time_interp.
+    """
+    time, dirc, time_interp = [np.asarray(_, dtype=float) for _ in (time, dirc, time_interp)]
+    seg = np.clip(np.searchsorted(time, time_interp, side="right") - 1, 0, len(time) - 2)
+    frac = (time_interp - time[seg]) / (time[seg+1] - time[seg])
+    ax, theta = get_rotations(dirc[:-1], dirc[1:])
+    return rotate_rodrigues(dirc[seg], ax[seg], frac * theta[seg])
+
 def interp_rot(v_s, v_e, nstep):
-    if (v_s == v_e).all():
-        return [v_s, ] * nstep
-    ax, theta = get_rotation(v_s, v_e)
-    theta_step = theta / nstep
-    q_rot_step = construct_q_rot(ax, theta_step)
-    v_interp = v_s
-    v_interp_list = []
-    for _ in range(nstep):
-        v_interp_list.append(v_interp)
-        v_interp = rotate(v_interp, q_rot_step)
-    return v_interp_list
\ No newline at end of file
+    return list(slerp_dirs([0, 1], [v_s, v_e], np.arange(nstep) / nstep))
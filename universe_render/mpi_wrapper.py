@@ -1,43 +1,771 @@
-from mpi4py import MPI
 import numpy as np
 import sys
+import os
+import io
+import time
 
-from .camera import raw_to_clip, clip_to_canvas
-from .frames import frame_to_camera
+from .camera import raw_to_clip, clip_to_canvas, raw_to_canvas, ProjectionBuffer
+from .render import bin_to_tiles
+from .frames import frame_to_camera, frames_to_view_project
+from .spatial import ParticleTree
+from .snap_io import local_range
+from .sinks import MapSink, ImageSink
+from .channels import Channels
+from .profiling import NoProfiler
 
 import warnings
 
 
-def mpi_render_wrap(pos, hsml, qty, frames, render_func, npix_x, npix_y, use_hinv=False,
+def render_frame(cam, pos, hsml, qty, render_func, grid, npix_x, npix_y, use_hinv=False,
+                 fused=True, tree=None, buf=None, profiler=NoProfiler(), frame_id=-1, vp=None):
+    """
+    Project the particles with the camera and splat them onto grid.
+    ------
+    cam    - camera.Camera object
+    pos, hsml, qty - the particles, see mpi_render_wrap
+    render_func - the render function produced by render_func_factory
+    grid   - ndarray([npix_x, npix_y]) the canvas to add to
+             The particles are passed to render_func in the dtype of hsml.
+    use_hinv, fused, tree - see mpi_render_wrap
+    buf    - camera.ProjectionBuffer reused by the fused projection
+    vp     - ndarray([4, 4]) cam.view_project_matrix(), used by the fused projection,
+             e.g. a row of frames.frames_to_view_project. By default computed from cam.
+    profiler - profiling.Profiler timing the projection and the splatting of frame_id,
+               and counting the particles before and after the masking and the pixels touched.
+    ------
+    grid
+    """
+    with profiler.stage("project", frame_id):
+        if fused:
+            w, hi, pi = raw_to_canvas(cam, qty, hsml, pos, npix_x, npix_y, buf=buf, tree=tree, vp=vp)
+        else:
+            w, h, p = raw_to_clip(cam, qty, hsml, pos, npix_x, npix_y, tree=tree)
+            hi, pi = clip_to_canvas(h, p, npix_x, npix_y)
+            w, hi, pi = [np.ascontiguousarray(_, dtype=hsml.dtype) for _ in (w, hi, pi)]
+
+    with profiler.stage("splat", frame_id):
+        if use_hinv:
+            hi_inv = 1. / hi
+            render_func(w, hi, hi_inv, pi, grid)
+        else:
+            render_func(w, hi, pi, grid)
+    if profiler.enabled:
+        profiler.count("particles", len(hsml), frame_id)
+        profiler.count("visible", len(hi), frame_id)
+        # the footprints, at most the canvas
+        profiler.count("pixels", int(np.minimum((4*hi + 1)**2, npix_x*npix_y).sum()), frame_id)
+    return grid
+
+def npy_header(shape, dtype):
+    """
+    Return the header of a .npy file of an array of the given shape and dtype.
+    """
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                                  "fortran_order": False, "shape": tuple(shape)})
+    return header.getvalue()
+
+def write_npy_strip(filename, shape, x_start, strip, write_header=False):
+    """
+    Write the rows [x_start, x_start+len(strip)) of a .npy map of the given shape in place.
+    Every rank can write its own strip of the same file concurrently;
+    exactly one of them should write the header.
+    """
+    header = npy_header(shape, strip.dtype)
+    row_bytes = int(np.prod(shape[1:])) * strip.dtype.itemsize
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        if write_header:
+            os.pwrite(fd, header, 0)
+        os.pwrite(fd, np.ascontiguousarray(strip).tobytes(), len(header) + x_start * row_bytes)
+    finally:
+        os.close(fd)
+
+def create_npy(filename, shape, dtype=float):
+    """
+    Create a .npy file of the given shape without writing the data, which reads as zeros.
+    On most file systems the file takes no space until the data is written.
+    """
+    header = npy_header(shape, dtype)
+    with open(filename, "wb") as f:
+        f.write(header)
+        f.truncate(len(header) + int(np.prod(shape)) * np.dtype(dtype).itemsize)
+
+def write_npy_tile(filename, shape, x_start, y_start, tile):
+    """
+    Write a tile ndarray([..., nx_tile, ny_tile]) at [..., x_start:, y_start:] of a .npy map
+    of the given shape in place, e.g. a file made by create_npy. The tile is written row by row,
+    so that no part of the map is held in memory.
+    """
+    header_size = len(npy_header(shape, tile.dtype))
+    item = tile.dtype.itemsize
+    nx_tile, ny_tile = tile.shape[-2:]
+    rows = np.ascontiguousarray(tile).reshape(-1, ny_tile)
+    fd = os.open(filename, os.O_WRONLY)
+    try:
+        for i, row in enumerate(rows):
+            ic, ix = divmod(i, nx_tile)
+            os.pwrite(fd, row.tobytes(), header_size + ((ic * shape[-2] + x_start + ix) * shape[-1] + y_start) * item)
+    finally:
+        os.close(fd)
+
+# Estimated costs in units of one pixel splat for the cost load balance
+cost_proj = 4.   # projection of one particle, visible or not
+cost_vis  = 16.  # overhead of one visible particle
+
+def particle_cost(h_index, npix_x, npix_y):
+    """
+    The estimated cost of a visible particle: its footprint (4*h_index)^2,
+    at most the canvas, plus cost_vis. The projection cost_proj comes on top.
+    """
+    return np.minimum((4*h_index)**2, npix_x*npix_y) + cost_vis
+
+def balance_bins(bin_cost, bin_size, npart, size):
+    """
+    Split the particles into size index ranges of equal cost.
+    ------
+    bin_cost - ndarray([n_bin]) the cost of the particles [i*bin_size, (i+1)*bin_size)
+    ------
+    bounds   - ndarray([size+1]) rank r takes the particles [bounds[r], bounds[r+1])
+    """
+    edges = np.minimum(np.arange(len(bin_cost)+1) * bin_size, npart)
+    cum = np.concatenate([[0.], np.cumsum(bin_cost)])
+    if cum[-1] <= 0:
+        return np.array([local_range(npart, r, size)[0] for r in range(size)] + [npart])
+    bounds = np.interp(cum[-1] * np.arange(size+1) / size, cum, edges).astype(np.int64)
+    bounds[0], bounds[-1] = 0, npart
+    return bounds
+
+def decomposition_cost(group_size, size, npart, n_frame, npix_x, npix_y,
+                       t_part=1e-7, t_pix=1e-9, bandwidth=1e9, latency=1e-5):
+    """
+    A simple cost model (in seconds) of rendering n_frame frames on size ranks,
+    with the ranks in groups of group_size. Every group renders whole frames, and the
+    particles are split over the ranks of a group whose canvases are then reduced.
+    ------
+    t_part    - time to project and splat one particle
+    t_pix     - time to clear and write one pixel
+    bandwidth - bytes per second of the canvas reduction
+    latency   - seconds per message of the canvas reduction
+    """
+    n_group = size // group_size
+    n_round = -(-n_frame // n_group)
+    t_render = npart / group_size * t_part + npix_x * npix_y * t_pix
+    t_reduce = 0. if group_size == 1 else np.log2(group_size) * (latency + 8 * npix_x * npix_y / bandwidth)
+    return n_round * (t_render + t_reduce)
+
+def choose_group_size(size, npart, n_frame, npix_x, npix_y, max_part_per_rank=None, **kwargs):
+    """
+    Return the group size (a divisor of size) with the lowest decomposition_cost.
+    max_part_per_rank - If given, only the group sizes such that every rank
+                        holds at most max_part_per_rank particles are considered.
+    """
+    candidates = [g for g in range(1, size+1) if size % g == 0]
+    if max_part_per_rank is not None:
+        fit = [g for g in candidates if npart / g <= max_part_per_rank]
+        candidates = fit if fit else [size]
+    return min(candidates, key=lambda g: decomposition_cost(g, size, npart, n_frame, npix_x, npix_y, **kwargs))
+
+#####################
+## Work Scheduling ##
+#####################
+# Note: WorkScheduler decides what every rank renders: the groups of ranks and the frames
+#       of every group (decomposition), the particles of every rank within its group and
+#       their rebalancing (balance), and the blocks of frames and the chunks of particles
+#       rendered together (frame_batch, chunk_size). See mpi_render_wrap for the options.
+
+class WorkScheduler(object):
+    def __init__(self, comm, npart, frame_ids, npix_x, npix_y, decomposition="particle", group_size=None,
+                 max_part_per_rank=None, local=False, balance="index", rebalance_every=1, n_bin_per_rank=64,
+                 frame_batch=1, chunk_size=None, batch_chunk_size=1<<16, use_tree=False, fused=True,
+                 profiler=NoProfiler()):
+        """
+        Split the ranks of comm into groups and the work over them.
+        comm:      MPI communicator
+                   all ranks of the render.
+        npart:     int
+                   the number of particles, or of local particles with local.
+        frame_ids: list of int
+                   the frames to render, e.g. those not in the cache.
+        others:    see mpi_render_wrap
+        """
+        size, rank = comm.Get_size(), comm.Get_rank()
+        if decomposition == "particle":
+            group_size = size
+        elif decomposition == "frame":
+            group_size = 1
+        elif decomposition == "auto":
+            group_size = choose_group_size(size, npart, len(frame_ids), npix_x, npix_y, max_part_per_rank)
+        elif decomposition != "hybrid":
+            raise ValueError(f"Unknown decomposition {decomposition}. Use 'particle', 'frame', 'hybrid' or 'auto'.")
+        if group_size is None:
+            raise ValueError("group_size is needed for the hybrid decomposition.")
+        if local and (group_size != size):
+            raise ValueError("local data can only be used with the particle decomposition.")
+        self.comm = comm
+        self.group_size = group_size
+        self.n_group  = -(-size // group_size)
+        self.group_id = rank // group_size
+        self.gcomm = comm.Split(self.group_id, rank) if group_size < size else comm
+        self.grank, self.gsize = self.gcomm.Get_rank(), self.gcomm.Get_size()
+        self.frame_ids = frame_ids[self.group_id::self.n_group]
+
+        self.npart = npart
+        self.local = local
+        self.ip_start, self.ip_end = (0, npart) if local else local_range(npart, self.grank, self.gsize)
+
+        if balance == "cost":
+            if local or use_tree or not fused:
+                raise ValueError("balance='cost' needs fused, and is not used with local or use_tree.")
+            self.n_bin = n_bin_per_rank * self.gsize
+            self.bin_size = max(1, -(-npart // self.n_bin))
+            self.bin_cost = np.zeros(self.n_bin)
+            self.bin_id = np.arange(self.n_bin)
+        elif balance != "index":
+            raise ValueError(f"Unknown balance {balance}. Use 'index' or 'cost'.")
+        self.balance = balance
+        self.rebalance_every = rebalance_every
+
+        self.frame_batch = frame_batch
+        self.chunk_size = chunk_size
+        self.batch_chunk_size = batch_chunk_size
+        self.use_tree = use_tree
+        self.prof = profiler
+
+    def blocks(self):
+        """
+        Yield the blocks of frame_batch frames of this group, lists of (k, frame_id) where
+        frame_id = frame_ids[k]. Every chunk of particles is read once per block and splatted
+        into the canvases of all frames of the block.
+        """
+        for b_start in range(0, len(self.frame_ids), self.frame_batch):
+            yield list(enumerate(self.frame_ids[b_start:b_start+self.frame_batch], start=b_start))
+
+    def load(self, pos, hsml, qty, dtype):
+        """
+        Return the particles of this rank and the size of the chunks to render them in.
+        Rendered in one chunk, the particles are loaded in dtype now, else every chunk is
+        read in the render loop.
+        """
+        pos, hsml, qty = [_[self.ip_start:self.ip_end] for _ in (pos, hsml, qty)]
+        n_local = len(hsml)
+        if self.use_tree:
+            chunk = max(n_local, 1)
+        elif self.chunk_size is None:
+            chunk = max(n_local, 1) if self.frame_batch == 1 else self.batch_chunk_size
+        else:
+            chunk = self.chunk_size
+        if chunk >= n_local:
+            pos, hsml, qty = [np.ascontiguousarray(_, dtype=dtype) for _ in (pos, hsml, qty)]
+        return pos, hsml, qty, chunk
+
+    def start_block(self, block):
+        """
+        Add the cost of projecting all local particles for the frames of block.
+        """
+        if self.balance == "cost":
+            bin_id, bin_size = self.bin_id, self.bin_size
+            self.bin_cost += len(block) * cost_proj * np.maximum(0, np.minimum(self.ip_end, (bin_id+1)*bin_size)
+                                                                      - np.maximum(self.ip_start, bin_id*bin_size))
+
+    def add_cost(self, ic_start, idx, cost):
+        """
+        Add the cost of the visible particles idx of the chunk starting at ic_start.
+        """
+        if self.balance == "cost":
+            self.bin_cost += np.bincount((self.ip_start + ic_start + idx) // self.bin_size, weights=cost,
+                                         minlength=self.n_bin)
+
+    def rebalance(self, block, MPI):
+        """
+        Split the particles of the group by the cost of the blocks since the last rebalance,
+        every rebalance_every frames. Return True if the particles of this rank changed.
+        """
+        b_start, b_end = block[0][0], block[-1][0] + 1
+        if not (self.balance == "cost" and self.gsize > 1 and b_end < len(self.frame_ids)
+                and b_end // self.rebalance_every > b_start // self.rebalance_every):
+            return False
+        with self.prof.stage("rebalance"):
+            bin_cost_tot = np.empty_like(self.bin_cost)
+            self.gcomm.Allreduce(self.bin_cost, bin_cost_tot, op=MPI.SUM)
+            self.bin_cost[:] = 0.
+            bounds = balance_bins(bin_cost_tot, self.bin_size, self.npart, self.gsize)
+        if (bounds[self.grank], bounds[self.grank+1]) == (self.ip_start, self.ip_end):
+            return False
+        self.ip_start, self.ip_end = bounds[self.grank], bounds[self.grank+1]
+        return True
+
+    def free(self):
+        if self.gcomm is not self.comm:
+            self.gcomm.Free()
+
+################
+## Reductions ##
+################
+# Note: A reduction sums the canvases of the ranks of a group and gives every finished
+#       frame to the FrameOutput. reduce(k, frame_id, slot, grid) is called for every frame
+#       of a block, end_block() after the block and finish() after the last one.
+#       A non-blocking reduction needs n_set = 2 sets of canvases, so that the reductions
+#       of the previous block can still be in flight while the next block is rendered.
+
+class LocalReduction(object):
+    n_set = 1
+
+    def __init__(self, gcomm, output, canvas_shape, canvas_dtype, MPI):
+        """
+        No reduction, for groups of one rank.
+        """
+        self.output = output
+
+    def reduce(self, k, frame_id, slot, grid):
+        self.output.output_rendered(frame_id, grid)
+
+    def end_block(self):
+        pass
+
+    def finish(self, frame_ids):
+        pass
+
+class BlockingReduction(LocalReduction):
+    def __init__(self, gcomm, output, canvas_shape, canvas_dtype, MPI):
+        """
+        A blocking reduce to rank 0 of the group between two Barriers.
+        """
+        self.gcomm, self.output, self.MPI = gcomm, output, MPI
+
+    def reduce(self, k, frame_id, slot, grid):
+        prof, frame = self.output.prof, self.output.frame_offset + frame_id
+        # the wait at the first Barrier is the imbalance of the frame
+        with prof.stage("barrier", frame):
+            self.gcomm.Barrier()
+        with prof.stage("reduce", frame):
+            grid_tot = self.gcomm.reduce(grid, self.MPI.SUM, 0)
+            self.gcomm.Barrier()
+        if self.gcomm.Get_rank() == 0:
+            self.output.output_rendered(frame_id, grid_tot)
+
+class PipelineReduction(object):
+    n_set = 2
+
+    def __init__(self, gcomm, output, canvas_shape, canvas_dtype, MPI):
+        """
+        A non-blocking Ireduce, overlapped with rendering the next block. The root rotates
+        over the ranks of the group, so that the outputs are spread over the ranks.
+        """
+        self.gcomm, self.output, self.MPI = gcomm, output, MPI
+        self.grank, self.gsize = gcomm.Get_rank(), gcomm.Get_size()
+        self.recvs = {}
+        self.pending = []
+        self.block_pending = []
+
+    def start(self, k, slot, grid):
+        root = k % self.gsize
+        if self.grank == root and slot not in self.recvs:
+            self.recvs[slot] = np.empty_like(grid)
+        recv = self.recvs[slot] if self.grank == root else None
+        return self.gcomm.Ireduce(grid, recv, op=self.MPI.SUM, root=root), recv
+
+    def reduce(self, k, frame_id, slot, grid):
+        t_start = time.perf_counter()
+        req, recv = self.start(k, slot, grid)
+        self.output.prof.record("reduce", t_start, self.output.frame_offset + frame_id)
+        self.block_pending.append((req, frame_id, recv))
+
+    def end_block(self):
+        # the reductions of the previous block, whose canvases are rendered into next
+        for pending in self.pending:
+            self.wait(*pending)
+        self.pending, self.block_pending = self.block_pending, []
+
+    def wait(self, req, frame_id, recv):
+        with self.output.prof.stage("reduce_wait", self.output.frame_offset + frame_id):
+            req.Wait()
+        if recv is not None:
+            self.output.output_rendered(frame_id, recv)
+
+    def finish(self, frame_ids):
+        self.end_block()
+
+class StripReduction(PipelineReduction):
+    def __init__(self, gcomm, output, canvas_shape, canvas_dtype, MPI):
+        """
+        A non-blocking Ireduce_scatter, overlapped with rendering the next block. Every rank
+        writes its strip of rows of the map file, and the maps are given to the other sinks
+        from the files at the end.
+        """
+        super().__init__(gcomm, output, canvas_shape, canvas_dtype, MPI)
+        self.npix_x, self.npix_y = canvas_shape
+        self.canvas_dtype = canvas_dtype
+        self.strips = [local_range(self.npix_x, r, self.gsize) for r in range(self.gsize)]
+
+    def start(self, k, slot, grid):
+        x_start, x_end = self.strips[self.grank]
+        if slot not in self.recvs:
+            self.recvs[slot] = np.empty([x_end - x_start, self.npix_y], dtype=self.canvas_dtype)
+        recv = self.recvs[slot]
+        counts = [(b - a) * self.npix_y for a, b in self.strips]
+        return self.gcomm.Ireduce_scatter(grid, recv, counts, op=self.MPI.SUM), recv
+
+    def wait(self, req, frame_id, recv):
+        output = self.output
+        frame = output.frame_offset + frame_id
+        with output.prof.stage("reduce_wait", frame):
+            req.Wait()
+        with output.prof.stage("write_strip", frame):
+            write_npy_strip(output.map_sink.filename(frame), (self.npix_x, self.npix_y), self.strips[self.grank][0],
+                            recv, write_header=(self.grank == 0))
+
+    def finish(self, frame_ids):
+        self.end_block()
+        # output the maps written in strips, spread over the ranks of the group
+        self.gcomm.Barrier()
+        for frame_id in frame_ids[self.grank::self.gsize]:
+            self.output.output_written(frame_id)
+
+reductions = {"blocking": BlockingReduction, "pipeline": PipelineReduction, "strip": StripReduction}
+
+##################
+## Frame Output ##
+##################
+# Note: FrameOutput gives the finished maps to the sinks (see sinks) and the frame cache.
+#       Unordered sinks write on the rank holding the map. The payloads of the ordered
+#       sinks are sent to rank 0 on their own communicator, which writes them as they arrive.
+#       The tag of a message is the index of its sink and the frame id is sent in the message
+#       (see pack_payload), as MPI only guarantees tags up to 32767. The ordered sinks put
+#       the frames in order themselves, e.g. sinks.FFmpegSink.
+
+def pack_payload(frame_id, payload):
+    """
+    Return the bytes of payload after the frame id, as one message.
+    """
+    return np.concatenate([np.array([frame_id], dtype=np.int64).view(np.uint8),
+                           np.ascontiguousarray(payload).reshape(-1).view(np.uint8)])
+
+def unpack_payload(message, shape, dtype):
+    """
+    Return the frame id and the payload of a message from pack_payload.
+    """
+    return int(message[:8].view(np.int64)[0]), message[8:].view(dtype).reshape(shape)
+
+class FrameOutput(object):
+    def __init__(self, comm, frames, sinks, finalize, save_map=True, tmp_path="../tmp/", map_prefix="map",
+                 cache=None, frame_offset=0, profiler=NoProfiler(), MPI=None):
+        """
+        The outputs of a render, created on all ranks.
+        comm:     MPI communicator
+                  all ranks of the render.
+        frames:   the frames of the render. The frames in the cache are in cached, the others in todo.
+        sinks:    list of sinks. A sinks.MapSink is put first if save_map.
+        finalize: function
+                  converting a reduced canvas into the maps, see canvas_layout.
+        others:   see mpi_render_wrap
+        """
+        self.comm, self.rank, self.size = comm, comm.Get_rank(), comm.Get_size()
+        self.frames = frames
+        self.finalize = finalize
+        self.frame_offset = frame_offset
+        self.prof = profiler
+        self.MPI = MPI
+
+        self.map_sink = MapSink(tmp_path, map_prefix)
+        self.save_map = save_map
+        self.sinks = ([self.map_sink] if save_map else []) + list(sinks)
+        self.ordered = [sink for sink in self.sinks if sink.ordered]
+        # the frames of ordered sinks are sent to rank 0 on their own communicator
+        self.ocomm = comm.Dup() if self.ordered else None
+        self.sends = []
+        self.n_ordered = 0
+
+        self.cache = cache
+        if cache is not None:
+            self.keys = cache.keys(frames, comm)
+            done = comm.bcast([cache.valid(key) for key in self.keys] if self.rank == 0 else None, root=0)
+        else:
+            done = [False] * len(frames)
+        self.todo = [frame_id for frame_id in range(len(frames)) if not done[frame_id]]
+        self.cached = [frame_id for frame_id in range(len(frames)) if done[frame_id]]
+        # the cached frames are output by all ranks, in step with the rendered frames
+        self.cached_ids = self.cached[self.rank::self.size]
+
+    def output_frame(self, frame_id, grid_tot, skip_map=False):
+        for sink in self.sinks:
+            with self.prof.stage(type(sink).__name__, self.frame_offset + frame_id):
+                if sink.ordered:
+                    payload = sink.encode(grid_tot)
+                    i = self.ordered.index(sink)
+                    if self.rank == 0:
+                        sink.write(self.frame_offset + frame_id, payload)
+                        self.n_ordered += 1
+                    else:
+                        message = pack_payload(frame_id, payload)
+                        self.sends.append((self.ocomm.Isend(message, dest=0, tag=i), message))
+                elif not (skip_map and sink is self.map_sink):
+                    sink.write(self.frame_offset + frame_id, grid_tot)
+
+    def output_rendered(self, frame_id, grid_tot):
+        """
+        Output a reduced canvas and store its maps in the cache.
+        """
+        grid_tot = self.finalize(grid_tot)
+        self.output_frame(frame_id, grid_tot)
+        if self.cache is not None:
+            with self.prof.stage("cache_store", self.frame_offset + frame_id):
+                self.cache.store(self.keys[frame_id], grid_tot)
+
+    def output_written(self, frame_id):
+        """
+        Output a map already written to its file by the ranks, see StripReduction.
+        """
+        filename = self.map_sink.filename(self.frame_offset + frame_id)
+        self.output_frame(frame_id, np.load(filename), skip_map=True)
+        if self.cache is not None:
+            with self.prof.stage("cache_store", self.frame_offset + frame_id):
+                self.cache.store_file(self.keys[frame_id], filename)
+
+    def output_cached(self, until):
+        """
+        Output the cached frames of this rank before the frame until.
+        """
+        while self.cached_ids and self.cached_ids[0] < until:
+            frame_id = self.cached_ids.pop(0)
+            with self.prof.stage("cache_load", self.frame_offset + frame_id):
+                if self.save_map:
+                    self.cache.restore(self.keys[frame_id], self.map_sink.filename(self.frame_offset + frame_id))
+                grid_tot = self.cache.load(self.keys[frame_id]) if any(sink is not self.map_sink for sink in self.sinks) else None
+            if grid_tot is not None:
+                self.output_frame(frame_id, grid_tot, skip_map=True)
+
+    def receive_ordered(self, block):
+        # only on rank 0. Never wait for the sends on the other ranks before the end,
+        # as rank 0 may be waiting for them in a collective.
+        MPI, ordered = self.MPI, self.ordered
+        status = MPI.Status()
+        while self.n_ordered < len(self.frames) * len(ordered):
+            if block:
+                self.ocomm.Probe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status)
+            elif not self.ocomm.Iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status):
+                break
+            i = status.Get_tag()
+            message = np.empty(8 + int(np.prod(ordered[i].shape)) * np.dtype(ordered[i].dtype).itemsize, dtype=np.uint8)
+            t_start = time.perf_counter()
+            self.ocomm.Recv(message, source=status.Get_source(), tag=i)
+            frame_id, payload = unpack_payload(message, ordered[i].shape, ordered[i].dtype)
+            self.prof.record("receive", t_start, self.frame_offset + frame_id)
+            with self.prof.stage(type(ordered[i]).__name__, self.frame_offset + frame_id):
+                ordered[i].write(self.frame_offset + frame_id, payload)
+            self.n_ordered += 1
+
+    def progress(self):
+        """
+        Write the frames of the ordered sinks arrived on rank 0, and drop the finished sends.
+        """
+        if self.ordered and self.rank == 0:
+            self.receive_ordered(block=False)
+        self.sends = [(req, payload) for req, payload in self.sends if not req.Test()]
+
+    def collect(self):
+        """
+        Collect all frames of the ordered sinks on rank 0.
+        """
+        if self.ordered:
+            if self.rank == 0:
+                self.receive_ordered(block=True)
+            with self.prof.stage("send_wait"):
+                self.MPI.Request.Waitall([req for req, _ in self.sends])
+            self.ocomm.Free()
+
+    def close(self):
+        """
+        Close the sinks, e.g. wait for the images written in the background by plot.ImageWriter.
+        """
+        with self.prof.stage("close"):
+            close_all(self.sinks, self.rank)
+
+def imbalance(values):
+    """
+    The load imbalance of values over ranks, max over mean.
+    """
+    values = np.asarray(values, dtype=float)
+    return float(values.max() / values.mean()) if values.mean() > 0 else 1.
+
+def load_report(comm, group_id, **values):
+    """
+    Gather the values of every rank (e.g. render_time=...) over comm, with their imbalance
+    over all ranks ({key}_imbalance) and within every group ({key}_group_imbalance, a list).
+    """
+    report = {key: comm.allgather(value) for key, value in values.items()}
+    report["group_id"] = comm.allgather(group_id)
+    groups = sorted(set(report["group_id"]))
+    for key in values:
+        report[key + "_imbalance"] = imbalance(report[key])
+        report[key + "_group_imbalance"] = [imbalance([v for v, gid in zip(report[key], report["group_id"]) if gid == g])
+                                            for g in groups]
+    return report
+
+def close_all(sinks, rank):
+    """
+    Close the sinks. Ordered sinks only live on rank 0.
+    """
+    for sink in sinks:
+        if rank == 0 or not sink.ordered:
+            sink.close()
+
+def finished(movie_done, tmp_path, img_prefix, movie_path):
+    """
+    Print the end of a render, with the ffmpeg command if the images still have to be encoded.
+    """
+    if movie_done:
+        print("Render finished!")
+    else:
+        print("Render finished! Please generate the movie with")
+        print(f"    ffmpeg -framerate 24 -i {tmp_path}{img_prefix}_%04d.jpg -c:v libx264 -profile:v high -pix_fmt yuv420p {movie_path}output.mp4")
+
+def canvas_layout(qty, npix_x, npix_y):
+    """
+    Return the shape of the canvas to render qty on, and the function converting
+    a reduced canvas into the maps (see channels.Channels).
+    """
+    if isinstance(qty, Channels):
+        return (qty.n_column, npix_x, npix_y), qty.finalize
+    elif np.ndim(qty) == 2:
+        return (np.shape(qty)[1], npix_x, npix_y), (lambda canvas: canvas)
+    else:
+        return (npix_x, npix_y), (lambda canvas: canvas)
+
+def mpi_render_wrap(pos, hsml, qty, frames, render_func, npix_x, npix_y, use_hinv=False, use_tree=False, fused=True,
+                    chunk_size=None, local=False, decomposition="particle", group_size=None, max_part_per_rank=None,
+                    reduction="blocking", balance="index", rebalance_every=1, n_bin_per_rank=64,
                     plot_n_save=None, tmp_path="../tmp/", movie_path="../movies/",map_prefix="map", img_prefix="img",
-                    MPI=MPI):
+                    save_map=True, sinks=None, cache=None, frame_batch=1, batch_chunk_size=1<<16,
+                    dtype=np.float64, canvas_dtype=None, frame_offset=0, close_sinks=True, blend=None, profiler=None, MPI=None):
     """
-    An MPI wrapper for the render task
+    An MPI wrapper for the render task.
+    The work is split over the ranks by a WorkScheduler, the canvases of a group are summed
+    by a reduction (see reductions) and the maps are given to the sinks by a FrameOutput.
     ------
     pos    - ndarray([n_part, 3]) 
              the position of SPH particles in the scene.
+             pos, hsml and qty can be lazy views, e.g. snap_io.NpySnapshot.column.
+             Then each rank only reads its own particles.
     hsml   - ndarray([n_part,])
              the "size" of SPH particles in the scene.
     qty    - ndarray([n_part,])
              the quantity to render.
+             Several quantities are rendered in one pass with a channels.Channels, e.g. the
+             density and the mass-weighted temperature, or an ndarray([n_part, K]); then
+             render_func is made with render_func_factory(..., n_channel=K) (K = Channels.n_column),
+             the canvases of all channels are reduced together, and the maps are
+             ndarray([n_map, npix_x, npix_y]). Not with the "strip" reduction.
     frames - a list of frames that can be parsed with frames.frame_to_camera
              determine the camera info.
     render_func - the render function produced by render_func_factory
-    plot_n_save - a function to save intermediate images.
+    use_tree    - If True, build a spatial.ParticleTree over the local particles once
+                  and skip the tree nodes outside the frustum in every frame.
+    fused       - If True, project the particles with the fused camera.raw_to_canvas
+                  into buffers reused across frames. Otherwise use raw_to_clip + clip_to_canvas.
+    chunk_size  - If given, the local particles are read and rendered in chunks of chunk_size
+                  in every frame instead of being loaded at once (not with use_tree).
+    frame_batch - The number of frames rendered together. Every chunk of particles is then
+                  projected and splatted into the canvases of frame_batch frames while it is
+                  in cache, instead of streaming all particles once per frame. The maps are
+                  the same as with frame_batch=1. Needs frame_batch canvases (twice as many
+                  with a non-blocking reduction). Without chunk_size, the chunks have
+                  batch_chunk_size particles. Not useful with use_tree.
+    dtype       - The dtype the particles are read, projected and splatted in.
+    canvas_dtype - The dtype of the canvases, reductions and maps, by default dtype.
+                  Both must match the render function, e.g.
+                  render_func_factory(..., dtype=np.float32, canvas_dtype=np.float32, accumulate="tile")
+                  renders with half the memory, bandwidth and reduction volume of float64.
+    local       - If True, pos, hsml and qty only hold the particles of this rank,
+                  e.g. from snap_io.HDF5Snapshot.read_local, and are not split again.
+                  Only for the particle decomposition.
+    decomposition - How to distribute the work over the ranks:
+                  "particle" - the particles are split over all ranks, and the canvases
+                               of all ranks are reduced in every frame.
+                  "frame"    - every rank renders whole frames from all particles,
+                               with no reduction.
+                  "hybrid"   - the ranks form groups of group_size. The groups take the frames
+                               round-robin, and the particles are split within a group.
+                  "auto"     - "hybrid" with the group size by choose_group_size.
+    group_size  - The number of ranks per group for "hybrid".
+    max_part_per_rank - The memory limit passed to choose_group_size for "auto".
+    reduction   - How to reduce the canvases of a group:
+                  "blocking" - a blocking reduce to rank 0 between two Barriers (default).
+                  "pipeline" - a non-blocking Ireduce, overlapped with rendering the next frame.
+                               The root rotates over the ranks, so that saving and plotting
+                               is spread over the ranks.
+                  "strip"    - a non-blocking Ireduce_scatter, overlapped with rendering the
+                               next frame. Every rank writes its strip of rows of the map,
+                               and the images are plotted from the maps at the end.
+    balance     - How to split the particles within a group:
+                  "index" - evenly by index, see snap_io.local_range.
+                  "cost"  - by the cost estimated from the projection of the last frame
+                            (see particle_cost), so that every rank gets the same cost.
+                            The particles are binned by index into n_bin_per_rank bins per rank,
+                            and the bins are rebalanced every rebalance_every frames.
+                            Needs fused, and is not used with local or use_tree.
+    ------
+    report - dict. The render time and estimated cost (with fused) of every rank, and their
+             imbalance (max over mean) over all ranks and within every group, see load_report.
+             Also printed by rank 0.
+             With a cache, also the number of frames taken from the cache.
+    plot_n_save - a function to save intermediate images, e.g. plot.rho_map or plot.ImageWriter.
+                  It is wrapped in a sinks.ImageSink, which calls its close method at the end.
                   If None then no image will be produced.
     tmp_path    - The path to save intermediate results.
     map_prefix  - The prefix for saved map files
     img_prefix  - The prefix for saved img files
+    save_map    - If True, save every map as {tmp_path}/{map_prefix}_XXXX.npy (sinks.MapSink).
+                  Needed for the "strip" reduction.
+    sinks       - A list of further outputs, e.g. sinks.FFmpegSink to encode the movie directly.
+                  Ordered sinks get the frames in order on rank 0, see sinks.
+    cache       - A cache.FrameCache. The frames whose map is in the cache are not rendered:
+                  their maps are copied to {tmp_path}/{map_prefix}_XXXX.npy and passed to the
+                  other sinks, spread over all ranks. Only the missing frames are distributed
+                  for rendering, and every map is stored as soon as it is done (with the
+                  "strip" reduction: at the end), so an interrupted render resumes where it stopped. The cache is evicted at the
+                  end by its max_bytes and max_age.
+    frame_offset - The id of the first frame. The frame frames[i] is output as frame_offset + i,
+                  e.g. {tmp_path}/{map_prefix}_XXXX.npy, so that a movie can be rendered in parts,
+                  see series.mpi_render_series.
+    close_sinks - If False, the sinks (and plot_n_save) are not closed at the end, so that
+                  they take the frames of the next part.
+    blend       - A function blend(frame_id, start, end) returning pos, hsml and qty of the
+                  particles [start, end) of the given arrays to render frames[frame_id] from,
+                  e.g. interpolated between two snapshots to the time of the frame, see
+                  series.mpi_render_series. It is called in the render loop for every chunk
+                  of every frame. Not with use_tree.
+    profiler    - A profiling.Profiler, created on all ranks. Every stage (setup, read, project,
+                  splat, barrier, reduce, reduce_wait, the outputs of every sink, ...) is timed
+                  per frame and rank, and a summary over the ranks is printed by rank 0 at the
+                  end. The records can then be saved with profiler.save(filename, comm, format).
+                  The "barrier_end" stage is the time waited for the slowest rank.
     MPI         - The MPI api to use. By default mpi4py.MPI
     """
     # MPI init
+    if MPI is None:
+        from mpi4py import MPI
     comm = MPI.COMM_WORLD
-    size = comm.Get_size()
     rank = comm.Get_rank()
+    prof = NoProfiler() if profiler is None else profiler
+    t_setup = time.perf_counter()
     
     # Check plot&save function
-    if (plot_n_save is None) and (rank==0):
+    sinks = list(sinks) if sinks is not None else []
+    if (plot_n_save is None) and (not sinks) and (rank==0):
         warnings.warn("No plot_n_save function is specified. No image will be produced.")
+    if reduction not in reductions:
+        raise ValueError(f"Unknown reduction {reduction}. Use 'blocking', 'pipeline' or 'strip'.")
+    if (reduction == "strip") and not save_map:
+        raise ValueError("The strip reduction writes the maps, so it needs save_map.")
+    if (blend is not None) and use_tree:
+        raise ValueError("The tree is built over the given positions, it cannot be used with blend.")
+    
+    # Channels
+    canvas_shape, finalize = canvas_layout(qty, npix_x, npix_y)
+    multi = len(canvas_shape) == 3
+    if multi and reduction == "strip":
+        raise ValueError("The strip reduction is not supported with several channels.")
        
     # Check hinv option #FIXME we can assign more info on the function
     if use_hinv and (rank==0):
@@ -45,41 +773,194 @@ def mpi_render_wrap(pos, hsml, qty, frames, render_func, npix_x, npix_y, use_hin
         
     sys.stdout.flush()
     
-    # Task decomposition 
-    npart = len(hsml)
-    part_per_thread = int(npart // size + 1)
-    ip_start, ip_end = part_per_thread*(rank+0), min(part_per_thread*(rank+1), npart)
+    # Output and frame cache
+    if plot_n_save is not None:
+        sinks.append(ImageSink(plot_n_save, tmp_path, img_prefix, channel=0 if multi else None))
+    output = FrameOutput(comm, frames, sinks, finalize, save_map=save_map, tmp_path=tmp_path, map_prefix=map_prefix,
+                         cache=cache, frame_offset=frame_offset, profiler=prof, MPI=MPI)
     
-    # Data decomposition
-    pos  = pos[ip_start:ip_end]
-    hsml = hsml[ip_start:ip_end]
-    qty  = qty[ip_start:ip_end]
+    # Task decomposition and load balance
+    sched = WorkScheduler(comm, len(hsml), output.todo, npix_x, npix_y, decomposition=decomposition,
+                          group_size=group_size, max_part_per_rank=max_part_per_rank, local=local, balance=balance,
+                          rebalance_every=rebalance_every, n_bin_per_rank=n_bin_per_rank, frame_batch=frame_batch,
+                          chunk_size=chunk_size, batch_chunk_size=batch_chunk_size, use_tree=use_tree, fused=fused,
+                          profiler=prof)
+    if rank == 0 and decomposition != "particle":
+        print(f"Rendering with {sched.n_group} groups of {sched.group_size} ranks.")
+    canvas_dtype = dtype if canvas_dtype is None else canvas_dtype
+    red = (reductions[reduction] if sched.gsize > 1 else LocalReduction)(sched.gcomm, output, canvas_shape, canvas_dtype, MPI)
+    
+    # Data decomposition and spatial index
+    pos_l, hsml_l, qty_l, chunk = sched.load(pos, hsml, qty, dtype)
+    tree = ParticleTree(pos_l, hsml_l) if use_tree else None
+    buf  = ProjectionBuffer(dtype=dtype)
+    # the matrices of all frames at once, rather than for every chunk
+    vps = frames_to_view_project(frames)
     
     # Render loop
-    for frame_id, frame in enumerate(frames):
-        cam = frame_to_camera(frame)
-        w, h, p = raw_to_clip(cam, qty, hsml, pos, npix_x, npix_y)
-        hi, pi = clip_to_canvas(h, p, npix_x, npix_y)
+    grids = [np.zeros(canvas_shape, dtype=canvas_dtype) for _ in range(red.n_set * frame_batch)]
+    t_render, cost_render = np.zeros(len(sched.frame_ids)), np.zeros(len(sched.frame_ids))
+    prof.record("setup", t_setup)
+    for ib, block in enumerate(sched.blocks()):
+        b_start = block[0][0]
+        slots = [ib % red.n_set * frame_batch + j for j in range(len(block))]
+        output.output_cached(block[0][1])
+        cams = [frame_to_camera(frames[frame_id]) for _, frame_id in block]
+        for slot in slots:
+            grids[slot][:] = 0.
+        sched.start_block(block)
+        n_local = len(hsml_l)
+        for ic_start in range(0, n_local, chunk):
+            t_start = time.perf_counter()
+            ic_end = min(ic_start + chunk, n_local)
+            if blend is None:
+                pos_c, hsml_c, qty_c = [np.ascontiguousarray(_[ic_start:ic_end], dtype=dtype) for _ in (pos_l, hsml_l, qty_l)]
+            prof.record("read", t_start, frame_offset + block[0][1])
+            # the time to read the chunk is shared by the frames of the block
+            t_render[b_start:b_start+len(block)] += (time.perf_counter() - t_start) / len(block)
+            for (k, frame_id), cam, slot in zip(block, cams, slots):
+                t_start = time.perf_counter()
+                if blend is not None:
+                    with prof.stage("blend", frame_offset + frame_id):
+                        pos_c, hsml_c, qty_c = [np.ascontiguousarray(_, dtype=dtype) for _ in
+                                                blend(frame_id, sched.ip_start + ic_start, sched.ip_start + ic_end)]
+                render_frame(cam, pos_c, hsml_c, qty_c, render_func, grids[slot], npix_x, npix_y,
+                             use_hinv=use_hinv, fused=fused, tree=tree, buf=buf,
+                             profiler=prof, frame_id=frame_offset + frame_id, vp=vps[frame_id])
+                if fused:
+                    cost = particle_cost(buf.h[:buf.n], npix_x, npix_y)
+                    cost_render[k] += cost.sum() + cost_proj * (ic_end - ic_start)
+                    sched.add_cost(ic_start, buf.idx[:buf.n], cost)
+                t_render[k] += time.perf_counter() - t_start
+        
+        for (k, frame_id), slot in zip(block, slots):
+            red.reduce(k, frame_id, slot, grids[slot])
+        red.end_block()
         
-        grid = np.zeros([npix_x, npix_y], dtype=float)
+        # rebalance the particles for the next frames by the cost of this block
+        if sched.rebalance(block, MPI):
+            pos_l, hsml_l, qty_l, chunk = sched.load(pos, hsml, qty, dtype)
+        output.progress()
+    output.output_cached(len(frames))
+    red.finish(sched.frame_ids)
+    output.collect()
+    if close_sinks:
+        output.close()
+    
+    # Load balance report
+    report = load_report(comm, sched.group_id, render_time=t_render.sum(), cost=cost_render.sum())
+    if cache is not None:
+        report["n_cached"] = len(output.cached)
+        if rank == 0:
+            cache.evict()
+            print(f"{len(output.cached)} of {len(frames)} frames were taken from the cache.")
+    if rank == 0:
+        print(f"Load imbalance (max/mean over all ranks): render time {report['render_time_imbalance']:.3f}", end="")
+        print(f", estimated cost {report['cost_imbalance']:.3f}" if fused else "")
+        if 1 < sched.group_size < comm.Get_size():
+            print("Load imbalance within the groups: render time "
+                  + " ".join(f"{v:.3f}" for v in report["render_time_group_imbalance"]))
+    
+    sched.free()
+    with prof.stage("barrier_end"):
+        comm.Barrier()
+    if prof.enabled:
+        prof.summary(comm)
+    if rank == 0 and close_sinks:
+        finished(plot_n_save is None or output.ordered, tmp_path, img_prefix, movie_path)
+    return report
+
+def mpi_render_tiled(pos, hsml, qty, frame, render_func, npix_x, npix_y, filename, tile_size=4096,
+                     use_hinv=False, chunk_size=1<<20, local=False, dtype=np.float64, canvas_dtype=None, MPI=None):
+    """
+    Render one frame of any size, e.g. a poster of 32768 x 32768 pixels, tile by tile into
+    the .npy file filename. Only a few canvases of one tile are in memory at once.
+    The local particles are projected once, binned into the tiles by their footprint,
+    and every tile is rendered from the particles overlapping it. The tiles of all ranks
+    are reduced in turn (non-blocking, to a root rotating over the ranks) and the root
+    writes the tile into the memory-mapped map.
+    ------
+    pos, hsml, qty - the particles, see mpi_render_wrap. qty can also be a channels.Channels.
+    frame       - one frame, see frames.frame_to_camera
+    render_func - the render function produced by render_func_factory. It is called with the
+                  canvas of one tile, ndarray([tile_size, tile_size]).
+    filename    - the .npy file of the map ndarray([npix_x, npix_y]) (or ndarray([n_map, npix_x, npix_y])),
+                  written by the ranks in place, see write_npy_tile. Open it with np.load(filename, mmap_mode="r").
+    tile_size   - int. the size of the tiles in pixels.
+    chunk_size  - the particles are read and projected in chunks of chunk_size.
+    local, dtype, canvas_dtype - see mpi_render_wrap.
+    MPI         - The MPI api to use. By default mpi4py.MPI
+    """
+    if MPI is None:
+        from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+    size = comm.Get_size()
+    rank = comm.Get_rank()
+    
+    canvas_dtype = dtype if canvas_dtype is None else canvas_dtype
+    canvas_shape, finalize = canvas_layout(qty, tile_size, tile_size)
+    map_shape = finalize(np.zeros(canvas_shape[:-2] + (0, 0))).shape[:-2] + (npix_x, npix_y)
+    
+    # project the local particles onto the whole canvas
+    npart = len(hsml)
+    ip_start, ip_end = (0, npart) if local else local_range(npart, rank, size)
+    cam = frame_to_camera(frame)
+    vp  = cam.view_project_matrix()
+    buf = ProjectionBuffer(dtype=dtype)
+    ws = [np.zeros((0, ) + canvas_shape[:-2], dtype=dtype)]
+    hs, ps = [np.zeros(0, dtype=dtype)], [np.zeros((0, 2), dtype=dtype)]
+    for ic_start in range(ip_start, ip_end, chunk_size):
+        ic_end = min(ic_start + chunk_size, ip_end)
+        pos_c, hsml_c, qty_c = [np.ascontiguousarray(_[ic_start:ic_end], dtype=dtype) for _ in (pos, hsml, qty)]
+        w, h, p = raw_to_canvas(cam, qty_c, hsml_c, pos_c, npix_x, npix_y, buf=buf, vp=vp)
+        ws.append(w.copy())
+        hs.append(h.copy())
+        ps.append(p.copy())
+    w, h, p = np.concatenate(ws), np.concatenate(hs), np.concatenate(ps)
+    del ws, hs, ps
+    offsets, index = bin_to_tiles(h, p, npix_x, npix_y, tile_size)
+    
+    # the map on disk, created by rank 0
+    if rank == 0:
+        create_npy(filename, map_shape, canvas_dtype)
+    comm.Barrier()
+    
+    def finish_tile(pending):
+        req, it, recv = pending
+        req.Wait()
+        if recv is None:
+            return
+        tx_start, ty_start = (it // nty) * tile_size, (it % nty) * tile_size
+        tx_end, ty_end = min(npix_x, tx_start + tile_size), min(npix_y, ty_start + tile_size)
+        write_npy_tile(filename, map_shape, tx_start, ty_start, finalize(recv)[..., :tx_end-tx_start, :ty_end-ty_start])
+    
+    # Tile loop
+    ntx = (npix_x + tile_size - 1) // tile_size
+    nty = (npix_y + tile_size - 1) // tile_size
+    grids = [np.zeros(canvas_shape, dtype=canvas_dtype) for _ in range(2)]
+    recvs = [None, None]
+    pending = None
+    for it in range(ntx*nty):
+        tx_start, ty_start = (it // nty) * tile_size, (it % nty) * tile_size
+        sel = index[offsets[it]:offsets[it+1]]
+        grid = grids[it % 2]
+        grid[:] = 0.
+        w_t, h_t, p_t = w[sel], h[sel], p[sel] - np.array([tx_start, ty_start], dtype=dtype)
         if use_hinv:
-            hi_inv = 1. / hi
-            render_func(w, hi, hi_inv, pi, grid)
+            render_func(w_t, h_t, 1. / h_t, p_t, grid)
         else:
-            render_func(w, hi, pi, grid)
-        comm.Barrier()
-        grid_tot = comm.reduce(grid, MPI.SUM, 0)
-        comm.Barrier()
-        if rank == 0:
-            # save data map
-            map_fn = f"{tmp_path}/{map_prefix}_{str(frame_id).zfill(4)}.npy"
-            np.save(f"{tmp_path}/{map_prefix}_{str(frame_id).zfill(4)}.npy", grid_tot)
-            
-            # save image
-            img_fn = f"{tmp_path}/{img_prefix}_{str(frame_id).zfill(4)}.jpg"
-            if plot_n_save is not None:
-                plot_n_save(grid_tot, img_fn, tmp_path)
-                
+            render_func(w_t, h_t, p_t, grid)
+        
+        root = it % size
+        if rank == root and recvs[it % 2] is None:
+            recvs[it % 2] = np.empty_like(grid)
+        recv = recvs[it % 2] if rank == root else None
+        req = comm.Ireduce(grid, recv, op=MPI.SUM, root=root)
+        if pending is not None:
+            finish_tile(pending)
+        pending = (req, it, recv)
+    if pending is not None:
+        finish_tile(pending)
+    comm.Barrier()
     if rank == 0:
-        print("Render finished! Please generate the movie with")
-        print(f"    ffmpeg -framerate 24 -i {tmp_path}{img_prefix}_%04d.jpg -c:v libx264 -profile:v high -pix_fmt yuv420p {movie_path}output.mp4")
\ No newline at end of file
+        print(f"Render finished! The map is in {filename}.")
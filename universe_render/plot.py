@@ -1,16 +1,148 @@
 import numpy as np
-import matplotlib.pyplot as plt
+import zlib
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 ####################
 ## Plot Functions ##
 ####################
 # Note: PLZ define yours yourself
+#       matplotlib is imported when it is used, it takes a long time to import.
 
 def rho_map(arr, fn, ftype="jpg"):
+    import matplotlib.pyplot as plt
     dpi=240
     fig = plt.figure(figsize=(arr.shape[0]/dpi, arr.shape[1]/dpi), dpi=dpi)
     axes=fig.add_axes([0,0,1,1])    
     plt.imshow(np.log10(arr).T, cmap="cubehelix", origin='lower',clim=(-9, -4))
     axes.set_axis_off()
     plt.savefig(fn, bbox_inches='tight', pad_inches=0)
-    plt.close()
\ No newline at end of file
+    plt.close()
+
+##################
+## Image Output ##
+##################
+# Note: The functions below produce the same image as rho_map without matplotlib
+#       in the loop: the colormap is applied through a lookup table and the
+#       image is encoded directly.
+
+class ColormapLUT(object):
+    def __init__(self, cmap="cubehelix", clim=(-9, -4), log=True, facecolor=(1., 1., 1.)):
+        """
+        A colormap as a lookup table, applied in the same way as plt.imshow.
+        cmap:      str
+                   the name of a matplotlib colormap.
+        clim:      tuple
+                   the values mapped to the ends of the colormap (after log10 if log).
+        log:       bool
+                   If True, the map is shown as log10(arr).
+        facecolor: tuple
+                   the background color behind transparent colors, e.g. for invalid
+                   values such as log10(0). White as in the figures of rho_map.
+        """
+        import matplotlib.pyplot as plt
+        cm = plt.get_cmap(cmap)
+        self.N = cm.N
+        self.clim = clim
+        self.log = log
+        # N colors, then under, over and bad
+        rgba = np.vstack([cm(np.arange(self.N)), cm.get_under(), cm.get_over(), cm.get_bad()])
+        rgb = rgba[:,:3] * rgba[:,3:4] + np.array(facecolor) * (1 - rgba[:,3:4])
+        self.table = (rgb * 255).astype(np.uint8)
+
+    def __call__(self, arr):
+        """
+        Convert a map ndarray([nx, ny]) into an RGB image ndarray([ny, nx, 3]),
+        oriented as plt.imshow(arr.T, origin='lower').
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            val = np.log10(arr) if self.log else np.asarray(arr, dtype=float)
+            x = (val - self.clim[0]) / (self.clim[1] - self.clim[0]) * self.N
+        # as in matplotlib: the upper limit is the last color, nan and inf are bad
+        bad = ~np.isfinite(x)
+        x[x == self.N] = self.N - 1
+        x[bad] = 0
+        idx = np.clip(np.floor(x), -1, self.N).astype(np.intp)
+        idx[idx == self.N] = self.N + 1
+        idx[idx == -1] = self.N
+        idx[bad] = self.N + 2
+        return self.table[idx.T[::-1]]
+
+def encode_png(rgb, compress_level=1):
+    """
+    Encode an RGB image ndarray([ny, nx, 3]) of uint8 as PNG bytes.
+    """
+    ny, nx = rgb.shape[:2]
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+    raw = np.zeros((ny, nx*3 + 1), dtype=np.uint8)
+    raw[:,1:] = rgb.reshape(ny, nx*3)
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", nx, ny, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), compress_level))
+            + chunk(b"IEND", b""))
+
+def save_rgb(rgb, fn, quality=75):
+    """
+    Save an RGB image by the extension of fn: .png, .jpg/.jpeg (needs Pillow), or .rgb/.raw (raw bytes).
+    """
+    ext = fn.rsplit(".", 1)[-1].lower()
+    if ext == "png":
+        with open(fn, "wb") as f:
+            f.write(encode_png(rgb))
+    elif ext in ("jpg", "jpeg"):
+        from PIL import Image
+        Image.fromarray(rgb).save(fn, quality=quality)
+    elif ext in ("rgb", "raw"):
+        rgb.tofile(fn)
+    else:
+        raise ValueError(f"Unknown image format {ext}. Use png, jpg or rgb.")
+
+def rho_map_fast(arr, fn, *args, lut=None):
+    """
+    The same as rho_map (cubehelix, clim=(-9, -4)), without matplotlib.
+    """
+    lut = ColormapLUT() if lut is None else lut
+    save_rgb(lut(arr), fn)
+
+def _write_image(lut, arr, fn):
+    save_rgb(lut(arr), fn)
+
+class ImageWriter(object):
+    def __init__(self, lut=None, n_workers=2, max_pending=8, processes=False):
+        """
+        Write images in the background. An ImageWriter can be passed as plot_n_save
+        to mpi_render_wrap, which closes it at the end of the render.
+        lut:         ColormapLUT
+                     the colormap, by default the one of rho_map.
+        n_workers:   int
+                     the number of threads (or processes) writing images.
+        max_pending: int
+                     the number of images queued at most. Further calls block until
+                     an image is written, so the memory use is bounded.
+        processes:   bool
+                     If True, use a process pool instead of a thread pool.
+        """
+        self.lut = ColormapLUT() if lut is None else lut
+        self.pool = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(n_workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+
+    def __call__(self, arr, fn, *args):
+        """
+        Queue arr to be written to fn. arr is copied, so the caller can reuse it.
+        """
+        self.slots.acquire()
+        future = self.pool.submit(_write_image, self.lut, np.array(arr), fn)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures = [f for f in self.futures if not f.done() or f.exception() is not None] + [future]
+
+    def close(self):
+        """
+        Wait for all images to be written and raise the first error, if any.
+        """
+        self.pool.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+        self.futures = []
@@ -0,0 +1,156 @@
+import numpy as np
+import time
+import json
+
+###############
+## Profiling ##
+###############
+# Note: mpi_render_wrap(..., profiler=Profiler(comm)) times every stage of every frame on
+#       every rank (reading, projection, splatting, the waits for the reductions, the
+#       outputs, ...) and counts the particles and pixels. Without a profiler, a no-op
+#       one is used, whose calls cost a few hundred nanoseconds per chunk and frame.
+
+class _Stage(object):
+    __slots__ = ("profiler", "name", "frame", "t_start")
+
+    def __init__(self, profiler, name, frame):
+        self.profiler = profiler
+        self.name = name
+        self.frame = frame
+
+    def __enter__(self):
+        self.t_start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.events.append((self.name, self.frame, self.t_start - self.profiler.t0,
+                                     time.perf_counter() - self.t_start))
+        return False
+
+class _NoStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class NoProfiler(object):
+    """
+    The profiler doing nothing, used when profiling is disabled.
+    """
+    enabled = False
+    _stage = _NoStage()
+
+    def stage(self, name, frame=-1):
+        return self._stage
+
+    def record(self, name, t_start, frame=-1):
+        pass
+
+    def count(self, name, value, frame=-1):
+        pass
+
+class Profiler(object):
+    enabled = True
+
+    def __init__(self, comm=None):
+        """
+        Record the time of the stages of a render on this rank.
+        comm: MPI communicator
+              If given, the ranks are synchronized by a Barrier, so that the times of all
+              ranks share the same origin. Then the profiler is created on all ranks.
+        self.events holds (stage, frame, start, duration) in seconds,
+        and self.counts (name, frame, time, value).
+        """
+        if comm is not None:
+            comm.Barrier()
+        self.rank = 0 if comm is None else comm.Get_rank()
+        self.t0 = time.perf_counter()
+        self.events = []
+        self.counts = []
+
+    def stage(self, name, frame=-1):
+        """
+        Return a context manager timing the stage name (of the frame).
+        """
+        return _Stage(self, name, frame)
+
+    def record(self, name, t_start, frame=-1):
+        """
+        Record the stage name (of the frame) started at time.perf_counter() t_start and ending now.
+        """
+        self.events.append((name, frame, t_start - self.t0, time.perf_counter() - t_start))
+
+    def count(self, name, value, frame=-1):
+        """
+        Record a count, e.g. the number of visible particles of a frame.
+        """
+        self.counts.append((name, frame, time.perf_counter() - self.t0, value))
+
+    def totals(self):
+        """
+        Return {stage: (total time, number of calls)} and {count name: total} of this rank.
+        """
+        times, counts = {}, {}
+        for name, _, _, dt in self.events:
+            t, n = times.get(name, (0., 0))
+            times[name] = (t + dt, n + 1)
+        for name, _, _, value in self.counts:
+            counts[name] = counts.get(name, 0) + value
+        return times, counts
+
+    def _gather(self, comm):
+        data = {"rank": self.rank, "events": self.events, "counts": self.counts}
+        return [data] if comm is None else comm.gather(data, root=0)
+
+    def summary(self, comm=None):
+        """
+        Print the time of every stage over the ranks (on rank 0): the mean and maximum
+        of the total per rank, and the imbalance (max over mean).
+        """
+        totals = [self.totals()] if comm is None else comm.gather(self.totals(), root=0)
+        if self.rank != 0:
+            return
+        names = []
+        for times, _ in totals:
+            names += [name for name in times if name not in names]
+        print(f"{'stage':<24}{'calls':>8}{'mean [s]':>12}{'max [s]':>12}{'max/mean':>10}")
+        for name in names:
+            t = np.array([times.get(name, (0., 0))[0] for times, _ in totals])
+            n = sum(times.get(name, (0., 0))[1] for times, _ in totals)
+            print(f"{name:<24}{n:>8}{t.mean():>12.4f}{t.max():>12.4f}{t.max() / t.mean() if t.mean() > 0 else 1.:>10.3f}")
+        names = []
+        for _, counts in totals:
+            names += [name for name in counts if name not in names]
+        for name in names:
+            print(f"{name:<24}{sum(counts.get(name, 0) for _, counts in totals):>20,}")
+
+    def save(self, filename, comm=None, format="json"):
+        """
+        Write the records of all ranks to filename (by rank 0).
+        format: "json"   - {"ranks": [{"rank", "events": [[stage, frame, start, duration], ...],
+                                       "counts": [[name, frame, time, value], ...]}, ...]}
+                "chrome" - the Chrome trace event format, to be opened in chrome://tracing or
+                           https://ui.perfetto.dev, with one process per rank.
+        """
+        ranks = self._gather(comm)
+        if self.rank != 0:
+            return
+        if format == "json":
+            out = {"ranks": ranks}
+        elif format == "chrome":
+            trace = []
+            for data in ranks:
+                trace.append({"name": "process_name", "ph": "M", "pid": data["rank"],
+                              "args": {"name": f"rank {data['rank']}"}})
+                for name, frame, start, dt in data["events"]:
+                    trace.append({"name": name, "ph": "X", "pid": data["rank"], "tid": 0,
+                                  "ts": start * 1e6, "dur": dt * 1e6, "args": {"frame": frame}})
+                for name, frame, t, value in data["counts"]:
+                    trace.append({"name": name, "ph": "C", "pid": data["rank"], "ts": t * 1e6,
+                                  "args": {name: value}})
+            out = {"traceEvents": trace, "displayTimeUnit": "ms"}
+        else:
+            raise ValueError(f"Unknown format {format}. Use 'json' or 'chrome'.")
+        with open(filename, "w") as f:
+            json.dump(out, f, default=int)
@@ -1,46 +1,478 @@
 import math
-import numpy as np 
-import numba 
-from numba import njit, float64
+import numpy as np
+import numba
+from numba import njit, prange
+from numba.extending import register_jitable
+
+from .sph_kernels import KernelTable, kernels, get_kernel_table
 
 import warnings
 
-@njit
+@njit(cache=True)
 def dist(x1, y1, x2, y2):
     return math.sqrt((x1-x2)*(x1-x2)+(y1-y2)*(y1-y2))
 
-def render_func_factory(sph_kernel, npix_x, npix_y, use_hinv=False):
+@njit(cache=True)
+def footprint(px, py, h, nx, ny):
+    """
+    Return the pixel window [ix_start, ix_end) x [iy_start, iy_end) covered by a particle.
+    """
+    ix_start, ix_end = int(max(0, px - 2*h)), int(min(nx, px + 2*h))
+    iy_start, iy_end = int(max(0, py - 2*h)), int(min(ny, py + 2*h))
+    return ix_start, ix_end, iy_start, iy_end
+
+@njit(cache=True)
+def bin_to_tiles(h, p, nx, ny, tile_size):
+    """
+    Bin the particles into screen tiles of tile_size x tile_size pixels by their footprint.
+    A particle is listed in every tile its footprint overlaps. Within one tile the
+    particles keep their original order.
+    ------
+    h - ndarray([n_part]) the hsml on the canvas
+    p - ndarray([n_part, 2]) the position on the canvas
+    ------
+    offsets - ndarray([n_tile+1]) particles of tile it are index[offsets[it]:offsets[it+1]]
+    index   - ndarray([n_entry]) the particle indices sorted by tile
+    """
+    ntx = (nx + tile_size - 1) // tile_size
+    nty = (ny + tile_size - 1) // tile_size
+    npart = h.size
+
+    counts = np.zeros(ntx*nty+1, dtype=np.int64)
+    for ip in range(npart):
+        ix_start, ix_end, iy_start, iy_end = footprint(p[ip,0], p[ip,1], h[ip], nx, ny)
+        if ix_end <= ix_start or iy_end <= iy_start:
+            continue
+        for tx in range(ix_start // tile_size, (ix_end-1) // tile_size + 1):
+            for ty in range(iy_start // tile_size, (iy_end-1) // tile_size + 1):
+                counts[tx*nty+ty+1] += 1
+    offsets = np.cumsum(counts)
+
+    fill = offsets[:-1].copy()
+    index = np.empty(offsets[-1], dtype=np.int64)
+    for ip in range(npart):
+        ix_start, ix_end, iy_start, iy_end = footprint(p[ip,0], p[ip,1], h[ip], nx, ny)
+        if ix_end <= ix_start or iy_end <= iy_start:
+            continue
+        for tx in range(ix_start // tile_size, (ix_end-1) // tile_size + 1):
+            for ty in range(iy_start // tile_size, (iy_end-1) // tile_size + 1):
+                it = tx*nty+ty
+                index[fill[it]] = ip
+                fill[it] += 1
+    return offsets, index
+
+######################
+## Compiled Kernels ##
+######################
+# Note: The SPH kernel reaches the jitted code either as the kernel function itself
+#       (sph_kernel) or as its table (table, see table_ref), with the other one None;
+#       numba drops the branch of the one that is None when it compiles splat.
+#       The render cores below are plain functions (register_jitable), so every render
+#       function is compiled as one piece, and they also run in Python with NUMBA_DISABLE_JIT=1.
+#       A render function evaluating a table only holds plain values and is cached on disk
+#       (numba cache=True), so a new process loads it instead of compiling it. numba cannot
+#       cache a function holding another jitted function, so a render function calling an
+#       analytic kernel is compiled once per process.
+
+def table_ref(kernel_table):
+    """
+    Return the sph_kernels.KernelTable as the tuple used by the jitted code.
+    """
+    return (kernel_table.values, 1. / kernel_table.dq2, kernel_table.q_max * kernel_table.q_max)
+
+@register_jitable
+def table_row_range(table, use_hinv, karg, px, py, ix, iy_start, iy_end):
+    # the pixels of the row ix inside the support circle, and the table index scale
+    _, inv_dq2, q2_max = table
+    hinv = karg if use_hinv else 1. / karg
+    scale = hinv * hinv * inv_dq2
+    r2_max = q2_max / (hinv * hinv)
+    dx2 = (px - ix) * (px - ix)
+    if dx2 >= r2_max:
+        return dx2, scale, 0, 0
+    s = math.sqrt(r2_max - dx2)
+    return dx2, scale, max(iy_start, int(math.ceil(py - s))), min(iy_end, int(math.floor(py + s)) + 1)
+
+@register_jitable
+def table_lookup(table, dx2, dy, scale):
+    # inside the support circle, so the index is always within the table
+    values = table[0]
+    x = (dx2 + dy * dy) * scale
+    i = int(x)
+    return values[i] + (x - i) * (values[i+1] - values[i])
+
+@register_jitable
+def splat(sph_kernel, table, use_hinv, wp, karg, px, py, ix_start, ix_end, iy_start, iy_end, grid):
+    """
+    Splat one particle into the pixel window [ix_start, ix_end) x [iy_start, iy_end) of grid.
+    The kernel is given by one of (the other is None):
+    - sph_kernel: called as sph_kernel(r, karg), where karg is either h or h_inv.
+    - table:      table_ref(kernel_table). Only the pixels inside the support circle are
+                  visited (one sqrt per row), and the table is indexed by q^2 so there is
+                  no sqrt per pixel.
+    If grid is ndarray([K, nx, ny]), wp is ndarray([K]): the kernel is evaluated once per pixel
+    and all K channels are added.
+    """
+    if table is not None:
+        hinv = karg if use_hinv else 1. / karg
+        for ix in range(ix_start, ix_end):
+            dx2, scale, jy_start, jy_end = table_row_range(table, use_hinv, karg, px, py, ix, iy_start, iy_end)
+            for iy in range(jy_start, jy_end):
+                val = table_lookup(table, dx2, py - iy, scale)
+                if grid.ndim == 3:
+                    for k in range(wp.size):
+                        grid[k, ix, iy] = val*(wp[k] * hinv * hinv) + grid[k, ix, iy]
+                else:
+                    grid[ix, iy] = val*(wp * hinv * hinv) + grid[ix, iy]
+    if sph_kernel is not None:
+        for ix in range(ix_start, ix_end):
+            for iy in range(iy_start, iy_end):
+                val = sph_kernel(dist(px, py, ix, iy), karg)
+                if grid.ndim == 3:
+                    for k in range(wp.size):
+                        grid[k, ix, iy] = val*wp[k] + grid[k, ix, iy]
+                else:
+                    grid[ix, iy] = val*wp + grid[ix, iy]
+
+#################
+## Render Core ##
+#################
+# Note: sph_kernel and table are the kernel, see splat, karg is h or h_inv (use_hinv),
+#       and the canvas is grid, ndarray([nx, ny]) or ndarray([K, nx, ny]).
+#       render_tiles_parallel is the only core compiled on its own (numba parallel=True),
+#       it is not cached itself but is part of the cached render functions calling it.
+
+@register_jitable
+def render_serial(sph_kernel, table, use_hinv, w, h, karg, p, grid):
+    """
+    Splat the particles one after the other.
+    """
+    nx, ny = grid.shape[-2], grid.shape[-1]
+    npart = h.size
+    for ip in range(npart):
+        ix_start, ix_end, iy_start, iy_end = footprint(p[ip,0], p[ip,1], h[ip], nx, ny)
+        splat(sph_kernel, table, use_hinv, w[ip], karg[ip], p[ip,0], p[ip,1], ix_start, ix_end, iy_start, iy_end, grid)
+    return grid
+
+@njit(cache=True)
+def read_tile(grid, tx_start, tx_end, ty_start, ty_end):
+    # kept out of the parallel loops, where numba would turn the copies into nested parallel loops
+    return grid[..., tx_start:tx_end, ty_start:ty_end].astype(np.float64)
+
+@njit(cache=True)
+def write_tile(grid, acc, tx_start, ty_start):
+    grid[..., tx_start:tx_start+acc.shape[-2], ty_start:ty_start+acc.shape[-1]] = acc
+
+@register_jitable
+def render_tile(sph_kernel, table, use_hinv, accumulate, tile_size, it, offsets, index, w, h, karg, p, grid):
+    """
+    Splat the particles of the tile it, see bin_to_tiles. If accumulate is True (not None),
+    the tile is summed in float64 (with the particle positions relative to the tile) and then
+    written to grid.
+    """
+    nx, ny = grid.shape[-2], grid.shape[-1]
+    nty = (ny + tile_size - 1) // tile_size
+    tx_start, ty_start = (it // nty) * tile_size, (it % nty) * tile_size
+    tx_end, ty_end = min(nx, tx_start + tile_size), min(ny, ty_start + tile_size)
+    if accumulate is not None:
+        acc = read_tile(grid, tx_start, tx_end, ty_start, ty_end)
+        for k in range(offsets[it], offsets[it+1]):
+            ip = index[k]
+            ix_start, ix_end, iy_start, iy_end = footprint(p[ip,0], p[ip,1], h[ip], nx, ny)
+            splat(sph_kernel, table, use_hinv, w[ip], karg[ip], p[ip,0] - tx_start, p[ip,1] - ty_start,
+                  max(ix_start, tx_start) - tx_start, min(ix_end, tx_end) - tx_start,
+                  max(iy_start, ty_start) - ty_start, min(iy_end, ty_end) - ty_start, acc)
+        write_tile(grid, acc, tx_start, ty_start)
+    else:
+        for k in range(offsets[it], offsets[it+1]):
+            ip = index[k]
+            ix_start, ix_end, iy_start, iy_end = footprint(p[ip,0], p[ip,1], h[ip], nx, ny)
+            splat(sph_kernel, table, use_hinv, w[ip], karg[ip], p[ip,0], p[ip,1],
+                  max(ix_start, tx_start), min(ix_end, tx_end),
+                  max(iy_start, ty_start), min(iy_end, ty_end), grid)
+
+@register_jitable
+def render_tiles(sph_kernel, table, use_hinv, accumulate, tile_size, w, h, karg, p, grid):
+    """
+    Bin the particles into screen tiles by footprint and splat the tiles.
+    In render_tiles_parallel the tiles are splatted concurrently. Each tile is only written
+    by one thread, so no race or canvas copy is needed.
+    """
+    nx, ny = grid.shape[-2], grid.shape[-1]
+    ntx = (nx + tile_size - 1) // tile_size
+    nty = (ny + tile_size - 1) // tile_size
+    offsets, index = bin_to_tiles(h, p, nx, ny, tile_size)
+    for it in prange(ntx*nty):
+        render_tile(sph_kernel, table, use_hinv, accumulate, tile_size, it, offsets, index, w, h, karg, p, grid)
+    return grid
+
+render_tiles_parallel = njit(nogil=True, parallel=True)(render_tiles)
+
+@njit(cache=True)
+def deposit_cic(wp, px, py, grid):
+    """
+    Deposit the weight of a sub-pixel particle into its 4 nearest pixels (cloud-in-cell).
+    """
+    nx, ny = grid.shape
+    ix0, iy0 = int(math.floor(px)), int(math.floor(py))
+    tx, ty = px - ix0, py - iy0
+    for a in range(2):
+        ix = ix0 + a
+        if ix < 0 or ix >= nx:
+            continue
+        wx = tx if a else 1. - tx
+        for b in range(2):
+            iy = iy0 + b
+            if iy < 0 or iy >= ny:
+                continue
+            wy = ty if b else 1. - ty
+            grid[ix, iy] += wp * wx * wy
+
+@njit(cache=True)
+def _upsample_weights(n, nc, f):
+    """
+    1D bilinear weights from a coarse axis of nc pixels to a fine axis of n pixels (n <= nc*f),
+    normalized so that every coarse pixel spreads exactly its own value.
+    """
+    j0 = np.empty(nc*f, dtype=np.int64)
+    j1 = np.empty(nc*f, dtype=np.int64)
+    t  = np.empty(nc*f)
+    norm = np.zeros(nc)
+    for i in range(nc*f):
+        u = (i + 0.5) / f - 0.5
+        j = int(math.floor(u))
+        t[i] = u - j
+        j0[i], j1[i] = min(max(j, 0), nc-1), min(max(j+1, 0), nc-1)
+        norm[j0[i]] += 1. - t[i]
+        norm[j1[i]] += t[i]
+    a0 = np.empty(n)
+    a1 = np.empty(n)
+    for i in range(n):
+        a0[i] = (1. - t[i]) / norm[j0[i]]
+        a1[i] = t[i] / norm[j1[i]]
+    return j0, j1, a0, a1
+
+@njit(cache=True)
+def upsample_add(coarse, grid, f):
+    """
+    Upsample a canvas coarser by a factor f and add it to grid, conserving the total.
+    Pixel j of the coarse canvas covers the pixels [j*f, (j+1)*f) of grid.
+    """
+    nx, ny = grid.shape
+    ncx, ncy = coarse.shape
+    jx0, jx1, ax0, ax1 = _upsample_weights(nx, ncx, f)
+    jy0, jy1, ay0, ay1 = _upsample_weights(ny, ncy, f)
+    for ix in range(nx):
+        for iy in range(ny):
+            grid[ix, iy] += ax0[ix] * (ay0[iy] * coarse[jx0[ix], jy0[iy]] + ay1[iy] * coarse[jx0[ix], jy1[iy]]) \
+                          + ax1[ix] * (ay0[iy] * coarse[jx1[ix], jy0[iy]] + ay1[iy] * coarse[jx1[ix], jy1[iy]])
+    return grid
+
+@register_jitable
+def splat_reference(sph_kernel, table, use_hinv, h_ref):
+    """
+    The pixels of a particle with h = h_ref pixels at the center of its window.
+    """
+    ref = np.zeros((int(4*h_ref) + 1, int(4*h_ref) + 1))
+    splat(sph_kernel, table, use_hinv, 1., 1./h_ref if use_hinv else h_ref, 2*h_ref, 2*h_ref, 0, ref.shape[0], 0, ref.shape[1], ref)
+    return ref
+
+def kernel_integral(sph_kernel, table, use_hinv):
+    """
+    The sum of the kernel over the pixels for a large particle (h = 64 pixels).
+    """
+    return njit(cache=table is not None)(splat_reference)(sph_kernel, table, use_hinv, 64.).sum()
+
+@register_jitable
+def render_lod(sph_kernel, table, use_hinv, parallel, accumulate, tile_size, integral, h_min, h_norm, h_max, w, h, karg, p, grid):
+    """
+    Render with level-of-detail handling.
+    - h < h_min:          deposited with cloud-in-cell.
+    - h_min <= h < h_norm: splatted and normalized by the sum of the kernel over its pixels.
+    - h_norm <= h <= h_max: splatted by render_tiles_parallel, render_tiles or render_serial.
+    - h > h_max:          splatted on a canvas coarser by 2^L, such that h / 2^L <= h_max,
+                          which is then upsampled onto the canvas.
+    Every particle then puts (up to the canvas edges) the same total on the canvas, i.e. its
+    weight times the integral of the kernel (integral, see kernel_integral), whatever its size.
+    """
+    nx, ny = grid.shape
+    n_level = max(0, int(math.ceil(math.log2(max(nx, ny) / h_max))))
+    size = int(4*h_norm) + 3
+    npart = w.size
+    scratch = np.zeros((size, size))
+    level = np.zeros(npart, dtype=np.int64)
+    for ip in range(npart):
+        if h[ip] < h_min:
+            deposit_cic(w[ip] * integral, p[ip,0], p[ip,1], grid)
+            level[ip] = -1
+        elif h[ip] < h_norm:
+            # the full window, also outside the canvas, so that the normalization is not biased
+            ix_start, ix_end = int(math.floor(p[ip,0] - 2*h[ip])), int(math.floor(p[ip,0] + 2*h[ip])) + 1
+            iy_start, iy_end = int(math.floor(p[ip,1] - 2*h[ip])), int(math.floor(p[ip,1] + 2*h[ip])) + 1
+            sx, sy = ix_end - ix_start, iy_end - iy_start
+            scratch[:sx, :sy] = 0.
+            splat(sph_kernel, table, use_hinv, 1., karg[ip], p[ip,0] - ix_start, p[ip,1] - iy_start, 0, sx, 0, sy, scratch)
+            norm = scratch[:sx, :sy].sum() / integral
+            if norm > 0:
+                for ix in range(max(0, ix_start), min(nx, ix_end)):
+                    for iy in range(max(0, iy_start), min(ny, iy_end)):
+                        grid[ix, iy] += scratch[ix - ix_start, iy - iy_start] * w[ip] / norm
+            level[ip] = -1
+        elif h[ip] > h_max:
+            level[ip] = min(n_level, int(math.ceil(math.log2(h[ip] / h_max))))
+
+    sel = np.nonzero(level == 0)[0]
+    if parallel:
+        render_tiles_parallel(sph_kernel, table, use_hinv, accumulate, tile_size, w[sel], h[sel], karg[sel], p[sel], grid)
+    elif accumulate is not None:
+        render_tiles(sph_kernel, table, use_hinv, accumulate, tile_size, w[sel], h[sel], karg[sel], p[sel], grid)
+    else:
+        render_serial(sph_kernel, table, use_hinv, w[sel], h[sel], karg[sel], p[sel], grid)
+
+    for lv in range(1, n_level+1):
+        sel = np.nonzero(level == lv)[0]
+        if sel.size == 0:
+            continue
+        f = 2**lv
+        ncx, ncy = (nx + f - 1) // f, (ny + f - 1) // f
+        coarse = np.zeros((ncx, ncy))
+        for ip in sel:
+            pcx, pcy, hc = (p[ip,0] + 0.5) / f - 0.5, (p[ip,1] + 0.5) / f - 0.5, h[ip] / f
+            kargc = karg[ip] * f if use_hinv else karg[ip] / f
+            ix_start, ix_end, iy_start, iy_end = footprint(pcx, pcy, hc, ncx, ncy)
+            splat(sph_kernel, table, use_hinv, w[ip], kargc, pcx, pcy, ix_start, ix_end, iy_start, iy_end, coarse)
+        upsample_add(coarse, grid, f)
+    return grid
+
+render_funcs = {}
+
+def render_func_factory(sph_kernel, npix_x=None, npix_y=None, use_hinv=False, parallel=False, tile_size=64,
+                        kernel_table=None, lod=False, h_min=0.5, h_norm=4., h_max=32., n_channel=None,
+                        dtype=np.float64, canvas_dtype=None, accumulate="canvas"):
     """
     A factory function to generate a render function.
-    
+    Within one process the same options return the same function (render_funcs). With a
+    kernel_table, the render function is also cached on disk (numba cache=True), so a new
+    process loads it instead of compiling it. The resolution is taken from grid, so one
+    render function serves any canvas size.
+    ------
+    sph_kernel - the SPH kernel in sph_kernels, taking (r, h) or (r, h_inv) if use_hinv
+    npix_x     - deprecated and not used, the render function takes the resolution from grid
+    npix_y     - deprecated and not used, the render function takes the resolution from grid
+    use_hinv   - bool. If True, the render function takes (w, h, h_inv, p, grid)
+    parallel   - bool. If True, the particles are binned into screen tiles by footprint
+                 and the tiles are splatted concurrently with numba.prange.
+                 Each tile is only written by one thread, so no race or canvas copy is needed,
+                 and the result matches the serial render function.
+    tile_size  - int. the size of screen tiles in pixels (only used if parallel or accumulate="tile")
+    kernel_table - sph_kernels.KernelTable of sph_kernel, or True to build one.
+                 If given, the kernel is evaluated from the table and the pixels
+                 outside the support circle are skipped row by row.
+    lod        - bool. If True, handle the particles by their size on the canvas:
+                 sub-pixel particles (h < h_min) are deposited with cloud-in-cell,
+                 small ones (h < h_norm) are normalized to conserve their weight,
+                 and large ones (h > h_max) are splatted on coarser canvases and upsampled.
+                 See render_lod.
+    h_min, h_norm, h_max - float. the thresholds in pixels for lod. Above h_norm = 4, the sum
+                 of the kernel over the pixels is within 1e-3 of its integral without normalizing.
+    n_channel  - int. If given, render n_channel quantities in one pass: the render function
+                 takes w as ndarray([n_part, n_channel]) and grid as ndarray([n_channel, npix_x, npix_y]),
+                 and the kernel is evaluated once per pixel for all channels. See channels.Channels.
+                 Not with lod.
+    dtype      - np.float64 or np.float32. the dtype of the particles (w, h, p) taken by the render function.
+    canvas_dtype - np.float64 or np.float32. the dtype of grid, by default dtype.
+                 With float32, the canvas takes half the memory and MPI reduction volume.
+                 The kernel itself is always evaluated in float64.
+                 Note particles much smaller than a pixel are sampled at the pixel centers only, and
+                 the float32 rounding of their positions (~1e-5 pixel) can move them in or out of a
+                 pixel; use lod to deposit them in a way that is smooth in the position.
+    accumulate - "canvas" - add every particle to grid directly, rounding to canvas_dtype every time.
+                 "tile"   - bin the particles into tiles (as with parallel) and accumulate every tile
+                            in float64 before rounding it once to canvas_dtype. With a float32 canvas
+                            the error is then that of float32 storage, not of float32 summation.
     """
+    if npix_x is not None or npix_y is not None:
+        warnings.warn("npix_x and npix_y of render_func_factory are deprecated and not used, "
+                      "the render function takes the resolution from grid.", DeprecationWarning, stacklevel=2)
+    multi = n_channel is not None
+    if multi and lod:
+        raise ValueError("lod is not supported with n_channel.")
+    if accumulate not in ("canvas", "tile"):
+        raise ValueError(f"Unknown accumulate {accumulate}. Use 'canvas' or 'tile'.")
+    if kernel_table is True:
+        kernel_table = KernelTable(sph_kernel)
+    if kernel_table is not None and kernel_table is not False:
+        sph_kernel, table = None, table_ref(kernel_table)
+        key = (table[0].tobytes(), table[1], table[2])
+    else:
+        table = None
+        key = (sph_kernel, )
     if use_hinv:
         warnings.warn("Using hinv option. Please ensure the SPH kernel take hinv as input.")
-        sph_kernel_hinv = sph_kernel
-        @njit(float64[:,:](float64[:], float64[:], float64[:], float64[:,:], float64[:,:]))
+    dtype = np.dtype(dtype)
+    canvas_dtype = dtype if canvas_dtype is None else np.dtype(canvas_dtype)
+    key = key + (use_hinv, parallel, tile_size, lod, h_min, h_norm, h_max, multi, dtype, canvas_dtype, accumulate)
+    if key in render_funcs:
+        return render_funcs[key]
+
+    # None rather than False, so that numba drops the float64 tiles when they are not used
+    accumulate = True if accumulate == "tile" else None
+    integral = kernel_integral(sph_kernel, table, use_hinv) if lod else 0.
+
+    # the GIL is released, so that e.g. the next snapshot can be read in a thread, see series.SnapshotSeries
+    # the explicit signature, e.g. float64[:,:](float64[:], float64[:], float64[:,:], float64[:,:])
+    ft = numba.from_dtype(dtype)
+    ct = numba.from_dtype(canvas_dtype)
+    wt, gt = (ft[:,:], ct[:,:,:]) if multi else (ft[:], ct[:,:])
+    if use_hinv:
+        @njit(gt(wt, ft[:], ft[:], ft[:,:], gt), nogil=True, cache=table is not None)
         def render_cpu(w, h, h_inv, p, grid):
-            nx, ny = npix_x, npix_y
-            npart = w.size
-            for ip in range(npart):
-                ix_start, ix_end = int(max(0, p[ip,0] - 2*h[ip])), int(min(nx, p[ip,0] + 2*h[ip]))
-                iy_start, iy_end = int(max(0, p[ip,1] - 2*h[ip])), int(min(ny, p[ip,1] + 2*h[ip]))
-                for ix in range(ix_start, ix_end):
-                    for iy in range(iy_start, iy_end):
-                        r = dist(p[ip,0], p[ip,1], ix, iy)
-                        grid[ix, iy] = sph_kernel_hinv(r, h_inv[ip])*w[ip] + grid[ix, iy]
-            return grid
+            if lod:
+                return render_lod(sph_kernel, table, use_hinv, parallel, accumulate, tile_size, integral,
+                                  h_min, h_norm, h_max, w, h, h_inv, p, grid)
+            elif parallel:
+                return render_tiles_parallel(sph_kernel, table, use_hinv, accumulate, tile_size, w, h, h_inv, p, grid)
+            elif accumulate is not None:
+                return render_tiles(sph_kernel, table, use_hinv, accumulate, tile_size, w, h, h_inv, p, grid)
+            return render_serial(sph_kernel, table, use_hinv, w, h, h_inv, p, grid)
     else:
-        @njit(float64[:,:](float64[:], float64[:], float64[:,:], float64[:,:]))
+        @njit(gt(wt, ft[:], ft[:,:], gt), nogil=True, cache=table is not None)
         def render_cpu(w, h, p, grid):
-            nx, ny = npix_x, npix_y
-            npart = w.size
-            for ip in range(npart):
-                ix_start, ix_end = int(max(0, p[ip,0] - 2*h[ip])), int(min(nx, p[ip,0] + 2*h[ip]))
-                iy_start, iy_end = int(max(0, p[ip,1] - 2*h[ip])), int(min(ny, p[ip,1] + 2*h[ip]))
-                for ix in range(ix_start, ix_end):
-                    for iy in range(iy_start, iy_end):
-                        r = dist(p[ip,0], p[ip,1], ix, iy)
-                        grid[ix, iy] = sph_kernel(r, h[ip])*w[ip] + grid[ix, iy]
-            return grid
+            if lod:
+                return render_lod(sph_kernel, table, use_hinv, parallel, accumulate, tile_size, integral,
+                                  h_min, h_norm, h_max, w, h, h, p, grid)
+            elif parallel:
+                return render_tiles_parallel(sph_kernel, table, use_hinv, accumulate, tile_size, w, h, h, p, grid)
+            elif accumulate is not None:
+                return render_tiles(sph_kernel, table, use_hinv, accumulate, tile_size, w, h, h, p, grid)
+            return render_serial(sph_kernel, table, use_hinv, w, h, h, p, grid)
+    render_funcs[key] = render_cpu
     return render_cpu
 
+def precompile(names=None, **options):
+    """
+    Compile (or load from the numba cache) the render functions of the kernels in
+    sph_kernels.kernels, e.g. once after installation or before a run, so that the
+    first frame is not delayed by the compilation.
+    ------
+    names   - list of str. the kernels to compile, by default all of sph_kernels.kernels.
+              The kernels ending with "_hinv" are compiled with use_hinv=True.
+    options - passed to render_func_factory, e.g. parallel=True, lod=True.
+              kernel_table is True by default and uses sph_kernels.get_kernel_table: only
+              the render functions with a table are cached on disk, with kernel_table=None
+              they are compiled for this process only.
+    ------
+    render_funcs - dict. name: render function
+    """
+    names = list(kernels) if names is None else names
+    funcs = {}
+    for name in names:
+        kwargs = dict(options)
+        kwargs.setdefault("kernel_table", True)
+        kwargs.setdefault("use_hinv", name.endswith("_hinv"))
+        if kwargs.get("kernel_table") is True:
+            kwargs["kernel_table"] = get_kernel_table(name)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            funcs[name] = render_func_factory(kernels[name], **kwargs)
+    return funcs
@@ -0,0 +1,213 @@
+import numpy as np
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from .mpi_wrapper import mpi_render_wrap, close_all, finished
+from .snap_io import NpySnapshot, local_range
+
+#################
+## Time Series ##
+#################
+# Note: A movie following the simulation through time renders every frame from the
+#       snapshot of its time. The snapshots are loaded by a background thread one step
+#       ahead, so that reading and decoding the next snapshot overlaps with rendering the
+#       current one; at most two snapshots (three with interpolation) are in memory.
+#       The render functions and the projection release the GIL, so the thread runs
+#       while the frames are rendered.
+
+def npy_loader(comm=None, qty="rho", dtype=float):
+    """
+    Return a loader for SnapshotSeries reading the .npy layout of the example.
+    With comm, every rank only reads its own particles (mpi_render_wrap(..., local=True)).
+    """
+    def load(filename):
+        snap = NpySnapshot(filename)
+        start, end = (0, None) if comm is None else local_range(snap.n_part, comm.Get_rank(), comm.Get_size())
+        return tuple(np.ascontiguousarray(snap.column(name, start, end), dtype=dtype)
+                     for name in ("pos", "hsml", qty))
+    return load
+
+class SnapshotSeries(object):
+    def __init__(self, snapshots, snap_frames, loader, interpolate=False, box_size=None, prefetch=True):
+        """
+        The snapshots of a movie through time.
+        snapshots:   list of str
+                     the snapshot files, in order of time.
+        snap_frames: ndarray([n_snap, ])
+                     the frame at which every snapshot is shown, increasing.
+                     Frame i shows the last snapshot k with snap_frames[k] <= i (the first
+                     snapshot before snap_frames[0]).
+        loader:      function
+                     loader(filename) returns pos, hsml, qty of a snapshot as ndarrays, e.g.
+                     npy_loader(comm) or lambda fn: HDF5Snapshot(fn).read_local(comm).
+                     It runs in a background thread, so it must not communicate over MPI.
+                     It may return the particle ids as a 4th array, then the particles
+                     are sorted by id for the interpolation.
+        interpolate: bool
+                     If True, the frames between snap_frames[k] and snap_frames[k+1] are
+                     rendered from pos, hsml and qty interpolated linearly between the two
+                     snapshots. The snapshots must hold the same particles (on every rank).
+        box_size:    float
+                     For a periodic box, the positions are interpolated along the shortest
+                     displacement.
+        prefetch:    bool
+                     If False, the snapshots are loaded when needed, without a thread.
+        """
+        self.snapshots = list(snapshots)
+        self.snap_frames = np.asarray(snap_frames)
+        if len(self.snap_frames) != len(self.snapshots) or np.any(np.diff(self.snap_frames) <= 0):
+            raise ValueError("snap_frames needs one increasing frame per snapshot.")
+        self.loader = loader
+        self.interpolate = interpolate
+        self.box_size = box_size
+        self.executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        self.loaded = {}
+        self.load_wait = 0.
+
+    def _load(self, k):
+        data = tuple(self.loader(self.snapshots[k]))
+        if len(data) == 4:
+            order = np.argsort(data[3], kind="stable")
+            data = tuple(np.take(arr, order, axis=0) for arr in data)
+        return data
+
+    def _submit(self, k):
+        if k in self.loaded or k >= len(self.snapshots):
+            return
+        if self.executor is None:
+            self.loaded[k] = self._load(k)
+        else:
+            self.loaded[k] = self.executor.submit(self._load, k)
+
+    def get(self, k):
+        """
+        Return the data of snapshot k (and k+1 with interpolate), and start loading the next one.
+        The snapshots before k are released.
+        """
+        needed = [k, k+1] if self.interpolate and k+1 < len(self.snapshots) else [k]
+        for j in needed:
+            self._submit(j)
+        for j in list(self.loaded):
+            if j < k:
+                del self.loaded[j]
+        t_start = time.perf_counter()
+        data = []
+        for j in needed:
+            if not isinstance(self.loaded[j], tuple):
+                self.loaded[j] = self.loaded[j].result()
+            data.append(self.loaded[j])
+        self.load_wait += time.perf_counter() - t_start
+        self._submit(needed[-1] + 1)
+        return data
+
+    def segments(self, n_frame):
+        """
+        Return (k, frame_start, frame_end, t) for the frames [0, n_frame): the frames shown from
+        snapshot k, and their weights t, ndarray([frame_end - frame_start]) in [0, 1), between
+        snapshot k and k+1 (all 0 without interpolate).
+        """
+        k_of = np.maximum(np.searchsorted(self.snap_frames, np.arange(n_frame), side="right") - 1, 0)
+        segments = []
+        for k in np.unique(k_of):
+            frame_ids = np.nonzero(k_of == k)[0]
+            frame_start, frame_end = int(frame_ids[0]), int(frame_ids[-1]) + 1
+            t = np.zeros(frame_end - frame_start)
+            if self.interpolate and k+1 < len(self.snapshots):
+                t = np.maximum(np.arange(frame_start, frame_end) - self.snap_frames[k], 0) \
+                    / (self.snap_frames[k+1] - self.snap_frames[k])
+            segments.append((int(k), frame_start, frame_end, t))
+        return segments
+
+    def check(self, data):
+        """
+        Check that two snapshots hold the same particles, so that they can be interpolated.
+        """
+        if len(data[0]) == 4 and not np.array_equal(data[0][3], data[1][3]):
+            raise ValueError("The snapshots do not hold the same particles, they cannot be interpolated.")
+        if len(data[0][0]) != len(data[1][0]):
+            raise ValueError(f"The snapshots hold {len(data[0][0])} and {len(data[1][0])} particles, they cannot be interpolated.")
+
+    def blend(self, data, t, start=0, end=None):
+        """
+        Interpolate pos, hsml and qty of the particles [start, end) between two snapshots,
+        see check.
+        """
+        (pos0, hsml0, qty0), (pos1, hsml1, qty1) = [[arr[start:end] for arr in d[:3]] for d in data]
+        if t == 0:
+            return pos0, hsml0, qty0
+        dpos = pos1 - pos0
+        if self.box_size is not None:
+            dpos -= self.box_size * np.round(dpos / self.box_size)
+        return pos0 + t * dpos, hsml0 + t * (hsml1 - hsml0), qty0 + t * (qty1 - qty0)
+
+    def blend_frame(self, data, t, frame_id, start, end):
+        """
+        blend for the frame frame_id of a segment with the weights t, see segments.
+        partial(series.blend_frame, data, t) is the blend of mpi_render_wrap.
+        """
+        return self.blend(data, t[frame_id], start, end)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        self.loaded = {}
+
+def mpi_render_series(series, frames, render_func, npix_x, npix_y, plot_n_save=None, sinks=None,
+                      tmp_path="../tmp/", movie_path="../movies/", img_prefix="img", MPI=None, **kwargs):
+    """
+    Render a movie through the snapshots of series in one run, with one mpi_render_wrap call
+    for the frames of every snapshot. With interpolate, every frame is blended to its time in
+    the render loop (mpi_render_wrap(..., blend=...)), so the frames between two snapshots are
+    distributed over the ranks like any others. The render function is compiled once, the
+    sinks (e.g. sinks.FFmpegSink) take all frames, and the next snapshot is loaded in the
+    background while the current one is rendered.
+    ------
+    series - SnapshotSeries
+    frames - all frames of the movie, see mpi_render_wrap. The frame frames[i] is output as frame i.
+    kwargs - passed to mpi_render_wrap, e.g. local=True for a loader reading the local particles.
+             The frame cache (bound to one snapshot) is not supported.
+    ------
+    reports - list of the reports of mpi_render_wrap, with the snapshot and the time waited
+              for it to be loaded ("load_wait").
+    """
+    if kwargs.get("cache") is not None:
+        raise ValueError("The frame cache is not supported with a time series.")
+    if MPI is None:
+        from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    sinks = list(sinks) if sinks is not None else []
+    reports = []
+    try:
+        for k, frame_start, frame_end, t in series.segments(len(frames)):
+            wait = series.load_wait
+            data = series.get(k)
+            wait = series.load_wait - wait
+            blend = None
+            if np.any(t > 0):
+                series.check(data)
+                # every frame is interpolated to its time in the render loop, chunk by chunk
+                blend = partial(series.blend_frame, data, t)
+            pos, hsml, qty = data[0][:3]
+            if rank == 0:
+                print(f"Frames {frame_start}-{frame_end-1}: snapshot {series.snapshots[k]}"
+                      + (f" interpolated to {series.snapshots[k+1]}" if blend is not None else "")
+                      + f", waited {wait:.2f} s for the data.")
+            report = mpi_render_wrap(pos, hsml, qty, frames[frame_start:frame_end], render_func, npix_x, npix_y,
+                                     plot_n_save=plot_n_save, sinks=sinks, tmp_path=tmp_path, movie_path=movie_path,
+                                     img_prefix=img_prefix, frame_offset=frame_start, close_sinks=False,
+                                     blend=blend, MPI=MPI, **kwargs)
+            report.update(snapshot=k, load_wait=wait)
+            reports.append(report)
+            del pos, hsml, qty, data, blend
+    finally:
+        series.close()
+
+    close_all(sinks, rank)
+    if plot_n_save is not None and hasattr(plot_n_save, "close"):
+        plot_n_save.close()
+    comm.Barrier()
+    if rank == 0:
+        finished(plot_n_save is None or any(sink.ordered for sink in sinks), tmp_path, img_prefix, movie_path)
+    return reports
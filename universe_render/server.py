@@ -0,0 +1,322 @@
+import numpy as np
+import asyncio
+import base64
+import json
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .camera import ProjectionBuffer
+from .frames import frame_to_camera
+from .mpi_wrapper import render_frame, canvas_layout
+from .spatial import ParticleTree
+from .plot import ColormapLUT, encode_png
+
+###################
+## Render Server ##
+###################
+# Note: A long-lived process keeping one snapshot in memory and rendering previews of
+#       camera frames on request, e.g. while designing a camera path for
+#       frames.write_frame_file. The particles, their subsamples and the k-d trees are
+#       prepared once, and the render function is compiled once.
+#       The protocol is one JSON object per line over a local socket (TCP or unix):
+#       request   {"id": 1, "frame": [t, x, y, z, dx, dy, dz, fov, n, f],
+#                  "npix": [nx, ny], "format": "png" | "map", "levels": 3}
+#                 {"cancel": 1}
+#       responses {"id": 1, "level": 0, "n_level": 3, "n_part": ..., "shape": [...],
+#                  "format": ..., "data": base64, "time": s, "final": false}, one per level,
+#                 {"id": 1, "cancelled": true} or {"id": 1, "error": "..."}
+#       "npix", "format" and "levels" (the number of the finest levels to send, 1 for
+#       the full set only) are optional.
+#       Every request is rendered from a random subsample first and then refined up to all
+#       particles. A new request on a connection cancels the one still running there, so a
+#       client moving the camera only waits for the latest frame. A level being rendered
+#       is finished, the cancel takes effect before the next level.
+
+class RenderServer(object):
+    def __init__(self, pos, hsml, qty, render_func, npix_x, npix_y, use_hinv=False, use_tree=True,
+                 fractions=(1/64, 1/8, 1.), format="png", lut=None, canvas_dtype=None, max_npix=4096, seed=0):
+        """
+        Render previews of one snapshot for the clients of a local socket.
+        pos, hsml, qty: ndarray
+                     the particles, see mpi_render_wrap. qty can also be a channels.Channels;
+                     the images then show the first map.
+        render_func: function
+                     the render function produced by render_func_factory. It takes the
+                     resolution from the canvas, so the clients can ask for any npix.
+        npix_x:      int
+        npix_y:      int
+                     the resolution when a request does not give one.
+        use_hinv:    bool
+                     see mpi_render_wrap.
+        use_tree:    bool
+                     If True, a spatial.ParticleTree is built for every level.
+        fractions:   tuple of float
+                     the fraction of the particles rendered at every level of refinement,
+                     increasing up to 1. The subsample of a fraction f keeps the expected map:
+                     the weights are divided by f, and hsml is multiplied by f^(-1/3) so that
+                     every particle still overlaps about as many neighbours.
+        format:      str
+                     "png" for an image with lut, or "map" for the map as float32.
+        lut:         plot.ColormapLUT
+                     the colormap of the images, by default the one of plot.rho_map.
+        canvas_dtype: the dtype of the canvas, by default the dtype of hsml.
+        max_npix:    int
+                     the largest resolution accepted along one axis.
+        seed:        int
+                     the seed of the subsamples.
+        """
+        if any(f <= 0 or f > 1 for f in fractions) or list(fractions) != sorted(fractions):
+            raise ValueError("fractions must be increasing within (0, 1].")
+        self.qty = qty
+        self.render_func = render_func
+        self.npix_x, self.npix_y = npix_x, npix_y
+        self.use_hinv = use_hinv
+        self.format = format
+        self.lut = ColormapLUT() if lut is None else lut
+        self.canvas_dtype = hsml.dtype if canvas_dtype is None else canvas_dtype
+        self.max_npix = max_npix
+
+        weight = np.asarray(qty, dtype=hsml.dtype)
+        n_part = len(hsml)
+        perm = np.random.default_rng(seed).permutation(n_part)
+        self.levels = []
+        for f in fractions:
+            n = max(1, int(round(f * n_part)))
+            if n == n_part:
+                level = (pos, hsml, weight)
+            else:
+                # sorted, so that the subsample is read in the order of the snapshot
+                idx = np.sort(perm[:n])
+                scale = n_part / n
+                level = (pos[idx], (hsml[idx] * scale**(1/3)).astype(hsml.dtype), (weight[idx] * scale).astype(hsml.dtype))
+            tree = ParticleTree(level[0], level[1]) if use_tree else None
+            self.levels.append(level + (tree, ProjectionBuffer(dtype=hsml.dtype)))
+        # one render at a time, so that the levels can reuse their buffers
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.address = None
+        self.server = None
+        self.loop = None
+        self.thread = None
+
+    def render(self, frame, npix_x=None, npix_y=None, level=-1):
+        """
+        Render frame from the particles of a level of refinement (by default all particles).
+        ------
+        maps - ndarray([npix_x, npix_y]), or ndarray([n_map, npix_x, npix_y]) for several maps
+        """
+        npix_x = self.npix_x if npix_x is None else npix_x
+        npix_y = self.npix_y if npix_y is None else npix_y
+        pos, hsml, weight, tree, buf = self.levels[level]
+        canvas_shape, finalize = canvas_layout(self.qty, npix_x, npix_y)
+        grid = np.zeros(canvas_shape, dtype=self.canvas_dtype)
+        render_frame(frame_to_camera(np.asarray(frame, dtype=float)), pos, hsml, weight, self.render_func, grid,
+                     npix_x, npix_y, use_hinv=self.use_hinv, tree=tree, buf=buf)
+        return finalize(grid)
+
+    def encode(self, maps, format):
+        """
+        Return the bytes sent for the maps: a PNG image of the (first) map, or the maps as float32.
+        """
+        if format == "png":
+            return encode_png(self.lut(maps[0] if maps.ndim == 3 else maps))
+        elif format == "map":
+            return np.ascontiguousarray(maps, dtype="<f4").tobytes()
+        raise ValueError(f"Unknown format {format}. Use 'png' or 'map'.")
+
+    def _parse(self, request):
+        frame = np.asarray(request["frame"], dtype=float)
+        if frame.shape != (10, ):
+            raise ValueError("frame must hold the 10 numbers of a frame, see frames.")
+        npix_x, npix_y = request.get("npix", (self.npix_x, self.npix_y))
+        npix_x, npix_y = int(npix_x), int(npix_y)
+        if not (0 < npix_x <= self.max_npix and 0 < npix_y <= self.max_npix):
+            raise ValueError(f"npix must be within 1 and {self.max_npix}.")
+        format = request.get("format", self.format)
+        if format not in ("png", "map"):
+            raise ValueError(f"Unknown format {format}. Use 'png' or 'map'.")
+        n_level = len(self.levels)
+        levels = range(n_level - min(n_level, max(1, int(request.get("levels", n_level)))), n_level)
+        return frame, npix_x, npix_y, format, levels
+
+    async def _respond(self, request, writer):
+        loop = asyncio.get_running_loop()
+        request_id = request.get("id")
+        try:
+            frame, npix_x, npix_y, format, levels = self._parse(request)
+            for level in levels:
+                t_start = time.perf_counter()
+                maps = await loop.run_in_executor(self.executor, self.render, frame, npix_x, npix_y, level)
+                data = await loop.run_in_executor(self.executor, self.encode, maps, format)
+                response = {"id": request_id, "level": level, "n_level": len(self.levels),
+                            "n_part": len(self.levels[level][1]), "shape": list(maps.shape),
+                            "format": format, "data": base64.b64encode(data).decode(),
+                            "time": time.perf_counter() - t_start, "final": level == levels[-1]}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except Exception as e:
+            writer.write(json.dumps({"id": request_id, "error": f"{type(e).__name__}: {e}"}).encode() + b"\n")
+
+    def _cancel(self, task, task_id, writer):
+        # the reply is sent here, as a task cancelled before it started never runs _respond
+        if task is not None and not task.done():
+            task.cancel()
+            writer.write(json.dumps({"id": task_id, "cancelled": True}).encode() + b"\n")
+
+    async def _handle(self, reader, writer):
+        task, task_id = None, None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    writer.write(json.dumps({"id": None, "error": f"Invalid request: {e}"}).encode() + b"\n")
+                    continue
+                if "cancel" in request:
+                    if task_id == request["cancel"]:
+                        self._cancel(task, task_id, writer)
+                    continue
+                # the request still running is stale
+                self._cancel(task, task_id, writer)
+                task, task_id = asyncio.create_task(self._respond(request, writer)), request.get("id")
+        except ConnectionError:
+            pass
+        finally:
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=0, path=None):
+        """
+        Start serving on host:port (port 0 picks a free port), or on the unix socket path.
+        The address is then in self.address.
+        ------
+        server - asyncio.Server
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle, path=path)
+            self.address = path
+        else:
+            server = await asyncio.start_server(self._handle, host=host, port=port)
+            self.address = server.sockets[0].getsockname()[:2]
+        return server
+
+    def serve_forever(self, host="127.0.0.1", port=0, path=None):
+        """
+        Serve until interrupted, e.g. as the main program of a preview session.
+        """
+        async def main():
+            server = await self.serve(host, port, path)
+            print(f"Serving previews on {self.address}")
+            async with server:
+                await server.serve_forever()
+        asyncio.run(main())
+
+    def start(self, host="127.0.0.1", port=0, path=None):
+        """
+        Serve in a background thread, e.g. from a notebook, until self.stop().
+        ------
+        address - (host, port) or the unix socket path, for RenderClient
+        """
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(self.serve(host, port, path))
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        return self.address
+
+    def stop(self):
+        if self.thread is None:
+            return
+        async def shutdown():
+            self.server.close()
+            await self.server.wait_closed()
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.thread = None
+
+class RenderClient(object):
+    def __init__(self, address, timeout=None):
+        """
+        A blocking client of a RenderServer.
+        address: tuple or str
+                 (host, port), or the path of a unix socket, see RenderServer.start.
+        timeout: float
+                 the timeout of the socket in seconds.
+        """
+        if isinstance(address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(tuple(address) if not isinstance(address, str) else address)
+        self.file = self.sock.makefile("rb")
+        self.next_id = 0
+
+    def _send(self, message):
+        self.sock.sendall(json.dumps(message).encode() + b"\n")
+
+    def request(self, frame, npix_x=None, npix_y=None, format=None, levels=None):
+        """
+        Send a request without waiting for it, and return its id. The request still running
+        on this connection is cancelled.
+        """
+        self.next_id += 1
+        message = {"id": self.next_id, "frame": [float(_) for _ in frame]}
+        if npix_x is not None:
+            message["npix"] = [npix_x, npix_y]
+        if format is not None:
+            message["format"] = format
+        if levels is not None:
+            message["levels"] = levels
+        self._send(message)
+        return self.next_id
+
+    def cancel(self, request_id):
+        self._send({"cancel": request_id})
+
+    def receive(self):
+        """
+        Wait for the next response.
+        ------
+        response - dict, see RenderServer
+        data     - the maps as ndarray (format "map"), the PNG bytes (format "png"), or None
+        """
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("The render server closed the connection.")
+        response = json.loads(line)
+        data = response.pop("data", None)
+        if data is not None:
+            data = base64.b64decode(data)
+            if response["format"] == "map":
+                data = np.frombuffer(data, dtype="<f4").reshape(response["shape"])
+        return response, data
+
+    def render(self, frame, npix_x=None, npix_y=None, format=None, levels=None):
+        """
+        Request frame and yield (response, data) for every level of refinement, up to the final one.
+        The responses of older requests are skipped.
+        """
+        request_id = self.request(frame, npix_x, npix_y, format, levels)
+        while True:
+            response, data = self.receive()
+            if response.get("id") != request_id:
+                continue
+            if "error" in response:
+                raise RuntimeError(f"The render server failed: {response['error']}")
+            if response.get("cancelled"):
+                return
+            yield response, data
+            if response["final"]:
+                return
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
@@ -0,0 +1,159 @@
+import numpy as np
+import subprocess
+import threading
+import queue
+
+from .plot import ColormapLUT
+
+###########
+## Sinks ##
+###########
+# Note: A sink takes the rendered maps of mpi_render_wrap with sink.write(frame_id, arr)
+#       and is finalized with sink.close().
+#       An "ordered" sink needs all frames in order in one process. The wrapper then
+#       converts every map with sink.encode(arr) on the rank that rendered it, and
+#       sends the result (ndarray(sink.shape) of sink.dtype) to rank 0, which calls
+#       sink.write(frame_id, payload) once the frame arrives.
+
+class MapSink(object):
+    ordered = False
+
+    def __init__(self, tmp_path="../tmp/", map_prefix="map"):
+        """
+        Save every map as {tmp_path}/{map_prefix}_XXXX.npy.
+        """
+        self.tmp_path = tmp_path
+        self.map_prefix = map_prefix
+
+    def filename(self, frame_id):
+        return f"{self.tmp_path}/{self.map_prefix}_{str(frame_id).zfill(4)}.npy"
+
+    def write(self, frame_id, arr):
+        np.save(self.filename(frame_id), arr)
+
+    def close(self):
+        pass
+
+class ImageSink(object):
+    ordered = False
+
+    def __init__(self, plot_n_save, tmp_path="../tmp/", img_prefix="img", ftype="jpg", channel=None):
+        """
+        Save every map as an image {tmp_path}/{img_prefix}_XXXX.{ftype} with plot_n_save,
+        e.g. plot.rho_map or plot.ImageWriter.
+        For maps of several channels, channel selects the map to plot.
+        """
+        self.plot_n_save = plot_n_save
+        self.tmp_path = tmp_path
+        self.img_prefix = img_prefix
+        self.ftype = ftype
+        self.channel = channel
+
+    def filename(self, frame_id):
+        return f"{self.tmp_path}/{self.img_prefix}_{str(frame_id).zfill(4)}.{self.ftype}"
+
+    def write(self, frame_id, arr):
+        if self.channel is not None:
+            arr = arr[self.channel]
+        self.plot_n_save(arr, self.filename(frame_id), self.tmp_path)
+
+    def close(self):
+        if hasattr(self.plot_n_save, "close"):
+            self.plot_n_save.close()
+
+class FFmpegSink(object):
+    ordered = True
+
+    def __init__(self, filename, npix_x, npix_y, framerate=24, lut=None, first_frame=0, max_pending=8,
+                 ffmpeg="ffmpeg", codec_args=("-c:v", "libx264", "-profile:v", "high", "-pix_fmt", "yuv420p"),
+                 channel=None):
+        """
+        Encode the frames into a movie by piping raw RGB frames into an ffmpeg process.
+        No intermediate file is written.
+        filename:    str
+                     the output movie.
+        npix_x:      int
+        npix_y:      int
+                     the size of the frames.
+        framerate:   float
+                     frames per second of the movie.
+        lut:         plot.ColormapLUT
+                     the colormap, by default the one of plot.rho_map.
+        first_frame: int
+                     the frame_id of the first frame of the movie.
+        max_pending: int
+                     the number of frames queued for ffmpeg at most. write() blocks when
+                     ffmpeg falls behind, so the memory use is bounded.
+        ffmpeg:      str
+                     the ffmpeg executable.
+        codec_args:  tuple
+                     the output options of ffmpeg.
+        channel:     int
+                     For maps of several channels, the map to encode.
+        """
+        self.lut = ColormapLUT() if lut is None else lut
+        self.shape = (npix_y, npix_x, 3)
+        self.dtype = np.uint8
+        self.next_frame = first_frame
+        self.early = {}
+        self.cmd = [ffmpeg, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24",
+                    "-s", f"{npix_x}x{npix_y}", "-r", str(framerate), "-i", "-", *codec_args, filename]
+        self.max_pending = max_pending
+        self.proc = None
+        self.error = None
+        self.channel = channel
+
+    def _start(self):
+        # ffmpeg is only started by the process that writes the frames
+        self.proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE)
+        self.queue = queue.Queue(maxsize=self.max_pending)
+        self.thread = threading.Thread(target=self._pipe, daemon=True)
+        self.thread.start()
+
+    def _pipe(self):
+        while True:
+            rgb = self.queue.get()
+            if rgb is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.proc.stdin.write(rgb.tobytes())
+            except (BrokenPipeError, OSError) as e:
+                self.error = e
+
+    def encode(self, arr):
+        """
+        Convert a map into an RGB frame.
+        """
+        if self.channel is not None:
+            arr = arr[self.channel]
+        return np.ascontiguousarray(self.lut(arr))
+
+    def write(self, frame_id, rgb):
+        """
+        Queue an RGB frame. Frames arriving early are held until the frames before them arrive.
+        """
+        if self.proc is None:
+            self._start()
+        self.early[frame_id] = rgb
+        while self.next_frame in self.early:
+            self.queue.put(self.early.pop(self.next_frame))
+            self.next_frame += 1
+
+    def close(self):
+        """
+        Flush the frames, wait for ffmpeg and raise if it failed or a frame is missing.
+        """
+        if self.proc is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.proc.stdin.close()
+        ret = self.proc.wait()
+        self.proc = None
+        if self.error is not None or ret != 0:
+            raise RuntimeError(f"ffmpeg failed ({' '.join(self.cmd)}) with return code {ret}: {self.error}")
+        if self.early:
+            raise RuntimeError(f"Missing frame {self.next_frame} for the movie, "
+                               f"{len(self.early)} later frames were not written.")
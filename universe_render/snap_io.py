@@ -1,14 +1,201 @@
 import numpy as np
+import glob
+import re
 
-def from_npy(filename):
+# Rows of the .npy layout used in the example, stored as ndarray([6, n_part])
+npy_columns = {"pos": slice(0, 3), "temp": 3, "rho": 4, "hsml": 5}
+
+class NpySnapshot(object):
+    def __init__(self, filename, columns=npy_columns):
+        """
+        Memory-mapped access to a snapshot in the .npy layout of the example.
+        Nothing is read until a column or a particle range is accessed.
+        filename: str
+                  the .npy file, holding ndarray([n_col, n_part]).
+        columns:  dict
+                  the row (or slice of rows) of every quantity in the file.
+        """
+        self.filename = filename
+        self.columns = columns
+        self.data = np.load(filename, mmap_mode="r")
+        self.n_part = self.data.shape[1]
+
+    def column(self, name, start=0, end=None):
+        """
+        Return a lazy view of a quantity for the particles [start, end), without copying.
+        pos is returned as ndarray([n, 3]), the others as ndarray([n, ]).
+        """
+        return self.data[self.columns[name], start:end].T
+
+    def read(self, start=0, end=None, dtype=float):
+        """
+        Read pos, hsml, rho, temp of the particles [start, end) into memory as dtype.
+        Only the bytes of these particles are touched.
+        """
+        return tuple(np.ascontiguousarray(self.column(name, start, end), dtype=dtype)
+                     for name in ("pos", "hsml", "rho", "temp"))
+
+    def chunks(self, chunk_size, start=0, end=None, dtype=float):
+        """
+        Iterate over the particles [start, end) in chunks of chunk_size.
+        Yield (ic_start, pos, hsml, rho, temp) for every chunk.
+        """
+        end = self.n_part if end is None else min(end, self.n_part)
+        for ic_start in range(start, end, chunk_size):
+            yield (ic_start, ) + self.read(ic_start, min(ic_start + chunk_size, end), dtype=dtype)
+
+def from_npy(filename, start=0, end=None):
+    """
+    This is the data format used in the example.
+    Only the particles [start, end) are read, see NpySnapshot.
+    """
+    pos, hsml, rho, temp = NpySnapshot(filename).read(start, end)
+
+    return pos, hsml, rho, temp
+
+def local_range(n_part, rank, size):
+    """
+    Return the particles [start, end) of a rank, when n_part particles are split over size ranks.
+    """
+    part_per_rank = int(n_part // size + 1)
+    return part_per_rank*rank, min(part_per_rank*(rank+1), n_part)
+
+####################
+## HDF5 Snapshots ##
+####################
+# Note: h5py is only needed for these readers and is imported when they are used.
+
+# Datasets in the Gadget/AREPO/GIZMO HDF5 layout
+hdf5_fields = {"pos": "Coordinates", "hsml": "SmoothingLength", "rho": "Density",
+               "u": "InternalEnergy", "mass": "Masses"}
+
+def hdf5_files(filename):
     """
-    This is the data format used in the example. 
+    Return the files of a snapshot. For a multi-file snapshot, any one of its files
+    (e.g. snap_000.0.hdf5) can be given, and all of snap_000.*.hdf5 are returned in order.
     """
-    data = np.load(filename).T.astype(float)
-    n_part = data.shape[0]
-    hsml = data[:,5]
-    rho = data[:,4]
-    temp = data[:,3]
-    pos = data[:,0:3]
+    m = re.match(r"(.*)\.(\d+)\.hdf5$", filename)
+    if m is None:
+        return [filename]
+    files = glob.glob(glob.escape(m.group(1)) + ".*.hdf5")
+    files = [fn for fn in files if re.match(r".*\.(\d+)\.hdf5$", fn)]
+    return sorted(files, key=lambda fn: int(fn.split(".")[-2]))
+
+class HDF5Snapshot(object):
+    def __init__(self, filename, part_type=0, fields=hdf5_fields):
+        """
+        Reader for (multi-file) HDF5 snapshots in the Gadget/AREPO/GIZMO layout.
+        Only the headers are read here; the datasets are read on demand.
+        filename:  str
+                   the snapshot file, or any file of a multi-file snapshot.
+        part_type: int
+                   the particle type to read, i.e. the group PartType{part_type}.
+        fields:    dict
+                   the dataset name of every quantity.
+        """
+        import h5py
+        self.h5py = h5py
+        self.files = hdf5_files(filename)
+        self.group = f"PartType{part_type}"
+        self.part_type = part_type
+        self.fields = fields
+
+        counts = []
+        for fn in self.files:
+            with h5py.File(fn, "r") as f:
+                if "Header" in f and "NumPart_ThisFile" in f["Header"].attrs:
+                    counts.append(int(f["Header"].attrs["NumPart_ThisFile"][part_type]))
+                elif self.group in f:
+                    counts.append(len(f[self.group][fields["pos"]]))
+                else:
+                    counts.append(0)
+        self.counts = np.array(counts, dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+        self.n_part = int(self.offsets[-1])
+
+    def _empty(self, name, dtype):
+        for fn, count in zip(self.files, self.counts):
+            if count > 0:
+                with self.h5py.File(fn, "r") as f:
+                    return np.zeros((0, ) + f[self.group][self.fields[name]].shape[1:], dtype=dtype)
+        return np.zeros(0, dtype=dtype)
+
+    def _slabs(self, start, end):
+        """
+        Return (file index, a, b) for the part of the global range [start, end) in every file.
+        """
+        slabs = []
+        for ifile in range(len(self.files)):
+            a = max(start, self.offsets[ifile]) - self.offsets[ifile]
+            b = min(end, self.offsets[ifile+1]) - self.offsets[ifile]
+            if b > a:
+                slabs.append((ifile, int(a), int(b)))
+        return slabs
+
+    def _concatenate(self, out, names, dtype):
+        return tuple(np.concatenate(out[name]).astype(dtype, copy=False) if out[name] else self._empty(name, dtype)
+                     for name in names)
+
+    def read(self, names=("pos", "hsml", "rho"), start=0, end=None, dtype=float):
+        """
+        Read the quantities of the particles [start, end), counted over all files.
+        Only the hyperslabs of the files overlapping the range are read.
+        """
+        end = self.n_part if end is None else min(end, self.n_part)
+        out = {name: [] for name in names}
+        for ifile, a, b in self._slabs(start, end):
+            with self.h5py.File(self.files[ifile], "r") as f:
+                for name in names:
+                    out[name].append(f[self.group][self.fields[name]][a:b])
+        return self._concatenate(out, names, dtype)
+
+    def read_files(self, file_ids, names=("pos", "hsml", "rho"), dtype=float):
+        """
+        Read the quantities of all particles in the given files.
+        """
+        out = {name: [] for name in names}
+        for ifile in file_ids:
+            if self.counts[ifile] == 0:
+                continue
+            with self.h5py.File(self.files[ifile], "r") as f:
+                for name in names:
+                    out[name].append(f[self.group][self.fields[name]][:])
+        return self._concatenate(out, names, dtype)
+
+    def read_local(self, comm, names=("pos", "hsml", "rho"), split="range", collective=False, dtype=float):
+        """
+        Read only the partition of this rank, for mpi_render_wrap(..., local=True).
+        comm:       MPI communicator
+        split:      "range" - the particles are split evenly by index, see local_range.
+                              Every rank reads a hyperslab of the files covering its range.
+                    "file"  - the files are distributed over the ranks round-robin.
+        collective: bool
+                    If True, read the hyperslabs with collective MPI-IO.
+                    This needs h5py built with MPI support, and split="range".
+        """
+        rank, size = comm.Get_rank(), comm.Get_size()
+        if split == "file":
+            return self.read_files(range(rank, len(self.files), size), names, dtype)
+        elif split != "range":
+            raise ValueError(f"Unknown split {split}. Use 'range' or 'file'.")
+
+        start, end = local_range(self.n_part, rank, size)
+        if not collective:
+            return self.read(names, start, end, dtype)
+
+        # collective I/O: every rank takes part in every read, possibly with an empty selection
+        out = {name: [] for name in names}
+        for ifile, fn in enumerate(self.files):
+            if self.counts[ifile] == 0:
+                continue
+            a = min(max(start - self.offsets[ifile], 0), self.counts[ifile])
+            b = min(max(end - self.offsets[ifile], 0), self.counts[ifile])
+            with self.h5py.File(fn, "r", driver="mpio", comm=comm) as f:
+                for name in names:
+                    dset = f[self.group][self.fields[name]]
+                    with dset.collective:
+                        arr = dset[int(a):int(b)]
+                    if b > a:
+                        out[name].append(arr)
+        return self._concatenate(out, names, dtype)
 
-    return pos, hsml, rho, temp
\ No newline at end of file
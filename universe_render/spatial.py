@@ -0,0 +1,162 @@
+import numpy as np
+from numba import njit
+
+#################
+## Spatial Tree ##
+#################
+# Note: The tree is built once over the particle positions and reused across frames.
+#       Every node stores the bounding box of its particles padded by their hsml,
+#       so a node can be safely discarded if its box is fully outside the frustum.
+
+@njit(cache=True)
+def _select(perm, pos, start, end, kth, axis):
+    """
+    Partially sort perm[start:end] along the axis so that perm[kth] is the median (quickselect).
+    """
+    lo, hi = start, end - 1
+    while lo < hi:
+        pivot = pos[perm[(lo + hi) // 2], axis]
+        i, j = lo, hi
+        while i <= j:
+            while pos[perm[i], axis] < pivot:
+                i += 1
+            while pos[perm[j], axis] > pivot:
+                j -= 1
+            if i <= j:
+                perm[i], perm[j] = perm[j], perm[i]
+                i += 1
+                j -= 1
+        if kth <= j:
+            hi = j
+        elif kth >= i:
+            lo = i
+        else:
+            break
+
+@njit(cache=True)
+def _build(pos, hsml, leaf_size):
+    npart = pos.shape[0]
+    perm = np.arange(npart)
+    max_node = 2 * (npart // leaf_size + 1) * 2
+    start = np.zeros(max_node, dtype=np.int64)
+    end   = np.zeros(max_node, dtype=np.int64)
+    child = -np.ones(max_node, dtype=np.int64)
+    lo    = np.zeros((max_node, 3))
+    hi    = np.zeros((max_node, 3))
+
+    start[0], end[0] = 0, npart
+    n_node = 1
+    stack = [0]
+    while len(stack) > 0:
+        inode = stack.pop()
+        i0, i1 = start[inode], end[inode]
+        if i1 - i0 <= leaf_size:
+            continue
+        # split along the longest axis at the median
+        xmin = pos[perm[i0]].copy()
+        xmax = pos[perm[i0]].copy()
+        for k in range(i0, i1):
+            for d in range(3):
+                xmin[d] = min(xmin[d], pos[perm[k], d])
+                xmax[d] = max(xmax[d], pos[perm[k], d])
+        axis = np.argmax(xmax - xmin)
+        mid = (i0 + i1) // 2
+        _select(perm, pos, i0, i1, mid, axis)
+        child[inode] = n_node
+        start[n_node], end[n_node] = i0, mid
+        start[n_node+1], end[n_node+1] = mid, i1
+        stack.append(n_node)
+        stack.append(n_node+1)
+        n_node += 2
+
+    # bounding boxes padded by hsml, children always come after their parent
+    for inode in range(n_node-1, -1, -1):
+        if child[inode] < 0:
+            for d in range(3):
+                lo[inode, d] = np.inf
+                hi[inode, d] = -np.inf
+            for k in range(start[inode], end[inode]):
+                ip = perm[k]
+                for d in range(3):
+                    lo[inode, d] = min(lo[inode, d], pos[ip, d] - 2*hsml[ip])
+                    hi[inode, d] = max(hi[inode, d], pos[ip, d] + 2*hsml[ip])
+        else:
+            c = child[inode]
+            for d in range(3):
+                lo[inode, d] = min(lo[c, d], lo[c+1, d])
+                hi[inode, d] = max(hi[c, d], hi[c+1, d])
+    return perm, start[:n_node], end[:n_node], child[:n_node], lo[:n_node], hi[:n_node]
+
+@njit(cache=True)
+def _query(planes, perm, start, end, child, lo, hi):
+    n_node = start.size
+    leaf = np.zeros(n_node, dtype=np.bool_)
+    n_out = 0
+    stack = [0]
+    while len(stack) > 0:
+        inode = stack.pop()
+        culled = False
+        for k in range(planes.shape[0]):
+            # the box corner furthest along the plane normal
+            d = planes[k, 3]
+            for a in range(3):
+                if planes[k, a] > 0:
+                    d += planes[k, a] * hi[inode, a]
+                else:
+                    d += planes[k, a] * lo[inode, a]
+            if d < 0:
+                culled = True
+                break
+        if culled:
+            continue
+        if child[inode] < 0:
+            leaf[inode] = True
+            n_out += end[inode] - start[inode]
+        else:
+            stack.append(child[inode])
+            stack.append(child[inode]+1)
+
+    idx = np.empty(n_out, dtype=np.int64)
+    n = 0
+    for inode in range(n_node):
+        if leaf[inode]:
+            for k in range(start[inode], end[inode]):
+                idx[n] = perm[k]
+                n += 1
+    return idx
+
+class ParticleTree(object):
+    def __init__(self, pos, hsml, leaf_size=256):
+        """
+        Build a k-d tree over the particles for frustum culling.
+        pos:       np.array([n_part, 3])
+                   the position of particles in the coordinate space.
+        hsml:      np.array([n_part, ])
+                   the hsml of particles. The node boxes are padded by 2*hsml.
+        leaf_size: int
+                   the maximum number of particles in a leaf node.
+        """
+        self.n_part = len(hsml)
+        self.leaf_size = leaf_size
+        pos  = np.ascontiguousarray(pos, dtype=float)
+        hsml = np.ascontiguousarray(hsml, dtype=float)
+        self.perm, self.start, self.end, self.child, self.lo, self.hi = _build(pos, hsml, leaf_size)
+
+    def query(self, c, clip_x=1, clip_y=1, sort=True, vp=None):
+        """
+        Return the indices of the particles in the leaves overlapping the frustum of camera c.
+        The selection is conservative, i.e. it still needs the mask in Camera.to_mask_clip.
+        c:      camera.Camera object
+        clip_x: float
+        clip_y: float
+                the x-y region for render, see Camera.to_mask_clip
+        sort:   bool
+                If True, the indices are returned in ascending order, so that the particles
+                are rendered in the same order as without the tree.
+        vp:     np.array([4, 4])
+                c.view_project_matrix(), if it is already computed.
+        """
+        idx = _query(c.frustum_planes(clip_x, clip_y, vp=vp), self.perm, self.start, self.end, self.child, self.lo, self.hi)
+        if sort:
+            idx.sort()
+        return idx
@@ -40,4 +40,61 @@ def cubic_spline_2D_hinv(r, hinv):
         val = 1 - 1.5 * q * q * (1 - 0.5 * q)
     return val * fac
 
-kernels = {"cubic_spline_2D":cubic_spline_2D, "cubic_spline_2D_hinv":cubic_spline_2D_hinv}
\ No newline at end of file
+kernels = {"cubic_spline_2D":cubic_spline_2D, "cubic_spline_2D_hinv":cubic_spline_2D_hinv}
+
+###################
+## Kernel Tables ##
+###################
+# Note: 1. the 2D kernels scale as W(r, h) = W(r/h, 1) / h^2, so one table of W(q, 1)
+#          serves all h. The same holds for the hinv kernels with hinv = 1/h.
+#       2. the table is indexed by q^2, so the render loop needs no sqrt per pixel.
+
+class KernelTable(object):
+    def __init__(self, sph_kernel, n_bin=4096, q_max=2.):
+        """
+        Tabulate an SPH kernel as a function of q^2 = (r/h)^2 with linear interpolation.
+        sph_kernel: function
+                    an SPH kernel in this module, taking (r, h) or (r, hinv).
+        n_bin:      int
+                    the number of bins over q^2 in [0, q_max^2].
+        q_max:      float
+                    the support of the kernel in units of h. W(q, 1) = 0 for q >= q_max.
+        """
+        self.sph_kernel = sph_kernel
+        self.n_bin = n_bin
+        self.q_max = q_max
+        self.dq2 = q_max * q_max / n_bin
+        q2 = np.arange(n_bin + 1) * self.dq2
+        # one extra zero so that the interpolation never reads out of bound
+        self.values = np.zeros(n_bin + 2)
+        self.values[:n_bin+1] = [sph_kernel(math.sqrt(x), 1.) for x in q2]
+        self.values[n_bin] = 0.
+
+    def __call__(self, r, h):
+        """
+        Evaluate the tabulated kernel at r for the given h (for checks, not for rendering).
+        """
+        q2 = (np.asarray(r, dtype=float) / h)**2
+        return np.interp(q2, np.arange(self.n_bin + 2) * self.dq2, self.values, right=0.) / h**2
+
+    def error(self, n_sample=100001):
+        """
+        Return the maximum absolute error of the table against the analytic kernel
+        over q in [0, q_max], relative to the kernel value at q = 0.
+        """
+        q = np.linspace(0, self.q_max, n_sample)
+        exact = np.array([self.sph_kernel(x, 1.) for x in q])
+        return np.max(np.abs(self(q, 1.) - exact)) / self.sph_kernel(0., 1.)
+
+kernel_tables = {}
+
+def get_kernel_table(name, **kwargs):
+    """
+    Return the table of kernels[name], with the KernelTable options kwargs. The table is built
+    at the first call and then cached per name and options, so every kernel added to kernels
+    gets a table automatically.
+    """
+    key = (name, tuple(sorted(kwargs.items())))
+    if key not in kernel_tables:
+        kernel_tables[key] = KernelTable(kernels[name], **kwargs)
+    return kernel_tables[key]